@@ -0,0 +1,43 @@
+"""
+Micro-benchmark for client secret decryption.
+
+Compares the previous behaviour (new Fernet instance on every decrypt), decrypt with a cached Fernet instance, and
+the cached 'decrypt_secret' used by the provider models.
+
+Run from the repo root:
+    python -m benchmarks.bench_crypto
+"""
+import os
+import timeit
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.project.settings')
+django.setup()
+
+from cryptography.fernet import Fernet  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+from fedauth.crypto import decrypt, decrypt_secret, encrypt  # noqa: E402
+
+ROUNDS = 20000
+
+
+def uncached_decrypt(ciphertext):
+    return Fernet(settings.SECRET_KEY).decrypt(ciphertext)
+
+
+def run():
+    ciphertext = encrypt(b'HWcI.p6WmTqCv6.OHtG3Dp0~Ep')
+    cases = [
+        ('new Fernet per decrypt (before)', lambda: uncached_decrypt(ciphertext)),
+        ('cached Fernet instance', lambda: decrypt(ciphertext)),
+        ('cached decrypted secret', lambda: decrypt_secret(ciphertext)),
+    ]
+    for name, func in cases:
+        seconds = timeit.timeit(func, number=ROUNDS)
+        print(f'{name:<35} {ROUNDS / seconds:>12,.0f} decrypts/s')
+
+
+if __name__ == '__main__':
+    run()
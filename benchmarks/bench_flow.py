@@ -0,0 +1,154 @@
+"""
+End-to-end frontend login flow: login API -> IdP (local stub) -> callback -> token exchange, for a number of providers
+and users. Reports, per request of the flow, the latency, database queries and redis operations, then the latency of
+every stage of the flow (see fedauth.metrics) and the overall throughput.
+
+Logins are made one after the other, so that the numbers are reproducible. Every user logs in '--rounds' times: the
+first round creates the users, later rounds update them. Needs the django cache (redis) configured in the test project
+settings.
+
+Run from the repo root:
+    python -m benchmarks.bench_flow [--providers 5] [--users 100] [--rounds 2] [--algorithm RS256|ES256|both] [--latency 0]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.project.settings')
+from django.conf import settings  # noqa: E402
+
+settings.DATABASES['default']['NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+django.setup()
+
+from django.core.cache import cache  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from fedauth.jwks import jwks_cache  # noqa: E402
+from fedauth.metrics import BUCKETS, get_metrics_exporter  # noqa: E402
+from tests.base import CaptureCacheOps  # noqa: E402
+from tests.factories import DynamicProviderFactory  # noqa: E402
+from tests.stub_idp import StubIdP  # noqa: E402
+
+FRONTEND = 'https://app.company.com'
+REQUESTS = ('login', 'callback', 'exchange')
+
+
+class Recorder:
+    """
+    Latency, queries and redis operations of every request of the flow.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)  # request -> [(seconds, queries, cache ops)]
+
+    def request(self, name, send):
+        with CaptureQueriesContext(connection) as queries, CaptureCacheOps() as cache_ops:
+            start = time.perf_counter()
+            response = send()
+            seconds = time.perf_counter() - start
+        self.samples[name].append((seconds, len(queries), len(cache_ops)))
+        return response
+
+    def report(self):
+        print(f"{'request':<12} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'queries':>8} {'cache ops':>10}")
+        for name in REQUESTS:
+            seconds, queries, cache_ops = zip(*self.samples[name])
+            millis = sorted(value * 1000 for value in seconds)
+            p95 = statistics.quantiles(millis, n=20)[-1] if len(millis) > 1 else millis[0]
+            print(
+                f'{name:<12} {statistics.median(millis):>8.2f} {p95:>8.2f} {millis[-1]:>8.2f} '
+                f'{statistics.mean(queries):>8.1f} {statistics.mean(cache_ops):>10.1f}'
+            )
+
+
+def login(client, idp, recorder, email):
+    """
+    One frontend login. Returns True if it ended with a pair of jwt tokens.
+    """
+    query = urlencode({'next': FRONTEND, 'fail': f'{FRONTEND}/fail/'})
+    resp = recorder.request('login', lambda: client.post(f"{reverse('oidc-provider-login')}?{query}", {'username': email}))
+    params = parse_qs(urlparse(resp.json()['auth_url']).query)
+
+    # the user logs in at the IdP, which redirects back to the callback
+    code = idp.authorize({'email': email, 'given_name': 'Jane', 'family_name': 'Doe', 'groups': []}, params['nonce'][0])
+    callback = f"{reverse('oidc-provider-callback')}?code={code}&state={params['state'][0]}"
+    resp = recorder.request('callback', lambda: client.get(callback))
+    if not resp.url.startswith(f'{FRONTEND}?code='):
+        return False
+
+    code = parse_qs(urlparse(resp.url).query)['code'][0]
+    resp = recorder.request('exchange', lambda: client.post(reverse('token-exchange'), {'code': code}))
+    return resp.status_code == 200
+
+
+def report_stages():
+    print(f"{'stage':<16} {'count':>6} {'mean ms':>8} {'slowest bucket':>15}")
+    totals = defaultdict(lambda: [0, 0.0, [0] * (len(BUCKETS) + 1)])
+    for (stage, _provider, _outcome), histogram in get_metrics_exporter().snapshot().items():
+        total = totals[stage]
+        total[0] += histogram['count']
+        total[1] += histogram['sum']
+        total[2] = [a + b for a, b in zip(total[2], histogram['buckets'])]
+    for stage, (count, seconds, buckets) in sorted(totals.items()):
+        slowest = max(index for index, value in enumerate(buckets) if value)
+        bound = f'<= {BUCKETS[slowest] * 1000:g}ms' if slowest < len(BUCKETS) else f'> {BUCKETS[-1]:g}s'
+        print(f'{stage:<16} {count:>6} {seconds / count * 1000:>8.2f} {bound:>15}')
+
+
+def run_algorithm(algorithm, args):
+    jwks_cache.clear()
+    get_metrics_exporter().clear()
+    with StubIdP(latency=args.latency, algorithm=algorithm) as idp:
+        domains = [f'tenant{i}.com' for i in range(args.providers)]
+        for domain in domains:
+            DynamicProviderFactory(domain=domain, **idp.provider_fields())
+        emails = [f'user{i}@{domains[i % len(domains)]}' for i in range(args.users)]
+
+        recorder, failed = Recorder(), 0
+        client = Client()
+        start = time.perf_counter()
+        for _round in range(args.rounds):
+            for email in emails:
+                failed += not login(client, idp, recorder, email)
+        seconds = time.perf_counter() - start
+
+    logins = args.users * args.rounds
+    print(f'\n{algorithm}: {args.providers} providers, {args.users} users, {args.rounds} rounds, IdP latency {args.latency * 1000:.0f}ms')
+    recorder.report()
+    print()
+    report_stages()
+    print(f'\n{logins / seconds:,.1f} logins/s ({logins} logins in {seconds:.2f}s, {failed} failed)')
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--providers', type=int, default=5)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=2, help='logins per user (the first one creates the user)')
+    parser.add_argument('--algorithm', choices=['RS256', 'ES256', 'both'], default='both', help='ID token signing algorithm')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every IdP response')
+    args = parser.parse_args()
+
+    call_command('migrate', verbosity=0)
+    with override_settings(
+        AUTHENTICATION_BACKENDS=['fedauth.backends.OIDCAuthenticationBackend'],
+        OIDC_REDIRECT_ALLOWED_HOSTS=[urlparse(FRONTEND).netloc],
+    ):
+        for algorithm in (['RS256', 'ES256'] if args.algorithm == 'both' else [args.algorithm]):
+            call_command('flush', interactive=False, verbosity=0)
+            cache.clear()
+            run_algorithm(algorithm, args)
+
+
+if __name__ == '__main__':
+    run()
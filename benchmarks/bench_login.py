@@ -0,0 +1,116 @@
+"""
+Concurrent login throughput of the sync and async callback views, against a local stub IdP that adds a fixed latency
+to every response (to simulate the round trip to a remote IdP).
+
+The sync view is served by a pool of worker threads (like a threaded WSGI server), the async view by a single event
+loop (like one ASGI worker). The stub IdP runs in a separate process. Needs the django cache (redis) configured in the test project settings.
+
+Run from the repo root:
+    python -m benchmarks.bench_login [--logins 200] [--threads 8] [--latency 0.05]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.project.settings')
+from django.conf import settings  # noqa: E402
+
+# threads need a shared database, so use a file instead of sqlite's in-memory database
+settings.DATABASES['default']['NAME'] = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.db.backends.signals import connection_created  # noqa: E402
+from django.test import AsyncClient, Client, override_settings  # noqa: E402
+from django.urls import reverse  # noqa: E402
+
+from tests.base import start_login  # noqa: E402
+from tests.factories import DynamicProviderFactory  # noqa: E402
+from tests.stub_idp import StubIdP  # noqa: E402
+
+
+def tune_sqlite(connection, **kwargs):
+    # don't wait for the disk on every commit, the database would otherwise be the bottleneck
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=OFF')
+
+
+connection_created.connect(tune_sqlite)
+
+
+def start_logins(idp, count):
+    """
+    Store the login contexts that the login view would have stored, and the IdP auth codes. Returns callback query strings.
+    """
+    queries = []
+    for i in range(count):
+        state, nonce = start_login()
+        code = idp.authorize({'email': f'user{i}@company.com', 'groups': []}, nonce)
+        queries.append(f'?code={code}&state={state}')
+    return queries
+
+
+def run_sync(idp, logins, threads):
+    url = reverse('oidc-provider-callback')
+    queries = start_logins(idp, logins)
+    with override_settings(
+        AUTHENTICATION_BACKENDS=['fedauth.backends.OIDCAuthenticationBackend'],
+        OIDC_AUTHENTICATION_CALLBACK_URL='oidc-provider-callback',
+    ):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            responses = list(pool.map(lambda query: Client().get(url + query), queries))
+        seconds = time.perf_counter() - start
+    return seconds, responses
+
+
+def run_async(idp, logins):
+    url = reverse('oidc-provider-callback-async')
+    queries = start_logins(idp, logins)
+
+    async def login_all():
+        return await asyncio.gather(*(AsyncClient().get(url + query) for query in queries))
+
+    with override_settings(
+        AUTHENTICATION_BACKENDS=['fedauth.backends.AsyncOIDCAuthenticationBackend'],
+        OIDC_AUTHENTICATION_CALLBACK_URL='oidc-provider-callback-async',
+    ):
+        start = time.perf_counter()
+        responses = asyncio.run(login_all())
+        seconds = time.perf_counter() - start
+    return seconds, responses
+
+
+def report(name, logins, seconds, responses):
+    # LOGIN_REDIRECT_URL and LOGIN_REDIRECT_URL_FAILURE are the same in the test project, so check the session
+    failed = sum(1 for response in responses if response.status_code != 302 or '_auth_user_id' not in response.client.session)
+    print(f'{name:<30} {logins / seconds:>8,.1f} logins/s  ({seconds:.2f}s, {failed} failed)')
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8, help='worker threads serving the sync view')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every IdP response')
+    parser.add_argument('--pool-size', type=int, default=16, help='max connections to the IdP (http_pool_size)')
+    args = parser.parse_args()
+
+    call_command('migrate', verbosity=0)
+    idp = StubIdP(latency=args.latency).start_process()
+    try:
+        DynamicProviderFactory(domain='company.com', http_pool_size=args.pool_size, **idp.provider_fields())
+        print(f'{args.logins} logins, IdP latency {args.latency * 1000:.0f}ms')
+        report(f'sync ({args.threads} threads)', args.logins, *run_sync(idp, args.logins, args.threads))
+        report('async (1 event loop)', args.logins, *run_async(idp, args.logins))
+    finally:
+        idp.stop()
+
+
+if __name__ == '__main__':
+    run()
@@ -23,6 +23,7 @@ class DynamicProviderAdmin(admin.ModelAdmin):
         'created_at',
         'updated_at',
         'domain',
+        'issuer',
         'auth_endpoint',
         'token_endpoint',
         'user_endpoint',
@@ -30,6 +31,10 @@ class DynamicProviderAdmin(admin.ModelAdmin):
         'client_id',
         'sign_algo',
         'scopes',
+        'http_timeout',
+        'http_pool_size',
+        'http_retries',
+        'use_id_token_claims',
     )
     add_fields = ('client_secret',)
 
@@ -59,6 +64,7 @@ class StaticProviderAdmin(admin.ModelAdmin):
         'created_at',
         'updated_at',
         'provider',
+        'issuer',
         'auth_endpoint',
         'token_endpoint',
         'user_endpoint',
@@ -66,6 +72,10 @@ class StaticProviderAdmin(admin.ModelAdmin):
         'client_id',
         'sign_algo',
         'scopes',
+        'http_timeout',
+        'http_pool_size',
+        'http_retries',
+        'use_id_token_claims',
     )
     add_fields = ('client_secret',)
 
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class FedauthConfig(AppConfig):
+    name = 'fedauth'
+
+    def ready(self):
+        from fedauth import signals  # noqa: F401 (connects provider signal handlers)
@@ -1,17 +1,32 @@
+import asyncio
+import inspect
 import logging
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.contrib.auth import get_user_model
-from django.core.exceptions import ValidationError, ImproperlyConfigured
+from django.contrib.auth import get_user_model, load_backend
+from django.core.exceptions import ValidationError, ImproperlyConfigured, PermissionDenied, SuspiciousOperation
+from django.db import IntegrityError, transaction
+from django.urls import reverse
 from mozilla_django_oidc.auth import OIDCAuthenticationBackend as DefaultOidcAuthBackend
+from mozilla_django_oidc.utils import absolutify
+from requests import HTTPError
+from requests.auth import HTTPBasicAuth
 
+from fedauth.http import get_async_client, get_session
+from fedauth.jwks import jwks_cache
+from fedauth.metrics import get_provider_label, measure
 from fedauth.mixins import AuthBackendSettingsMixin
+from fedauth.tracing import span
 from fedauth.validators import validate_phone
 
 LOGGER = logging.getLogger(__name__)
 
 UserModel = get_user_model()
 
+# claims used by 'update_user'
+USER_CLAIMS = ('email', 'given_name', 'family_name', 'groups') + (('phone_number',) if hasattr(UserModel, 'phone') else ())
+
 
 class OIDCAuthenticationBackend(AuthBackendSettingsMixin, DefaultOidcAuthBackend):
     """
@@ -21,6 +36,7 @@ class OIDCAuthenticationBackend(AuthBackendSettingsMixin, DefaultOidcAuthBackend
     domain = None
     provider = None
     request = None
+    metric_provider = ''  # provider label of the metrics (the provider can't be found anymore once the user is found)
 
     def __init__(self, *args, **kwargs):
         # Don't call super '__init__' here, as it tries to set class variables before
@@ -38,6 +54,7 @@ class OIDCAuthenticationBackend(AuthBackendSettingsMixin, DefaultOidcAuthBackend
         self.OIDC_RP_CLIENT_SECRET = self.get_settings("OIDC_RP_CLIENT_SECRET")
         self.OIDC_RP_SIGN_ALGO = self.get_settings("OIDC_RP_SIGN_ALGO", "HS256")
         self.OIDC_RP_IDP_SIGN_KEY = self.get_settings("OIDC_RP_IDP_SIGN_KEY", None)
+        self.metric_provider = get_provider_label(self.get_provider())
 
         if (
                 self.OIDC_RP_SIGN_ALGO.startswith("RS") or self.OIDC_RP_SIGN_ALGO.startswith("ES")
@@ -59,6 +76,125 @@ class OIDCAuthenticationBackend(AuthBackendSettingsMixin, DefaultOidcAuthBackend
         self.configure_oidc_settings()
         return super().authenticate(request, **kwargs)
 
+    def get_request_kwargs(self):
+        return {
+            'verify': self.get_settings("OIDC_VERIFY_SSL", True),
+            'timeout': self.get_settings("OIDC_TIMEOUT", None),
+            'proxies': self.get_settings("OIDC_PROXY", None),
+        }
+
+    def get_http_session(self):
+        # pooled session per provider, so that connections to the IdP are reused between logins
+        return get_session(self.get_provider())
+
+    def get_jwks_fetch(self):
+        session, kwargs, provider = self.get_http_session(), self.get_request_kwargs(), self.metric_provider
+
+        def fetch(url):
+            with measure('jwks', provider), span('fedauth.idp.jwks', provider):
+                return session.get(url, **kwargs)
+        return fetch
+
+    def retrieve_matching_jwk(self, token):
+        """
+        Same as mozilla's implementation, but the JWKS endpoint response is cached (see JWKSCache), instead of fetched
+        on every token verification.
+        """
+        return jwks_cache.get_signing_key(self.OIDC_OP_JWKS_ENDPOINT, token, self.get_jwks_fetch())
+
+    def should_prefetch_jwks(self):
+        # keys are only needed for RS/ES tokens without a configured key, and only fetched if they aren't cached
+        if not self.OIDC_RP_SIGN_ALGO.startswith(("RS", "ES")) or self.OIDC_RP_IDP_SIGN_KEY is not None:
+            return False
+        return self.OIDC_OP_JWKS_ENDPOINT is not None and not jwks_cache.has_key_set(self.OIDC_OP_JWKS_ENDPOINT)
+
+    def prefetch_jwks(self):
+        """
+        Start fetching the IdP's signing keys in the background, so that they arrive while we wait for the token,
+        instead of being fetched after it. The token verification waits for the fetch (see JWKSCache.refresh).
+        """
+        if self.should_prefetch_jwks():
+            jwks_cache.refresh_in_background(self.OIDC_OP_JWKS_ENDPOINT, self.get_jwks_fetch())
+
+    def get_token(self, payload):
+        """
+        Same as mozilla's implementation, but using the provider's pooled HTTP session, and with the JWKS fetched at
+        the same time.
+        """
+        self.prefetch_jwks()
+        auth = None
+        if self.get_settings("OIDC_TOKEN_USE_BASIC_AUTH", False):
+            # When Basic auth is defined, create the Auth Header and remove secret from payload.
+            auth = HTTPBasicAuth(payload.get("client_id"), payload.get("client_secret"))
+            del payload["client_secret"]
+
+        with measure('token', self.metric_provider), span('fedauth.idp.token', self.metric_provider):
+            response = self.get_http_session().post(
+                self.OIDC_OP_TOKEN_ENDPOINT,
+                data=payload,
+                auth=auth,
+                **self.get_request_kwargs(),
+            )
+            self.raise_token_response_error(response)
+            return response.json()
+
+    def get_userinfo(self, access_token, id_token, payload):
+        """
+        Same as mozilla's implementation, but using the provider's pooled HTTP session.
+        """
+        with measure('userinfo', self.metric_provider), span('fedauth.idp.userinfo', self.metric_provider):
+            user_response = self.get_http_session().get(
+                self.OIDC_OP_USER_ENDPOINT,
+                headers={"Authorization": "Bearer {0}".format(access_token)},
+                **self.get_request_kwargs(),
+            )
+            user_response.raise_for_status()
+
+        if user_response.headers.get("content-type", "").lower().startswith("application/jwt"):
+            # OIDC userinfo claims can be encoded as JWT
+            return self.verify_token(user_response.text)
+        return user_response.json()
+
+    def get_id_token_claims(self, payload):
+        """
+        Return the verified ID token payload as the user's claims, if the provider is set to use ID token claims and
+        the token has all claims that 'update_user' uses. Returns None if the userinfo endpoint has to be called.
+        """
+        provider = self.get_provider()
+        if provider is None or not provider.use_id_token_claims:
+            return None
+        if all(claim in payload for claim in USER_CLAIMS):
+            return payload
+        return None
+
+    def get_or_create_user(self, access_token, id_token, payload):
+        user_info = self.get_id_token_claims(payload) or self.get_userinfo(access_token, id_token, payload)
+        return self.get_or_create_user_from_claims(user_info)
+
+    def get_or_create_user_from_claims(self, claims):
+        """
+        Same as the second half of mozilla's 'get_or_create_user' (after the userinfo request), so that it can be
+        shared with the async backend.
+        """
+        if not self.verify_claims(claims):
+            raise SuspiciousOperation("Claims verification failed")
+
+        # email based filtering
+        users = self.filter_users_by_claims(claims)
+
+        if len(users) == 1:
+            return self.update_user(users[0], claims)
+        elif len(users) > 1:
+            # In the rare case that two user accounts have the same email address, bail.
+            raise SuspiciousOperation("Multiple users returned")
+        elif self.get_settings("OIDC_CREATE_USER", True):
+            return self.create_user(claims)
+        LOGGER.debug(
+            "Login failed: No user with %s found, and OIDC_CREATE_USER is False",
+            self.describe_user_by_claims(claims),
+        )
+        return None
+
     def filter_users_by_claims(self, claims):
         # clear session of values that is not needed anymore, since user is already authenticated at this point.
         self.request.session.pop('domain', None)
@@ -71,15 +207,31 @@ class OIDCAuthenticationBackend(AuthBackendSettingsMixin, DefaultOidcAuthBackend
         return claims['email']
 
     def create_user(self, claims):
-        user: UserModel = super(OIDCAuthenticationBackend, self).create_user(claims)
-        return self.update_user(user, claims)
+        """
+        Create the user with all claim fields set, in a single INSERT. If a concurrent login of the same user created
+        it first (e.g. a double submit), the existing user is updated instead.
+        """
+        username = self.get_username(claims)
+        try:
+            with measure('user_create', self.metric_provider), transaction.atomic():
+                return self.UserModel.objects.create_user(
+                    username, email=claims.get('email'), **self.get_user_values(claims)
+                )
+        except IntegrityError:
+            user = self.UserModel._default_manager.get_by_natural_key(username)
+            return self.update_user(user, claims)
 
-    def update_user(self, user, claims):
-        # set user details from claims
-        user.first_name = claims.get('given_name', '')
-        user.last_name = claims.get('family_name', '')
-        user.is_superuser = getattr(settings, "OIDC_SUPER_GROUP") in claims.get("groups", [])
-        user.is_staff = getattr(settings, "OIDC_ADMIN_GROUP") in claims.get("groups", [])
+    @staticmethod
+    def get_user_values(claims) -> dict:
+        """
+        User field values from claims. Claims returned from the idP are the source of truth for these fields.
+        """
+        values = {
+            'first_name': claims.get('given_name', ''),
+            'last_name': claims.get('family_name', ''),
+            'is_superuser': getattr(settings, "OIDC_SUPER_GROUP") in claims.get("groups", []),
+            'is_staff': getattr(settings, "OIDC_ADMIN_GROUP") in claims.get("groups", []),
+        }
 
         phone_number: str = claims.get('phone_number', '')
         if phone_number and hasattr(UserModel, 'phone'):  # TODO: make phone number field customizable.
@@ -89,7 +241,160 @@ class OIDCAuthenticationBackend(AuthBackendSettingsMixin, DefaultOidcAuthBackend
             except ValidationError:
                 LOGGER.info(f"Invalid phone number: {phone_number}")
             else:
-                user.phone = phone_number
+                values['phone'] = phone_number
+        return values
 
-        user.save()
+    def update_user(self, user, claims):
+        # set user details from claims, and only write the fields that changed (nothing, for most logins)
+        with measure('user_update', self.metric_provider) as metric:
+            changed = []
+            for field, value in self.get_user_values(claims).items():
+                if getattr(user, field) != value:
+                    setattr(user, field, value)
+                    changed.append(field)
+            if changed:
+                user.save(update_fields=changed)
+            else:
+                metric.outcome = 'unchanged'
+        return user
+
+
+class AsyncOIDCAuthenticationBackend(OIDCAuthenticationBackend):
+    """
+    Backend with an async 'aauthenticate' method, used by the async callback view (ASGI deployments).
+    The token and userinfo requests are made with httpx, so the event loop can serve other requests while waiting for
+    the IdP. Database and session access still runs in django's sync thread (sync_to_async).
+    """
+
+    def get_async_client(self):
+        return get_async_client(
+            self.get_provider(),
+            verify=self.get_settings("OIDC_VERIFY_SSL", True),
+            proxies=self.get_settings("OIDC_PROXY", None),
+        )
+
+    def get_token_payload(self, code, code_verifier=None):
+        reverse_url = self.get_settings("OIDC_AUTHENTICATION_CALLBACK_URL", "oidc_authentication_callback")
+        payload = {
+            "client_id": self.OIDC_RP_CLIENT_ID,
+            "client_secret": self.OIDC_RP_CLIENT_SECRET,
+            "grant_type": "authorization_code",
+            "code": code,
+            "redirect_uri": absolutify(self.request, reverse(reverse_url)),
+        }
+        # Send code_verifier with token request if using PKCE
+        if code_verifier is not None:
+            payload["code_verifier"] = code_verifier
+        return payload
+
+    async def aget_token(self, payload):
+        auth = None
+        if self.get_settings("OIDC_TOKEN_USE_BASIC_AUTH", False):
+            auth = (payload.get("client_id"), payload.pop("client_secret"))
+
+        with measure('token', self.metric_provider), span('fedauth.idp.token', self.metric_provider):
+            response = await self.get_async_client().post(
+                self.OIDC_OP_TOKEN_ENDPOINT,
+                data=payload,
+                auth=auth,
+                timeout=self.get_settings("OIDC_TIMEOUT", None),
+            )
+            self.raise_token_response_error(response)
+            return response.json()
+
+    async def aprefetch_jwks(self):
+        if not self.should_prefetch_jwks():
+            return
+        try:
+            await sync_to_async(jwks_cache.get_key_set, thread_sensitive=False)(
+                self.OIDC_OP_JWKS_ENDPOINT, self.get_jwks_fetch()
+            )
+        except Exception as exc:  # the token verification fetches the keys again, and raises
+            LOGGER.warning('JWKS prefetch for %s failed: %s', self.OIDC_OP_JWKS_ENDPOINT, exc)
+
+    async def aget_userinfo(self, access_token, id_token, payload):
+        with measure('userinfo', self.metric_provider), span('fedauth.idp.userinfo', self.metric_provider):
+            user_response = await self.get_async_client().get(
+                self.OIDC_OP_USER_ENDPOINT,
+                headers={"Authorization": "Bearer {0}".format(access_token)},
+                timeout=self.get_settings("OIDC_TIMEOUT", None),
+            )
+            if user_response.is_error:
+                # same exception as the sync backend ('requests' raise_for_status), instead of httpx.HTTPStatusError
+                raise HTTPError(
+                    f'{user_response.status_code} Error: {user_response.reason_phrase} for url: {user_response.url}',
+                    response=user_response,
+                )
+
+        if user_response.headers.get("content-type", "").lower().startswith("application/jwt"):
+            return await sync_to_async(self.verify_token, thread_sensitive=False)(user_response.text)
+        return user_response.json()
+
+    async def aauthenticate(self, request, nonce=None, code_verifier=None, **kwargs):
+        """
+        Async version of mozilla's 'authenticate'.
+        """
+        self.request = request
+        if not self.request:
+            return None
+
+        state = self.request.GET.get("state")
+        code = self.request.GET.get("code")
+        if not code or not state:
+            return None
+
+        # loads the provider (and the session, if it isn't loaded yet)
+        await sync_to_async(self.configure_oidc_settings)()
+
+        # fetch the signing keys (if they aren't cached) at the same time as the token
+        token_info, _ = await asyncio.gather(
+            self.aget_token(self.get_token_payload(code, code_verifier)), self.aprefetch_jwks()
+        )
+        id_token = token_info.get("id_token")
+        access_token = token_info.get("access_token")
+
+        # no db access, but might have to fetch the JWKS (with the blocking client), so don't tie up the sync thread
+        payload = await sync_to_async(self.verify_token, thread_sensitive=False)(id_token, nonce=nonce)
+        if not payload:
+            return None
+
+        try:
+            user_info = self.get_id_token_claims(payload) or await self.aget_userinfo(access_token, id_token, payload)
+            return await sync_to_async(self.finish_authentication)(access_token, id_token, user_info)
+        except SuspiciousOperation as exc:
+            LOGGER.warning("failed to get or create user: %s", exc)
+            return None
+
+    def finish_authentication(self, access_token, id_token, user_info):
+        # the session and db work of a login, in one sync_to_async call
+        self.store_tokens(access_token, id_token)
+        return self.get_or_create_user_from_claims(user_info)
+
+
+async def aauthenticate(request, **credentials):
+    """
+    Async version of django's 'authenticate' (only available from django 5.0). Backends without an 'aauthenticate'
+    method are run with sync_to_async.
+    """
+    for backend_path in settings.AUTHENTICATION_BACKENDS:
+        backend = load_backend(backend_path)
+        authenticate = getattr(backend, 'aauthenticate', backend.authenticate)
+        try:
+            inspect.signature(authenticate).bind(request, **credentials)
+        except TypeError:
+            # This backend doesn't accept these credentials as arguments. Try the next one.
+            continue
+        try:
+            if hasattr(backend, 'aauthenticate'):
+                user = await backend.aauthenticate(request, **credentials)
+            else:
+                user = await sync_to_async(backend.authenticate)(request, **credentials)
+        except PermissionDenied:
+            # This backend says to stop in our tracks - this user should not be allowed in at all.
+            return None
+        if user is None:
+            continue
+        # Annotate the user object with the path of the backend.
+        user.backend = backend_path
         return user
+    return None
@@ -2,7 +2,8 @@ from django.contrib.auth.backends import UserModel
 from django.core.exceptions import ImproperlyConfigured
 from mozilla_django_oidc.utils import import_from_settings
 
-from fedauth.utils import get_static_provider_settings, get_dynamic_provider_settings
+from fedauth.models import DynamicProvider
+from fedauth.utils import get_provider_config, find_dynamic_provider, get_static_provider
 
 
 class ViewBase:
@@ -11,6 +12,7 @@ class ViewBase:
     """
     OIDC_OP_AUTH_ENDPOINT = None
     OIDC_RP_CLIENT_ID = None
+    _provider = None  # provider object is loaded once per request, and reused for every setting lookup
 
     def get_improper_config_err(self, attr):
         raise NotImplementedError()
@@ -41,6 +43,14 @@ class DynamicViewBase(ViewBase):
     def get_improper_config_err(self, attr):
         return f"Setting {attr} not found for provider with domain '{self.domain}'"
 
+    def get_provider(self, domain):
+        if self._provider is None or self.domain != domain:
+            provider = find_dynamic_provider(domain)
+            if provider is None:
+                raise DynamicProvider.DoesNotExist(f"No provider found for domain '{domain}'")
+            self._provider = provider
+        return self._provider
+
     def get_model_config(self, attr, *args):
         username = self.kwargs.get(UserModel.USERNAME_FIELD, None)
         if username is None:
@@ -50,8 +60,9 @@ class DynamicViewBase(ViewBase):
             )
 
         domain = username.split('@')[-1]
+        provider = self.get_provider(domain)
         self.domain = domain
-        return get_dynamic_provider_settings(attr, domain, *args)
+        return get_provider_config(provider, attr, *args)
 
 
 class StaticViewBase(ViewBase):
@@ -64,5 +75,10 @@ class StaticViewBase(ViewBase):
     def get_improper_config_err(self, attr):
         return f"Setting {attr} not found for provider: '{self.alias}'"
 
+    def get_provider(self):
+        if self._provider is None or self._provider.provider != self.alias:
+            self._provider = get_static_provider(self.alias)
+        return self._provider
+
     def get_model_config(self, attr, *args):
-        return get_static_provider_settings(attr, self.alias, *args)
+        return get_provider_config(self.get_provider(), attr, *args)
@@ -0,0 +1,214 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django_redis.cache import RedisCache
+from mozilla_django_oidc.utils import import_from_settings
+from redis.exceptions import ResponseError
+
+PROVIDERS_VERSION_KEY = 'fedauth:providers:version'
+
+
+class TTLCache:
+    """
+    Small thread-safe in-process cache, with LRU eviction and a per entry timeout.
+    A timeout of None means that the entry only leaves the cache when it is evicted or cleared.
+    """
+
+    def __init__(self, maxsize=1024, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires_at, value = self._data[key]
+            except KeyError:
+                return default
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        expires_at = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class ProviderVersion:
+    """
+    Version number that moves every time a provider row changes. In-process caches derived from provider rows remember
+    the version they were built with, and are discarded when the version moved.
+
+    With FEDAUTH_PROVIDER_CACHE_BROADCAST enabled, a second counter is kept in the django cache, so that a change made
+    on one worker is picked up by all the others. The shared counter is polled at most once every
+    FEDAUTH_PROVIDER_CACHE_BROADCAST_INTERVAL seconds, to keep the cache round trips off the hot path.
+    """
+
+    def __init__(self):
+        self._local = 0
+        self._shared = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def broadcast_enabled():
+        return import_from_settings('FEDAUTH_PROVIDER_CACHE_BROADCAST', False)
+
+    def current(self):
+        if not self.broadcast_enabled():
+            return self._local
+        interval = import_from_settings('FEDAUTH_PROVIDER_CACHE_BROADCAST_INTERVAL', 5)
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= interval:
+            self._shared = cache.get(PROVIDERS_VERSION_KEY, 0)
+            self._checked_at = now
+        return self._local, self._shared
+
+    def bump(self, shared=False):
+        """
+        :param shared: also move the shared counter when broadcasting is disabled (for changes made outside the workers)
+        """
+        with self._lock:
+            self._local += 1
+        if shared or self.broadcast_enabled():
+            cache.add(PROVIDERS_VERSION_KEY, 0, timeout=None)
+            try:
+                cache.incr(PROVIDERS_VERSION_KEY)
+            except ValueError:  # key was evicted between 'add' and 'incr'
+                cache.set(PROVIDERS_VERSION_KEY, 1, timeout=None)
+            self._checked_at = None  # force a re-read on the next lookup
+
+
+provider_version = ProviderVersion()
+provider_cache = TTLCache(maxsize=import_from_settings('FEDAUTH_PROVIDER_CACHE_SIZE', 1024))
+
+
+def invalidate_providers(shared=False):
+    """
+    Drop all cached provider data. Called whenever a provider row is saved or deleted.
+    :param shared: also publish the change in the django cache when FEDAUTH_PROVIDER_CACHE_BROADCAST is disabled, so
+        that workers that do broadcast pick it up (e.g. after a management command)
+    """
+    provider_version.bump(shared)
+    provider_cache.clear()
+
+
+def get_or_load(key, loader):
+    """
+    Return provider derived data from the process wide provider cache, or load and cache it. Data is kept for
+    FEDAUTH_PROVIDER_CACHE_TIMEOUT seconds (0 disables the cache). Entries are tagged with the provider version they were
+    loaded at, so that data loaded while a provider was being changed is never served after the change.
+    """
+    timeout = import_from_settings('FEDAUTH_PROVIDER_CACHE_TIMEOUT', 300)
+    if not timeout:
+        return loader()
+
+    version = provider_version.current()
+    cached = provider_cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    value = loader()
+    provider_cache.set(key, (version, value), timeout)
+    return value
+
+
+def _redis_pop(client, key):
+    """
+    GET and DELETE in a single round trip. GETDEL needs Redis 6.2, older servers get the same in a MULTI transaction.
+    """
+    key = client.make_key(key)
+    redis = client.get_client(write=True)
+    try:
+        value = redis.getdel(key)
+    except ResponseError:
+        pipeline = redis.pipeline(transaction=True)
+        pipeline.get(key)
+        pipeline.delete(key)
+        value = pipeline.execute()[0]
+    return None if value is None else client.decode(value)
+
+
+def _redis_pop_many(client, keys):
+    keys = [client.make_key(key) for key in keys]
+    redis = client.get_client(write=True)
+    pipeline = redis.pipeline(transaction=False)  # every GETDEL is atomic on its own
+    for key in keys:
+        pipeline.getdel(key)
+    try:
+        values = pipeline.execute()
+    except ResponseError:  # redis < 6.2, see '_redis_pop'
+        pipeline = redis.pipeline(transaction=True)
+        for key in keys:
+            pipeline.get(key)
+            pipeline.delete(key)
+        values = pipeline.execute()[::2]
+    return [None if value is None else client.decode(value) for value in values]
+
+
+def cache_pop(key, default=None):
+    """
+    Return the cached value of a key and remove it, atomically: when several requests pop the same key at the same
+    time, only one of them gets the value. Used for single use values (e.g. auth codes).
+
+    With django-redis this is a single GETDEL. Other cache backends take a short lock with 'cache.add' (which only
+    succeeds for one caller), so they cost a few more round trips.
+    """
+    backend = caches[DEFAULT_CACHE_ALIAS]  # 'cache' is a proxy, so it can't be type checked
+    if isinstance(backend, RedisCache):
+        try:
+            value = _redis_pop(backend.client, key)
+        except NotImplementedError:  # sharded client, no single connection to run the command on
+            pass
+        else:
+            return default if value is None else value
+
+    lock_key = f'{key}:pop-lock'
+    if not cache.add(lock_key, 1, timeout=import_from_settings('FEDAUTH_CACHE_POP_LOCK_TIMEOUT', 10)):
+        return default  # another request is popping the key
+    try:
+        value = cache.get(key)
+        if value is not None:
+            cache.delete(key)
+    finally:
+        cache.delete(lock_key)
+    return default if value is None else value
+
+
+def cache_pop_many(keys) -> dict:
+    """
+    'cache_pop' for several keys. Returns a dict with the values of the keys that were found. With django-redis the
+    GETDELs are sent in a single pipeline (one round trip), other cache backends pop the keys one by one.
+    """
+    backend = caches[DEFAULT_CACHE_ALIAS]
+    if isinstance(backend, RedisCache):
+        try:
+            values = _redis_pop_many(backend.client, keys)
+        except NotImplementedError:
+            pass
+        else:
+            return {key: value for key, value in zip(keys, values) if value is not None}
+
+    values = {key: cache_pop(key) for key in keys}
+    return {key: value for key, value in values.items() if value is not None}
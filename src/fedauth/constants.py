@@ -7,5 +7,6 @@ SETTINGS_MAP = {
     'OIDC_RP_CLIENT_ID': 'client_id',
     'OIDC_RP_CLIENT_SECRET': 'client_secret',
     'OIDC_RP_SIGN_ALGO': 'sign_algo',
-    'OIDC_RP_SCOPES': 'scopes'
+    'OIDC_RP_SCOPES': 'scopes',
+    'OIDC_TIMEOUT': 'http_timeout',
 }
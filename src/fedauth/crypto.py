@@ -1,6 +1,12 @@
-from cryptography.fernet import Fernet
+import hashlib
+from functools import lru_cache
+
+from cryptography.fernet import Fernet, MultiFernet
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from mozilla_django_oidc.utils import import_from_settings
 
+from fedauth.cache import TTLCache
 
 SIGN_ALGOS = [
     ('HS256', 'HS256'),
@@ -8,17 +14,52 @@ SIGN_ALGOS = [
     ('ES256', 'ES256'),
 ]
 
+# decrypted client secrets, keyed by key and ciphertext hash (see 'decrypt_secret')
+secret_cache = TTLCache(maxsize=import_from_settings('FEDAUTH_SECRET_CACHE_SIZE', 1024))
+
+
+@lru_cache(maxsize=16)
+def get_fernet(key: str | bytes) -> Fernet:
+    """
+    Building a Fernet instance parses and splits the key every time, so instances are cached per key.
+    """
+    return Fernet(key)
+
+
+@lru_cache(maxsize=16)
+def get_multi_fernet(keys: tuple[str | bytes, ...]) -> MultiFernet:
+    return MultiFernet([get_fernet(key) for key in keys])
+
+
+def get_encryption_keys() -> tuple[str | bytes, ...]:
+    """
+    Keys used to encrypt provider secrets. The first key in FEDAUTH_ENCRYPTION_KEYS is used for encryption, and all keys
+    are tried for decryption, so that keys can be rotated. Falls back to SECRET_KEY if no keys are configured.
+    """
+    keys = import_from_settings('FEDAUTH_ENCRYPTION_KEYS', None)
+    if not keys:
+        return (settings.SECRET_KEY,)
+    # e.g. ''.split(',') for an unset environment variable, or a trailing comma
+    keys = tuple(key.strip() for key in keys if key.strip())
+    if not keys:
+        raise ImproperlyConfigured('FEDAUTH_ENCRYPTION_KEYS only holds empty keys.')
+    return keys
+
+
+def _get_fernet(key: str | bytes = None) -> Fernet | MultiFernet:
+    if key is None:
+        return get_multi_fernet(get_encryption_keys())
+    return get_fernet(key)
+
 
 def encrypt(plain_text: bytes, key: str | bytes = None) -> bytes:
     """
     Encrypt plain text.
     :param plain_text: text to encrypt
-    :param key: key used for encryption
+    :param key: key used for encryption (defaults to the primary encryption key)
     :return: encrypted ciphertext
     """
-    if key is None:
-        key = settings.SECRET_KEY
-    fernet = Fernet(key)
+    fernet = _get_fernet(key)
     return fernet.encrypt(plain_text)
 
 
@@ -26,15 +67,47 @@ def decrypt(ciphertext: bytes, key: str | bytes = None) -> bytes:
     """
     Decrypt encrypted plain text.
     :param ciphertext: encrypted data
-    :param key: key used for encryption
+    :param key: key used for encryption (defaults to trying all encryption keys)
     :return: decrypted plain text
     """
-    if key is None:
-        key = settings.SECRET_KEY
-    fernet = Fernet(key)
+    fernet = _get_fernet(key)
 
     # Ensure ciphertext is bytes
     if isinstance(ciphertext, memoryview):
         ciphertext = ciphertext.tobytes()
 
     return fernet.decrypt(ciphertext)
+
+
+def decrypt_secret(ciphertext: bytes, key: str | bytes = None) -> bytes:
+    """
+    Same as 'decrypt', but the plain text is kept in memory for FEDAUTH_SECRET_CACHE_TIMEOUT seconds (0 disables
+    caching), so that secrets read on every login don't pay for HMAC verification and AES decryption every time.
+    :param ciphertext: encrypted data
+    :param key: key used for encryption
+    :return: decrypted plain text
+    """
+    timeout = import_from_settings('FEDAUTH_SECRET_CACHE_TIMEOUT', 300)
+    if not timeout:
+        return decrypt(ciphertext, key)
+
+    if isinstance(ciphertext, memoryview):
+        ciphertext = ciphertext.tobytes()
+
+    cache_key = (key or get_encryption_keys(), hashlib.sha256(ciphertext).digest())
+    plain_text = secret_cache.get(cache_key)
+    if plain_text is None:
+        plain_text = decrypt(ciphertext, key)
+        secret_cache.set(cache_key, plain_text, timeout)
+    return plain_text
+
+
+def rotate(ciphertext: bytes) -> bytes:
+    """
+    Re-encrypt ciphertext with the primary encryption key (first key in FEDAUTH_ENCRYPTION_KEYS).
+    :param ciphertext: data encrypted with any of the encryption keys
+    :return: ciphertext encrypted with the primary key
+    """
+    if isinstance(ciphertext, memoryview):
+        ciphertext = ciphertext.tobytes()
+    return get_multi_fernet(get_encryption_keys()).rotate(ciphertext)
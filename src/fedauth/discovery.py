@@ -0,0 +1,147 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import defaultdict
+
+import requests
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from mozilla_django_oidc.utils import import_from_settings
+
+from fedauth.cache import TTLCache
+
+LOGGER = logging.getLogger(__name__)
+
+DISCOVERY_PATH = '/.well-known/openid-configuration'
+
+# mapping of Provider model endpoint fields to discovery document metadata
+ENDPOINT_METADATA = {
+    'auth_endpoint': 'authorization_endpoint',
+    'token_endpoint': 'token_endpoint',
+    'user_endpoint': 'userinfo_endpoint',
+    'jwks_endpoint': 'jwks_uri',
+}
+
+
+class DiscoveryError(Exception):
+    """
+    The discovery document of an issuer can't be fetched, or is invalid.
+    """
+
+
+def fetch_discovery_document(issuer: str) -> dict:
+    response = requests.get(
+        issuer.rstrip('/') + DISCOVERY_PATH,
+        verify=import_from_settings('OIDC_VERIFY_SSL', True),
+        # not OIDC_TIMEOUT, which defaults to no timeout: logins wait for this request
+        timeout=import_from_settings('FEDAUTH_DISCOVERY_TIMEOUT', 5),
+        proxies=import_from_settings('OIDC_PROXY', None),
+    )
+    response.raise_for_status()
+    document = response.json()
+    # the document's endpoints can only be trusted if it belongs to the issuer (OpenID Connect Discovery 1.0, 4.3)
+    if not isinstance(document, dict) or document.get('issuer') != issuer:
+        raise ValueError(f"discovery document issuer doesn't match '{issuer}'")
+    return document
+
+
+class DiscoveryCache:
+    """
+    Cache of OIDC discovery documents ('/.well-known/openid-configuration'), keyed by issuer.
+
+    Documents are kept in process memory and in the django cache for FEDAUTH_DISCOVERY_CACHE_TIMEOUT seconds. Only one
+    request fetches a missing document: other threads wait for it, and other workers wait for it to show up in the
+    django cache (for up to FEDAUTH_DISCOVERY_LOCK_TIMEOUT seconds), so a restart doesn't make every worker hit the
+    IdP at once.
+
+    Failed fetches are cached the same way (as the error message), for FEDAUTH_DISCOVERY_FAILURE_TIMEOUT seconds, so
+    that an IdP outage doesn't make every login fetch the document again.
+    """
+
+    def __init__(self):
+        self._documents = TTLCache(maxsize=1024)
+        self._locks = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_cache_key(issuer):
+        return f'fedauth:discovery:{hashlib.sha256(issuer.encode()).hexdigest()}'
+
+    def clear(self):
+        self._documents.clear()
+
+    def get_lock(self, issuer):
+        with self._lock:
+            return self._locks[issuer]
+
+    @staticmethod
+    def get_timeout(document) -> int:
+        if isinstance(document, str):  # failure
+            return import_from_settings('FEDAUTH_DISCOVERY_FAILURE_TIMEOUT', 30)
+        return import_from_settings('FEDAUTH_DISCOVERY_CACHE_TIMEOUT', 60 * 60)
+
+    def get(self, issuer: str) -> dict:
+        """
+        :raises DiscoveryError: if the document can't be fetched, or a recent fetch failed
+        """
+        document = self._documents.get(issuer)
+        if document is None:
+            with self.get_lock(issuer):
+                document = self._documents.get(issuer)
+                if document is None:
+                    document = self.get_shared(issuer)
+                    self._documents.set(issuer, document, self.get_timeout(document))
+        if isinstance(document, str):
+            raise DiscoveryError(document)
+        return document
+
+    def get_shared(self, issuer):
+        key = self.get_cache_key(issuer)
+        document = cache.get(key)
+        if document is not None:
+            return document
+
+        lock_key = f'{key}:lock'
+        lock_timeout = import_from_settings('FEDAUTH_DISCOVERY_LOCK_TIMEOUT', 5)
+        locked = cache.add(lock_key, 1, timeout=lock_timeout)
+        if not locked:
+            # another worker is fetching the document, wait for it (and fetch it ourselves if it takes too long)
+            deadline = time.monotonic() + lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                document = cache.get(key)
+                if document is not None:
+                    return document
+        try:
+            try:
+                document = fetch_discovery_document(issuer)
+            except (requests.RequestException, ValueError) as exc:
+                document = str(exc) or exc.__class__.__name__
+            cache.set(key, document, self.get_timeout(document))
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        return document
+
+
+discovery_cache = DiscoveryCache()
+
+
+def get_endpoint(provider, field: str) -> str:
+    """
+    Return an endpoint of the provider. If the provider has an issuer, the endpoint is taken from the issuer's discovery
+    document, so endpoints moved by the IdP are picked up automatically. The endpoint stored on the provider is used if
+    the discovery document doesn't list it, or can't be fetched.
+    """
+    value = getattr(provider, field)
+    if not provider.issuer:
+        return value
+    try:
+        document = discovery_cache.get(provider.issuer)
+    except DiscoveryError as exc:
+        if value:
+            LOGGER.warning('OIDC discovery failed for issuer %s, using stored %s: %s', provider.issuer, field, exc)
+            return value
+        raise ImproperlyConfigured(f"OIDC discovery failed for issuer '{provider.issuer}': {exc}")
+    return document.get(ENDPOINT_METADATA[field]) or value
@@ -0,0 +1,157 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.db.models.functions import Lower
+from mozilla_django_oidc.utils import import_from_settings
+
+from fedauth.cache import get_or_load, provider_version
+from fedauth.models import DynamicProvider
+
+_DOMAIN = object()  # marks a trie node where a provider domain ends
+
+
+def get_labels(domain: str) -> list[str]:
+    # labels are stored in reverse order ('eu.company.com' -> ['com', 'company', 'eu']), so that domains sharing a
+    # suffix share a branch of the trie.
+    return domain.strip('.').lower().split('.')[::-1]
+
+
+class DomainTrie:
+    """
+    Trie of provider domains, keyed on reversed domain labels.
+    Finds the longest provider domain that is a suffix of a given domain in O(labels).
+    """
+
+    def __init__(self, domains=()):
+        self._root = {}
+        for domain in domains:
+            self.add(domain)
+
+    def add(self, domain: str):
+        node = self._root
+        for label in get_labels(domain):
+            node = node.setdefault(label, {})
+        node[_DOMAIN] = domain
+
+    def match(self, domain: str, subdomains: bool = True) -> str | None:
+        """
+        Return the provider domain matching 'domain', or None.
+        :param domain: domain to look up (e.g. 'eu.company.com')
+        :param subdomains: if True, the longest provider domain that 'domain' is a subdomain of also matches
+        """
+        node = self._root
+        match = None
+        for label in get_labels(domain):
+            node = node.get(label)
+            if node is None:
+                return match if subdomains else None
+            if subdomains:
+                match = node.get(_DOMAIN, match)
+        return match if subdomains else node.get(_DOMAIN)
+
+
+class BloomFilter:
+    """
+    Set membership in a fixed size bit array, with false positives (at about 'error_rate') but no false negatives.
+    """
+
+    def __init__(self, items, error_rate=0.01):
+        items = list(items)
+        self.size = max(1024, int(-len(items) * math.log(error_rate) / math.log(2) ** 2))  # bits
+        self.hashes = max(1, round(-math.log2(error_rate)))
+        self._bits = bytearray((self.size + 7) // 8)
+        for item in items:
+            for bit in self._positions(item):
+                self._bits[bit >> 3] |= 1 << (bit & 7)
+
+    def _positions(self, item: str):
+        # k positions from two 64 bit hashes (Kirsch-Mitzenmacher)
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little')
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[bit >> 3] & (1 << (bit & 7)) for bit in self._positions(item))
+
+
+class DomainBloomFilter:
+    """
+    Same lookups as DomainTrie, for very large numbers of providers: the domains are kept in a Bloom filter (about 10
+    bits per domain, instead of the trie's few hundred bytes). Domains that no provider can match are answered from
+    memory; possible matches are confirmed with a query, which is kept in the provider cache.
+    """
+
+    def __init__(self, domains=(), error_rate=0.01):
+        self._filter = BloomFilter((domain.strip('.').lower() for domain in domains), error_rate)
+
+    @staticmethod
+    def get_candidates(domain: str, subdomains: bool = True) -> list[str]:
+        # the domain, and its parent domains (longest first) if subdomains match too
+        labels = get_labels(domain)[::-1]
+        if not subdomains:
+            return ['.'.join(labels)]
+        return ['.'.join(labels[i:]) for i in range(len(labels))]
+
+    def match(self, domain: str, subdomains: bool = True) -> str | None:
+        candidates = [candidate for candidate in self.get_candidates(domain, subdomains) if candidate in self._filter]
+        if not candidates:
+            return None
+
+        def load():
+            # domains are compared lowercased (like the trie), and returned as stored
+            found = dict(
+                DynamicProvider.objects.annotate(lower_domain=Lower('domain'))
+                .filter(lower_domain__in=candidates)
+                .values_list('lower_domain', 'domain')
+            )
+            return next((found[candidate] for candidate in candidates if candidate in found), None)
+        return get_or_load(('domain-match', tuple(candidates)), load)
+
+
+class DomainIndex:
+    """
+    In-memory index of all dynamic provider domains. The index is rebuilt (one query) the first time it is used after a
+    provider changed, or after FEDAUTH_PROVIDER_CACHE_TIMEOUT seconds (for providers changed by other processes), and
+    serves all other lookups from memory.
+
+    With more than FEDAUTH_DOMAIN_BLOOM_THRESHOLD providers, a Bloom filter (see DomainBloomFilter) is used instead of
+    a trie, to keep the index small.
+    """
+
+    def __init__(self):
+        self._matcher = None
+        self._version = None
+        self._built_at = None
+        self._lock = threading.Lock()
+
+    def is_stale(self, version) -> bool:
+        if self._matcher is None or self._version != version:
+            return True
+        return time.monotonic() - self._built_at >= import_from_settings('FEDAUTH_PROVIDER_CACHE_TIMEOUT', 300)
+
+    def get_matcher(self) -> DomainTrie | DomainBloomFilter:
+        version = provider_version.current()
+        if self.is_stale(version):
+            with self._lock:
+                if self.is_stale(version):
+                    self._matcher = self.build(DynamicProvider.objects.values_list('domain', flat=True))
+                    self._version = version
+                    self._built_at = time.monotonic()
+        return self._matcher
+
+    @staticmethod
+    def build(domains) -> DomainTrie | DomainBloomFilter:
+        threshold = import_from_settings('FEDAUTH_DOMAIN_BLOOM_THRESHOLD', 50000)
+        domains = list(domains)
+        if threshold is not None and len(domains) > threshold:
+            return DomainBloomFilter(domains, import_from_settings('FEDAUTH_DOMAIN_BLOOM_ERROR_RATE', 0.01))
+        return DomainTrie(domains)
+
+    def match(self, domain: str) -> str | None:
+        subdomains = import_from_settings('FEDAUTH_MATCH_SUBDOMAINS', True)
+        return self.get_matcher().match(domain, subdomains)
+
+
+domain_index = DomainIndex()
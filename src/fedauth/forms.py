@@ -1,9 +1,20 @@
 from django import forms
 
+from fedauth.discovery import ENDPOINT_METADATA
+
 
 class BaseProviderAdminForm(forms.ModelForm):
     client_secret = forms.CharField(required=False)
 
+    def clean(self):
+        cleaned_data = super().clean()
+        # endpoints are only optional when they can be discovered from the issuer
+        if not cleaned_data.get('issuer') and 'issuer' not in self.errors:
+            for field in ENDPOINT_METADATA:
+                if field in self.fields and not cleaned_data.get(field) and field not in self.errors:
+                    self.add_error(field, 'This field is required if no issuer is set.')
+        return cleaned_data
+
     def save(self, commit=True):
         obj = self.instance
         secret = self.data.get('client_secret')
@@ -1,14 +1,24 @@
-from django.core.cache import cache
+from django.contrib.auth import get_user_model
+from mozilla_django_oidc.utils import import_from_settings
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from fedauth.frontend_oidc.utils import build_oidc_auth_url
-from fedauth.models import StaticProvider, DynamicProvider
+from fedauth.cache import cache_pop, cache_pop_many, get_or_load
+from fedauth.frontend_oidc.utils import build_oidc_auth_url, get_tokens_for_user
+from fedauth.metrics import measure
+from fedauth.models import StaticProvider
+from fedauth.tracing import set_span_attributes, span
+from fedauth.utils import find_dynamic_provider, find_static_provider
 
 
 def get_provider_options():
-    providers = StaticProvider.objects.all()
-    return [(prov.provider, prov.provider) for prov in providers]
+    """
+    Static provider choices, kept in the provider cache (see 'get_or_load') instead of being queried on every login
+    request.
+    """
+    def load():
+        return [(alias, alias) for alias in StaticProvider.objects.values_list('provider', flat=True)]
+    return get_or_load('static-provider-options', load)
 
 
 class LoginSerializer(serializers.Serializer):
@@ -25,32 +35,32 @@ class LoginSerializer(serializers.Serializer):
     @staticmethod
     def get_provider_choices():
         """
-        The serializer by default caches 'ChoiceField.choices' the first time it is initialized. This
-        can be problematic, since providers can be added on admin page, and the new choices
-        won't reflect until cache expires. So we need to dynamically get choices every time the serializer is
-        initialized by calling this method in __init__
+        'ChoiceField.choices' is fixed when the serializer class is defined, so the choices are set again every time
+        the serializer is initialized. They come from the versioned provider cache ('get_provider_options'), not the
+        database: the cache is dropped when a provider is saved or deleted in this process (or, with
+        FEDAUTH_PROVIDER_CACHE_BROADCAST, on any worker), and otherwise expires after FEDAUTH_PROVIDER_CACHE_TIMEOUT
+        seconds.
         """
-        return [
-            (p.provider, p.provider)
-            for p in StaticProvider.objects.all()
-        ]
+        return get_provider_options()
 
-    def populate_auth_url(self, attrs):
-        auth_url = None
+    @staticmethod
+    def get_provider(attrs):
+        """
+        Resolve the provider object for the login request once. Returns None if no provider matches.
+        """
         # if username field is populated in payload - It's a dynamic login
         username = attrs.get('username')
-        request = self.context['request']
         if username:
             domain = username.split('@')[-1]
-            provider = DynamicProvider.objects.filter(domain=domain)
-            if provider.exists():
-                auth_url = build_oidc_auth_url(request, provider.first())
-        else:
-            # if there is no username in post data - we assume that it isn't a dynamic login ('Login with x')
-            gen_provider = attrs.get('provider')
-            provider = StaticProvider.objects.filter(provider=gen_provider)
-            if provider.exists():
-                auth_url = build_oidc_auth_url(request, provider.first())
+            return find_dynamic_provider(domain)
+        # if there is no username in post data - we assume that it isn't a dynamic login ('Login with x')
+        return find_static_provider(attrs.get('provider'))
+
+    def populate_auth_url(self, attrs, provider):
+        auth_url = None
+        if provider:
+            with measure('auth_url', provider), span('fedauth.auth_url', provider):
+                auth_url = build_oidc_auth_url(self.context['request'], provider)
         attrs['auth_url'] = auth_url
 
     def validate(self, attrs):
@@ -60,21 +70,82 @@ class LoginSerializer(serializers.Serializer):
             raise ValidationError('Submit either username OR provider, not both.')
         if not username and not provider:
             raise ValidationError('Must submit either username OR provider')
+        # the provider label is only set once the provider is found, requested domains are unbounded
+        with measure('provider_lookup') as metric, span('fedauth.provider_lookup'):
+            provider = self.get_provider(attrs)
+            metric.provider = provider
+            set_span_attributes(provider=provider)
+            metric.outcome = 'found' if provider else 'not_found'
         # populated validated data with idp url
-        self.populate_auth_url(attrs)
+        self.populate_auth_url(attrs, provider)
         return attrs
 
 
 class TokenExchangeSerializer(serializers.Serializer):
     code = serializers.CharField(max_length=64)
 
+    @staticmethod
+    def mint_tokens(user_id):
+        """
+        With FEDAUTH_LAZY_TOKENS, the callback only caches the id of the user that logged in, and the tokens are
+        minted here.
+        """
+        user = get_user_model().objects.filter(pk=user_id, is_active=True).first()
+        if user is None:
+            raise ValidationError({'detail': 'Code Invalid or expired'})
+        return get_tokens_for_user(user)
+
     def validate(self, attrs):
         request = self.context['request']
         code = request.data.get('code')
-        jwt_token = cache.get(f'auth_code:{code}')
-        if not jwt_token:
-            raise ValidationError({'detail': 'Code Invalid or expired'})
-        cache.delete(f'auth_code:{code}')
+        with measure('token_exchange') as metric:
+            # codes are single use, so the tokens are removed in the same (atomic) cache operation that reads them
+            jwt_token = cache_pop(f'auth_code:{code}')
+            if not jwt_token:
+                metric.outcome = 'invalid'
+                raise ValidationError({'detail': 'Code Invalid or expired'})
+            if 'user_id' in jwt_token:
+                jwt_token = self.mint_tokens(jwt_token['user_id'])
         # add tokens to attrs (jwt_token contains access and refresh tokens)
         attrs['tokens'] = jwt_token
         return attrs
+
+
+class BatchTokenExchangeSerializer(serializers.Serializer):
+    """
+    Exchange several codes at once (e.g. a backend that completes logins for several apps). All codes are redeemed
+    with a single cache round trip, and every code gets a result: its tokens, or an error.
+    """
+    codes = serializers.ListField(child=serializers.CharField(max_length=64), allow_empty=False)
+
+    @staticmethod
+    def validate_codes(codes):
+        max_codes = import_from_settings('FEDAUTH_TOKEN_EXCHANGE_BATCH_SIZE', 20)
+        if len(codes) > max_codes:
+            raise ValidationError(f'Ensure this field has no more than {max_codes} codes.')
+        return list(dict.fromkeys(codes))  # drop duplicates
+
+    def validate(self, attrs):
+        with measure('token_exchange'):
+            attrs['results'] = self.redeem_codes(attrs['codes'])
+        return attrs
+
+    @staticmethod
+    def redeem_codes(codes):
+        found = cache_pop_many([f'auth_code:{code}' for code in codes])
+        code_data = {code: found.get(f'auth_code:{code}') for code in codes}
+
+        # lazy codes (see TokenExchangeSerializer.mint_tokens), load all their users with one query
+        user_ids = {data['user_id'] for data in code_data.values() if data and 'user_id' in data}
+        users = get_user_model().objects.filter(pk__in=user_ids, is_active=True).in_bulk() if user_ids else {}
+
+        results = []
+        for code, data in code_data.items():
+            if data and 'user_id' in data:
+                user = users.get(data['user_id'])
+                data = get_tokens_for_user(user) if user else None
+            if data:
+                results.append({'code': code, **data})
+            else:
+                results.append({'code': code, 'detail': 'Code Invalid or expired'})
+        return results
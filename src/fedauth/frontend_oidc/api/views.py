@@ -6,7 +6,8 @@ from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from mozilla_django_oidc.views import get_next_url
 
-from fedauth.frontend_oidc.api.serializers import LoginSerializer, TokenExchangeSerializer
+from fedauth.frontend_oidc.api.serializers import BatchTokenExchangeSerializer, LoginSerializer, TokenExchangeSerializer
+from fedauth.tracing import span
 
 url_validator = URLValidator()
 
@@ -35,16 +36,14 @@ class OidcLoginView(CreateAPIView):
             url_validator(url_fail)
         except DjangoValidationError:
             raise ValidationError("Invalid 'next' or 'success' url")
-
-        # we need to add urls to session, so that callback knows where to redirect to.
-        request.session['next'] = url_success
-        request.session['fail'] = url_fail
+        # the urls are stored in the login context (see build_oidc_auth_url), so that callback knows where to redirect to.
 
     def create(self, request, *args, **kwargs):
-        self.validate_url_parameters(request)
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        return Response({'auth_url': serializer.validated_data['auth_url']})
+        with span('fedauth.login'):
+            self.validate_url_parameters(request)
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            return Response({'auth_url': serializer.validated_data['auth_url']})
 
 
 class TokenExchangeView(CreateAPIView):
@@ -57,7 +56,23 @@ class TokenExchangeView(CreateAPIView):
     permission_classes = [AllowAny]
 
     def create(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data)
-        serializer.is_valid(raise_exception=True)
-        jwt_tokens = serializer.validated_data['tokens']
-        return Response(jwt_tokens)
+        with span('fedauth.token_exchange'):
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            jwt_tokens = serializer.validated_data['tokens']
+            return Response(jwt_tokens)
+
+
+class BatchTokenExchangeView(CreateAPIView):
+    """
+    Same as TokenExchangeView, for a list of codes. Returns a result for every code, in the order they were submitted:
+    the jwt tokens, or a 'detail' message if the code is invalid or expired.
+    """
+    serializer_class = BatchTokenExchangeSerializer
+    permission_classes = [AllowAny]
+
+    def create(self, request, *args, **kwargs):
+        with span('fedauth.token_exchange'):
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            return Response({'results': serializer.validated_data['results']})
@@ -1,8 +1,9 @@
 from django.urls import path
 
-from fedauth.frontend_oidc.api.views import OidcLoginView, TokenExchangeView
+from fedauth.frontend_oidc.api.views import BatchTokenExchangeView, OidcLoginView, TokenExchangeView
 
 urlpatterns = [
     path('', OidcLoginView.as_view(), name='oidc-provider-login'),
-    path('token-exchange/', TokenExchangeView.as_view(), name='token-exchange')
+    path('token-exchange/', TokenExchangeView.as_view(), name='token-exchange'),
+    path('token-exchange/batch/', BatchTokenExchangeView.as_view(), name='token-exchange-batch'),
 ]
@@ -4,61 +4,57 @@ from urllib.parse import urlencode
 from django.core.exceptions import ImproperlyConfigured
 from django.urls import reverse
 from django.utils.crypto import get_random_string
-from mozilla_django_oidc.utils import (
-    absolutify,
-    add_state_and_verifier_and_nonce_to_session,
-)
+from mozilla_django_oidc.utils import absolutify
 from mozilla_django_oidc.views import get_next_url
+from rest_framework_simplejwt.tokens import RefreshToken
 
+from fedauth.login_context import save_login_context
 from fedauth.models import DynamicProvider, StaticProvider
-from fedauth.utils import get_static_provider_settings, get_dynamic_provider_settings
-
-
-def get_settings(req, attr, *args):
-    domain = req.session.get('domain')
-    provider = req.session.get('provider')
-    if domain:
-        return get_dynamic_provider_settings(attr, domain, *args)
-    return get_static_provider_settings(attr, provider, *args)
+from fedauth.tracing import set_span_attributes
+from fedauth.utils import get_provider_config
 
 
 def build_oidc_auth_url(request, provider: Union[DynamicProvider, str]):
-    # throughout this method we populate the session with values that is needed later in the flow (e.g. during callback)
-    request.session['next'] = get_next_url(request, 'next')
-    request.session['fail'] = get_next_url(request, 'fail')
-
-    # store values in session, so that we have context during callback
+    # values that are needed later in the flow (during callback) are stored in the login context
+    context = {
+        'next': get_next_url(request, 'next'),
+        'fail': get_next_url(request, 'fail'),
+    }
     if isinstance(provider, DynamicProvider):
-        request.session['domain'] = provider.domain
+        context['domain'] = provider.domain
     elif isinstance(provider, StaticProvider):
-        request.session['provider'] = provider.provider
+        context['provider'] = provider.provider
     else:
         raise ImproperlyConfigured('Invalid provider')
 
     # get credentials from provider object
-    oidc_op_auth_endpoint = provider.auth_endpoint
+    oidc_op_auth_endpoint = get_provider_config(provider, 'OIDC_OP_AUTHORIZATION_ENDPOINT')
     oidc_rp_client_id = provider.client_id
 
-    callback_url = get_settings(request, 'OIDC_AUTHENTICATION_CALLBACK_URL', 'oidc_authentication_callback')
+    # settings are read from the provider object we already have, rather than loading it again for every setting
+    callback_url = get_provider_config(provider, 'OIDC_AUTHENTICATION_CALLBACK_URL', 'oidc_authentication_callback')
 
-    # In order to easily keep track of session during the flow, we can use the session key as state parameter!
-    # since the state will persist through the entire flow (during callback etc), we can easily find session later down the line.
-    request.session.save()  # But we first need to save the session to generate the session id.
-    state_param = request.session.session_key
+    # The state parameter persists through the entire flow, so the callback uses it to find the login context.
+    context['nonce'] = get_random_string(get_provider_config(provider, 'OIDC_NONCE_SIZE', 32))
+    state = save_login_context(context)
+    set_span_attributes(state=state)  # links the callback's trace to this one
 
     params = {
         'response_type': 'code',
-        'scope': get_settings(request, 'OIDC_RP_SCOPES', 'openid email'),
+        'scope': get_provider_config(provider, 'OIDC_RP_SCOPES', 'openid email'),
         'client_id': oidc_rp_client_id,
         'redirect_uri': absolutify(request, reverse(callback_url)),
-        'state': state_param,
+        'state': state,
+        'nonce': context['nonce'],
     }
-
-    nonce = get_random_string(get_settings(request, 'OIDC_NONCE_SIZE', 32))
-    params['nonce'] = nonce
-
-    add_state_and_verifier_and_nonce_to_session(
-        request, state_param, params, None
-    )
     idp_auth_url = f'{oidc_op_auth_endpoint}?{urlencode(params)}'
     return idp_auth_url
+
+
+def get_tokens_for_user(user) -> dict:
+    # generate a refresh token object to get refresh and access tokens
+    tokens = RefreshToken.for_user(user=user)
+    return {
+        'access_token': str(tokens.access_token),
+        'refresh_token': str(tokens)
+    }
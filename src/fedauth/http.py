@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import weakref
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+
+import requests
+from django.core.exceptions import ImproperlyConfigured
+from mozilla_django_oidc.utils import import_from_settings
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+try:
+    import httpx
+except ImportError:  # only needed for the async views ('async' extra)
+    httpx = None
+
+_sessions = {}
+_async_clients = weakref.WeakKeyDictionary()  # event loop -> {provider key: (config, client)}
+_lock = threading.Lock()
+
+
+def get_pool_config(provider=None) -> tuple:
+    """
+    Return the cache key of the provider's HTTP pool, and its (pool size, retries) config.
+    """
+    pool_size = import_from_settings('FEDAUTH_HTTP_POOL_SIZE', 10)
+    retries = import_from_settings('FEDAUTH_HTTP_RETRIES', 0)
+    key = None
+    if provider is not None:
+        key = (provider._meta.label, provider.pk)
+        if provider.http_pool_size is not None:
+            pool_size = provider.http_pool_size
+        if provider.http_retries is not None:
+            retries = provider.http_retries
+    return key, (pool_size, retries)
+
+
+def get_cookie_policy() -> DefaultCookiePolicy:
+    # sessions are shared by the logins of all users, so cookies set by the IdP for one user must not be sent on the
+    # requests of another: no cookie is stored.
+    return DefaultCookiePolicy(allowed_domains=[])
+
+
+def build_session(pool_size: int, retries: int) -> requests.Session:
+    """
+    Session with a keep-alive connection pool, that doesn't keep cookies. Connection errors are retried for all requests,
+    while failed responses (5xx) are only retried for idempotent requests (so auth codes are never posted twice).
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.2,
+        status_forcelist=(500, 502, 503, 504),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.cookies.set_policy(get_cookie_policy())
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session(provider=None) -> requests.Session:
+    """
+    Return the pooled HTTP session for a provider, so that token, userinfo and JWKS requests to the same IdP reuse
+    connections instead of doing a new TCP and TLS handshake for every login. Without a provider, a session with
+    default pool settings is returned.
+    The session is rebuilt when the provider's pool settings change.
+    """
+    key, config = get_pool_config(provider)
+    with _lock:
+        entry = _sessions.get(key)
+        if entry is None or entry[0] != config:
+            entry = (config, build_session(*config))
+            _sessions[key] = entry
+    return entry[1]
+
+
+def build_async_client(pool_size: int, retries: int, verify=True, proxies=None) -> 'httpx.AsyncClient':
+    """
+    httpx version of 'build_session'. httpx only retries connection errors. SSL verification and proxies are
+    configured on the client, since httpx doesn't take them per request. 'proxies' uses the requests format
+    (OIDC_PROXY), e.g. {'https': 'http://proxy:3128'}.
+    """
+    limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+
+    def transport(proxy=None):
+        return httpx.AsyncHTTPTransport(verify=verify, limits=limits, retries=retries, proxy=proxy)
+
+    mounts = {}
+    for scheme, url in (proxies or {}).items():
+        mounts[scheme if '://' in scheme else f'{scheme}://'] = transport(url)
+    cookies = CookieJar(policy=get_cookie_policy())
+    return httpx.AsyncClient(transport=transport(), mounts=mounts, cookies=cookies)
+
+
+class AsyncClient:
+    """
+    httpx client that lets at most 'pool_size' requests into httpcore's connection pool at a time, and queues the rest
+    on a semaphore. httpcore rescans its whole queue on every state change of the pool, which dominates the CPU time
+    of the event loop when hundreds of logins wait for a connection.
+    """
+
+    def __init__(self, pool_size: int, retries: int, verify=True, proxies=None):
+        self.client = build_async_client(pool_size, retries, verify=verify, proxies=proxies)
+        self._semaphore = asyncio.Semaphore(pool_size)
+
+    async def request(self, method, url, **kwargs) -> 'httpx.Response':
+        async with self._semaphore:
+            return await self.client.request(method, url, **kwargs)
+
+    async def get(self, url, **kwargs) -> 'httpx.Response':
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs) -> 'httpx.Response':
+        return await self.request('POST', url, **kwargs)
+
+
+def get_async_client(provider=None, verify=True, proxies=None) -> AsyncClient:
+    """
+    Async version of 'get_session'. Clients are bound to the event loop they were created in, so one client is kept
+    per provider per event loop.
+    """
+    if httpx is None:
+        raise ImproperlyConfigured("The async views require httpx. Install fedauth with the 'async' extra.")
+    key, config = get_pool_config(provider)
+    config += (verify, tuple(sorted((proxies or {}).items())))
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    entry = clients.get(key)
+    if entry is None or entry[0] != config:
+        entry = (config, AsyncClient(*config[:2], verify=verify, proxies=proxies))
+        clients[key] = entry
+    return entry[1]
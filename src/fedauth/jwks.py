@@ -0,0 +1,172 @@
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+
+import jwt
+from django.core.exceptions import SuspiciousOperation
+from django.utils.encoding import smart_str
+from mozilla_django_oidc.utils import import_from_settings
+
+LOGGER = logging.getLogger(__name__)
+
+CACHE_CONTROL_RE = re.compile(r'(max-age|stale-while-revalidate)\s*=\s*"?(\d+)"?', re.IGNORECASE)
+
+
+def parse_cache_control(header: str) -> dict[str, int]:
+    """
+    Return the 'max-age' and 'stale-while-revalidate' directives of a Cache-Control header.
+    'no-cache' and 'no-store' are treated as 'max-age=0, stale-while-revalidate=0', so that keys the IdP doesn't want
+    cached (e.g. withdrawn keys) aren't served as stale keys either.
+    """
+    directives = {name.lower(): int(value) for name, value in CACHE_CONTROL_RE.findall(header or '')}
+    if re.search(r'no-cache|no-store', header or '', re.IGNORECASE):
+        directives.update({'max-age': 0, 'stale-while-revalidate': 0})
+    return directives
+
+
+class JWKSet:
+    """
+    Keys fetched from a JWKS endpoint, parsed once into PyJWK objects.
+    """
+
+    def __init__(self, jwks: dict, max_age: int, stale_age: int):
+        now = time.monotonic()
+        self.fresh_until = now + max_age
+        self.stale_until = self.fresh_until + stale_age
+        self.keys = []
+        for jwk in jwks.get('keys', []):
+            try:
+                self.keys.append((jwk, jwt.PyJWK(jwk)))
+            except jwt.PyJWKError:
+                # e.g. encryption keys, or algorithms not supported by pyjwt. Can't be used to verify tokens anyway.
+                LOGGER.debug('Skipping unusable JWK %s', jwk.get('kid'))
+
+    @property
+    def is_fresh(self):
+        return time.monotonic() < self.fresh_until
+
+    @property
+    def is_usable(self):
+        return time.monotonic() < self.stale_until
+
+    def find(self, header: dict) -> jwt.PyJWK | None:
+        # same matching rules as mozilla's 'retrieve_matching_jwk'
+        key = None
+        for jwk, parsed in self.keys:
+            if import_from_settings('OIDC_VERIFY_KID', True) and jwk.get('kid') != smart_str(header.get('kid')):
+                continue
+            if 'alg' in jwk and jwk['alg'] != smart_str(header.get('alg')):
+                continue
+            key = parsed
+        return key
+
+
+class JWKSCache:
+    """
+    In-process cache of JWKS endpoint responses, keyed by endpoint.
+
+    - Key sets are kept for the Cache-Control 'max-age' of the response (FEDAUTH_JWKS_CACHE_TIMEOUT if not set).
+    - Once expired, the stale key set is still used for up to 'stale-while-revalidate' seconds
+      (FEDAUTH_JWKS_STALE_TIMEOUT if not set), while it is refreshed in a background thread. The stale set also keeps
+      being served if the endpoint is down or slow.
+    - If a token is signed with an unknown 'kid' (the IdP rotated its keys), the key set is refetched straight away,
+      at most once every FEDAUTH_JWKS_MIN_REFRESH_INTERVAL seconds per endpoint.
+    """
+
+    def __init__(self):
+        self._sets = {}
+        self._refreshed_at = {}
+        self._refreshing = {}
+        self._locks = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._sets.clear()
+            self._refreshed_at.clear()
+
+    def has_key_set(self, endpoint) -> bool:
+        jwk_set = self._sets.get(endpoint)
+        return jwk_set is not None and jwk_set.is_usable
+
+    def get_lock(self, endpoint):
+        with self._lock:
+            return self._locks[endpoint]
+
+    def fetch(self, endpoint, fetch) -> JWKSet:
+        response = fetch(endpoint)
+        response.raise_for_status()
+        directives = parse_cache_control(response.headers.get('Cache-Control', ''))
+        max_age = directives.get('max-age', import_from_settings('FEDAUTH_JWKS_CACHE_TIMEOUT', 60 * 60))
+        stale_age = directives.get('stale-while-revalidate', import_from_settings('FEDAUTH_JWKS_STALE_TIMEOUT', 60 * 60 * 24))
+        jwk_set = JWKSet(response.json(), max_age, stale_age)
+        with self._lock:
+            self._sets[endpoint] = jwk_set
+            self._refreshed_at[endpoint] = time.monotonic()
+        return jwk_set
+
+    def refresh(self, endpoint, fetch, force=False) -> JWKSet | None:
+        """
+        Fetch the key set, unless another thread is already fetching it, in which case wait for that result.
+        Forced refreshes are rate limited per endpoint, and return None when skipped.
+        """
+        with self.get_lock(endpoint):
+            if force:
+                refreshed_at = self._refreshed_at.get(endpoint)
+                interval = import_from_settings('FEDAUTH_JWKS_MIN_REFRESH_INTERVAL', 60)
+                if refreshed_at is not None and time.monotonic() - refreshed_at < interval:
+                    return None
+            else:
+                jwk_set = self._sets.get(endpoint)
+                if jwk_set is not None and jwk_set.is_fresh:
+                    return jwk_set  # fetched by another thread while we were waiting
+            return self.fetch(endpoint, fetch)
+
+    def refresh_in_background(self, endpoint, fetch):
+        def run():
+            try:
+                self.refresh(endpoint, fetch)
+            except Exception as exc:  # keep serving the stale key set
+                LOGGER.warning('Background JWKS refresh for %s failed: %s', endpoint, exc)
+            finally:
+                with self._lock:
+                    self._refreshing.pop(endpoint, None)
+
+        with self._lock:
+            if endpoint in self._refreshing:
+                return self._refreshing[endpoint]
+            thread = threading.Thread(target=run, name='fedauth-jwks-refresh', daemon=True)
+            self._refreshing[endpoint] = thread
+        thread.start()
+        return thread
+
+    def get_key_set(self, endpoint, fetch) -> JWKSet:
+        jwk_set = self._sets.get(endpoint)
+        if jwk_set is None or not jwk_set.is_usable:
+            return self.refresh(endpoint, fetch)
+        if not jwk_set.is_fresh:
+            self.refresh_in_background(endpoint, fetch)
+        return jwk_set
+
+    def get_signing_key(self, endpoint, token, fetch) -> jwt.PyJWK:
+        """
+        Return the key that the token was signed with.
+        :param endpoint: JWKS endpoint of the provider
+        :param token: the JWT to find the signing key for
+        :param fetch: callable that performs the HTTP GET for the endpoint, and returns the response
+        """
+        header = jwt.get_unverified_header(token)
+        key = self.get_key_set(endpoint, fetch).find(header)
+        if key is None:
+            # unknown kid, the IdP might have rotated its keys
+            jwk_set = self.refresh(endpoint, fetch, force=True)
+            if jwk_set is not None:
+                key = jwk_set.find(header)
+        if key is None:
+            raise SuspiciousOperation('Could not find a valid JWKS.')
+        return key
+
+
+jwks_cache = JWKSCache()
@@ -0,0 +1,117 @@
+import json
+from functools import lru_cache
+
+from cryptography.fernet import InvalidToken
+from django.core.cache import cache
+from django.utils.crypto import get_random_string
+from django.utils.module_loading import import_string
+from mozilla_django_oidc.utils import import_from_settings
+
+from fedauth.cache import cache_pop
+from fedauth.crypto import get_encryption_keys, get_multi_fernet
+
+# values of a frontend login that the callback needs. Stored with the nonce (and PKCE code verifier, if any).
+LOGIN_CONTEXT_FIELDS = ('domain', 'provider', 'next', 'fail')
+
+DEFAULT_LOGIN_STATE_STORE = 'fedauth.login_context.CacheLoginStateStore'
+
+
+def get_login_context_timeout() -> int:
+    # seconds a user has to complete the login at the IdP
+    return import_from_settings('FEDAUTH_LOGIN_CONTEXT_TIMEOUT', 60 * 15)
+
+
+def get_login_context_key(state: str) -> str:
+    return f'fedauth:login:{state}'
+
+
+class LoginStateStore:
+    """
+    Keeps the context of a frontend login between the login request and the callback. The login request and the
+    callback are made by different clients (frontend and browser), so they don't share a session; the OIDC 'state'
+    parameter is what ties them together.
+    """
+
+    def save(self, context: dict) -> str:
+        """
+        Store the context, and return the state parameter to send to the IdP.
+        """
+        raise NotImplementedError
+
+    def pop(self, state: str) -> dict | None:
+        """
+        Return the context of the state, or None for unknown or expired states (e.g. admin logins, which keep their
+        state in the browser session). A store should make sure a state can't be used again, where it can.
+        """
+        raise NotImplementedError
+
+
+class CacheLoginStateStore(LoginStateStore):
+    """
+    Stores the context in the django cache, under a random state. The record is removed in the same (atomic) cache
+    operation that reads it, so a state can only be used once.
+    """
+
+    def save(self, context: dict) -> str:
+        state = get_random_string(32)
+        cache.set(get_login_context_key(state), context, timeout=get_login_context_timeout())
+        return state
+
+    def pop(self, state: str) -> dict | None:
+        if not state.isalnum():
+            return None
+        return cache_pop(get_login_context_key(state))
+
+
+class SignedLoginStateStore(LoginStateStore):
+    """
+    Stores nothing: the state parameter is the context itself, encrypted with the encryption keys (see
+    fedauth.crypto), and only accepted for FEDAUTH_LOGIN_CONTEXT_TIMEOUT seconds. Starting and finishing a login
+    don't touch the cache at all.
+
+    The state can't be removed once it's used. Replays are still refused by the IdP, since an auth code can only be
+    redeemed once, and the ID token has to carry the nonce of the state.
+    """
+
+    @staticmethod
+    def get_fernet():
+        return get_multi_fernet(get_encryption_keys())
+
+    def save(self, context: dict) -> str:
+        payload = json.dumps(context, separators=(',', ':')).encode()
+        return self.get_fernet().encrypt(payload).decode()
+
+    def pop(self, state: str) -> dict | None:
+        try:
+            payload = self.get_fernet().decrypt(state.encode(), ttl=get_login_context_timeout())
+        except InvalidToken:
+            return None
+        return json.loads(payload)
+
+
+@lru_cache(maxsize=4)
+def _get_login_state_store(path: str) -> LoginStateStore:
+    return import_string(path)()
+
+
+def get_login_state_store() -> LoginStateStore:
+    """
+    The store configured with FEDAUTH_LOGIN_STATE_STORE (dotted path to a LoginStateStore class).
+    """
+    return _get_login_state_store(import_from_settings('FEDAUTH_LOGIN_STATE_STORE', DEFAULT_LOGIN_STATE_STORE))
+
+
+def save_login_context(context: dict) -> str:
+    """
+    Store the context of a frontend login, and return the state parameter that identifies it. Empty values are left out.
+    """
+    return get_login_state_store().save({key: value for key, value in context.items() if value})
+
+
+def pop_login_context(state: str) -> dict | None:
+    """
+    Return the login context for the state, so that the callback can finish the login. Returns None for unknown states.
+    """
+    if not state:
+        return None
+    return get_login_state_store().pop(state)
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+
+from fedauth.crypto import decrypt
+from fedauth.management.providers import FORMATS, KEY_FIELDS, MODELS, get_fields, get_format, get_row_writer
+
+
+class Command(BaseCommand):
+    """
+    Writes providers to a JSON Lines or CSV file that fedauth_import_providers can read: one row per provider, with its
+    domain (dynamic) or alias (static) first. Providers are streamed from the database in batches.
+
+    Client secrets are only exported with '--include-secrets', in plain text. Without them, the file can't be imported
+    as is.
+    """
+    help = 'Export providers to a JSON Lines or CSV file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to write ('-' for stdout).")
+        parser.add_argument('--model', choices=MODELS.keys(), default='dynamic', help='Provider type to export.')
+        parser.add_argument('--format', choices=FORMATS, help='File format. Defaults to csv for .csv files, jsonl otherwise.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of rows read per query.')
+        parser.add_argument('--include-secrets', action='store_true', help='Export client secrets in plain text.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = get_format(path, options['format'])
+        if path == '-':
+            self.export_rows(self.stdout, format, options)
+            return
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            total = self.export_rows(file, format, options)
+        self.stdout.write(self.style.SUCCESS(f"{options['model']}: done, {total} providers exported"))
+
+    @staticmethod
+    def export_rows(file, format, options) -> int:
+        model = MODELS[options['model']]
+        fields = get_fields(model)
+        columns = [field.name for field in fields]
+        if options['include_secrets']:
+            columns.append('client_secret')
+        write_row = get_row_writer(file, format, columns)
+
+        total = 0
+        providers = model.objects.order_by(KEY_FIELDS[model]).iterator(chunk_size=options['batch_size'])
+        for provider in providers:
+            row = {field.name: field.value_from_object(provider) for field in fields}
+            if options['include_secrets']:
+                # not cached like 'decrypt_secret': every secret is read once
+                row['client_secret'] = decrypt(provider.client_secret_cipher).decode()
+            write_row(row)
+            total += 1
+        return total
@@ -0,0 +1,94 @@
+import sys
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from fedauth.crypto import get_encryption_keys, get_multi_fernet
+from fedauth.management.providers import (
+    FORMATS,
+    KEY_FIELDS,
+    MODELS,
+    build_provider,
+    format_errors,
+    get_fields,
+    get_format,
+    invalidate_worker_caches,
+    read_rows,
+)
+
+
+class Command(BaseCommand):
+    """
+    Creates or updates providers from a JSON Lines or CSV file (see fedauth_export_providers for the columns). Rows are
+    matched to existing providers on their domain (dynamic) or alias (static); 'client_secret' is required on every row.
+
+    The file is streamed, and rows are written in batches, one transaction and one upsert query per batch. Invalid rows
+    are reported and skipped. Re-running an import is safe.
+    """
+    help = 'Create or update providers from a JSON Lines or CSV file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import ('-' for stdin).")
+        parser.add_argument('--model', choices=MODELS.keys(), default='dynamic', help='Provider type of the rows.')
+        parser.add_argument('--format', choices=FORMATS, help='File format. Defaults to csv for .csv files, jsonl otherwise.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of rows written per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Only validate the rows.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = get_format(path, options['format'])
+        if path == '-':
+            self.import_rows(sys.stdin, format, options)
+            return
+        # 'utf-8-sig' drops the byte order mark that spreadsheet applications write at the start of CSV files
+        with open(path, newline='', encoding='utf-8-sig') as file:
+            self.import_rows(file, format, options)
+
+    def import_rows(self, file, format, options):
+        name = options['model']
+        model = MODELS[name]
+        # one instance for the whole import: building a Fernet parses its key
+        fernet = get_multi_fernet(get_encryption_keys())
+        batch = {}
+        total = invalid = 0
+        try:
+            for line, row in read_rows(file, format):
+                if row is None:
+                    self.stderr.write(f'line {line}: invalid row')
+                    invalid += 1
+                    continue
+                try:
+                    provider = build_provider(model, row, fernet)
+                except ValidationError as error:
+                    self.stderr.write(f'line {line}: {format_errors(error)}')
+                    invalid += 1
+                    continue
+                # an upsert can't touch the same row twice, so the last row of a key wins
+                batch[getattr(provider, KEY_FIELDS[model])] = provider
+                if len(batch) >= options['batch_size']:
+                    total += self.write_batch(model, batch, options['dry_run'])
+                    self.stdout.write(f'{name}: imported {total} providers')
+            total += self.write_batch(model, batch, options['dry_run'])
+        finally:
+            # bulk_create skips model signals, so provider caches have to be dropped here.
+            invalidate_worker_caches(self)
+
+        action = 'validated' if options['dry_run'] else 'imported'
+        self.stdout.write(self.style.SUCCESS(f'{name}: done, {total} providers {action}, {invalid} invalid rows skipped'))
+
+    @staticmethod
+    def write_batch(model, batch, dry_run) -> int:
+        count = len(batch)
+        if count and not dry_run:
+            key = KEY_FIELDS[model]
+            update_fields = [field.name for field in get_fields(model) if field.name != key]
+            with transaction.atomic():
+                model.objects.bulk_create(
+                    batch.values(),
+                    update_conflicts=True,
+                    unique_fields=[key],
+                    update_fields=update_fields + ['client_secret_cipher', 'updated_at'],
+                )
+        batch.clear()
+        return count
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from fedauth.crypto import rotate
+from fedauth.management.providers import invalidate_worker_caches
+from fedauth.models import DynamicProvider, StaticProvider
+
+MODELS = {
+    'dynamic': DynamicProvider,
+    'static': StaticProvider,
+}
+
+
+class Command(BaseCommand):
+    """
+    Re-encrypts all provider client secrets with the primary key in FEDAUTH_ENCRYPTION_KEYS.
+
+    Rotation steps:
+    1. Prepend the new key to FEDAUTH_ENCRYPTION_KEYS (keep the old key in the list) and deploy.
+    2. Run this command.
+    3. Once running workers dropped their cached providers (see the command output), remove the old key from
+       FEDAUTH_ENCRYPTION_KEYS.
+
+    Rows are processed in primary key order, one transaction per batch. If the command is interrupted, it can be resumed
+    with '--model' and '--start-after' (the last primary key reported). Re-running over rows that were already rotated
+    is safe.
+    """
+    help = 'Re-encrypt provider client secrets with the primary encryption key.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=MODELS.keys(), help='Only rotate secrets of this provider type.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of rows updated per transaction.')
+        parser.add_argument('--start-after', type=int, default=0, help='Resume after this primary key (requires --model).')
+
+    def handle(self, *args, **options):
+        # primary keys of the provider tables are unrelated, a cutoff only makes sense for one of them
+        if options['start_after'] and not options['model']:
+            raise CommandError('--start-after requires --model.')
+        names = [options['model']] if options['model'] else list(MODELS)
+        try:
+            for name in names:
+                self.rotate_model(name, options['batch_size'], options['start_after'])
+        finally:
+            # bulk_update skips model signals, so provider caches have to be dropped here.
+            invalidate_worker_caches(self)
+
+    def rotate_model(self, name, batch_size, start_after):
+        model = MODELS[name]
+        last_pk = start_after
+        total = 0
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    model.objects.select_for_update()
+                    .filter(pk__gt=last_pk)
+                    .order_by('pk')
+                    .only('pk', 'client_secret_cipher')[:batch_size]
+                )
+                if not batch:
+                    break
+                for provider in batch:
+                    provider.client_secret_cipher = rotate(provider.client_secret_cipher)
+                model.objects.bulk_update(batch, ['client_secret_cipher'])
+            last_pk = batch[-1].pk
+            total += len(batch)
+            self.stdout.write(f'{name}: rotated {total} secrets (last pk {last_pk})')
+        self.stdout.write(self.style.SUCCESS(f'{name}: done, {total} secrets rotated'))
@@ -0,0 +1,135 @@
+"""
+Provider rows for the fedauth_import_providers and fedauth_export_providers commands. A row holds the provider's fields
+by name (its domain or alias first), and the plain text 'client_secret'. Rows are stored as JSON Lines or CSV.
+"""
+import csv
+import json
+
+from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
+from mozilla_django_oidc.utils import import_from_settings
+
+from fedauth.cache import invalidate_providers, provider_version
+from fedauth.discovery import ENDPOINT_METADATA
+from fedauth.models import DynamicProvider, StaticProvider
+
+MODELS = {
+    'dynamic': DynamicProvider,
+    'static': StaticProvider,
+}
+
+# field each provider type is identified by
+KEY_FIELDS = {
+    DynamicProvider: 'domain',
+    StaticProvider: 'provider',
+}
+
+FORMATS = ('jsonl', 'csv')
+
+
+def get_fields(model) -> list:
+    """
+    Fields of a row, in order: the key field first, then the provider settings. Timestamps and the secret ciphertext are
+    left out.
+    """
+    key = KEY_FIELDS[model]
+    fields = [
+        field for field in model._meta.concrete_fields
+        if field.editable and not field.primary_key and field.name not in (key, 'client_secret_cipher')
+    ]
+    return [model._meta.get_field(key)] + fields
+
+
+def get_format(path: str, format: str = None) -> str:
+    if format:
+        return format
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def read_rows(file, format: str):
+    """
+    Yield (line number, row) for every row of the file. Rows that can't be parsed are yielded as None.
+    """
+    if format == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            # cells beyond the header end up under the key None
+            yield reader.line_num, None if None in row else row
+        return
+
+    for line, text in enumerate(file, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError:
+            row = None
+        yield line, row if isinstance(row, dict) else None
+
+
+def get_row_writer(file, format: str, columns: list[str]):
+    """
+    Return a function that writes a row to the file.
+    """
+    if format == 'csv':
+        writer = csv.DictWriter(file, columns, lineterminator='\n')
+        writer.writeheader()
+        return writer.writerow
+    return lambda row: file.write(json.dumps(row) + '\n')
+
+
+def _get_value(field, value):
+    # empty values (missing keys, empty CSV cells) fall back to NULL or the field default
+    if value is None or value == '':
+        if field.null:
+            return None
+        if field.has_default():
+            return field.get_default()
+        return ''
+    return value
+
+
+def build_provider(model, row: dict, fernet):
+    """
+    Validate a row and return an unsaved provider, with its secret encrypted with 'fernet'. Uniqueness isn't checked:
+    rows are upserted on their key field.
+    :raises ValidationError: with a message dict
+    """
+    fields = get_fields(model)
+    unknown = set(row) - {field.name for field in fields} - {'client_secret'}
+    if unknown:
+        raise ValidationError({NON_FIELD_ERRORS: f"Unknown fields: {', '.join(sorted(unknown))}"})
+    secret = row.get('client_secret')
+    if not secret:
+        raise ValidationError({'client_secret': 'This field is required.'})
+
+    provider = model(**{field.name: _get_value(field, row.get(field.name)) for field in fields})
+    provider.full_clean(exclude=['client_secret_cipher'], validate_unique=False)
+    # endpoints are only optional when they can be discovered from the issuer (same as the admin form)
+    if not provider.issuer:
+        missing = [field for field in ENDPOINT_METADATA if not getattr(provider, field)]
+        if missing:
+            raise ValidationError({field: 'This field is required if no issuer is set.' for field in missing})
+    provider.client_secret_cipher = fernet.encrypt(str(secret).encode())
+    return provider
+
+
+def format_errors(error: ValidationError) -> str:
+    return '; '.join(
+        ' '.join(messages) if field == NON_FIELD_ERRORS else f"{field}: {' '.join(messages)}"
+        for field, messages in error.message_dict.items()
+    )
+
+
+def invalidate_worker_caches(command):
+    """
+    Drop provider caches after rows were written without model signals (bulk_create/bulk_update). Workers running with
+    FEDAUTH_PROVIDER_CACHE_BROADCAST pick the change up from the django cache; other workers only once their provider
+    caches expire, which the command reports.
+    """
+    invalidate_providers(shared=True)
+    if not provider_version.broadcast_enabled():
+        timeout = import_from_settings('FEDAUTH_PROVIDER_CACHE_TIMEOUT', 300)
+        command.stdout.write(command.style.WARNING(
+            f'Running workers pick up the changes within {timeout} seconds (FEDAUTH_PROVIDER_CACHE_TIMEOUT). '
+            'Restart them, or enable FEDAUTH_PROVIDER_CACHE_BROADCAST, to use the changes right away.'
+        ))
@@ -0,0 +1,167 @@
+"""
+Latency and outcome of every stage of the login flow, labelled by provider (domain or alias).
+
+    with measure('token', provider) as metric:
+        ...
+        metric.outcome = 'invalid'  # optional, defaults to 'success' (or 'error' if an exception is raised)
+
+Measurements go to the exporter configured with FEDAUTH_METRICS_EXPORTER (dotted path to a MetricsExporter class, or
+None to disable metrics). The default exporter keeps them in memory; PrometheusExporter exposes them with
+prometheus_client ('metrics' extra).
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from mozilla_django_oidc.utils import import_from_settings
+
+try:
+    import prometheus_client
+except ImportError:  # only needed for PrometheusExporter ('metrics' extra)
+    prometheus_client = None
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_METRICS_EXPORTER = 'fedauth.metrics.InProcessExporter'
+
+# stages of the login flow that are measured
+STAGES = (
+    'provider_lookup',  # find the provider of a login request
+    'auth_url',  # build the IdP auth url
+    'token',  # IdP token request
+    'userinfo',  # IdP userinfo request
+    'jwks',  # IdP JWKS request
+    'user_create',
+    'user_update',
+    'token_exchange',  # exchange of a short-lived code (or a batch of codes) for jwt tokens
+)
+
+# histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class MetricsExporter:
+
+    def observe(self, stage: str, seconds: float, provider: str, outcome: str):
+        raise NotImplementedError
+
+
+class InProcessExporter(MetricsExporter):
+    """
+    Keeps a histogram per (stage, provider, outcome) in memory, for this process only.
+    """
+
+    def __init__(self):
+        self._histograms = defaultdict(lambda: {'count': 0, 'sum': 0.0, 'buckets': [0] * (len(BUCKETS) + 1)})
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, provider, outcome):
+        with self._lock:
+            histogram = self._histograms[(stage, provider, outcome)]
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['buckets'][bisect_left(BUCKETS, seconds)] += 1
+
+    def snapshot(self) -> dict:
+        """
+        Return a copy of the histograms, keyed by (stage, provider, outcome). 'buckets' holds the number of
+        measurements per bucket of BUCKETS (not cumulative), and a last bucket for everything above.
+        """
+        with self._lock:
+            return {key: {**value, 'buckets': list(value['buckets'])} for key, value in self._histograms.items()}
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+class PrometheusExporter(MetricsExporter):
+    """
+    Exposes 'fedauth_stage_duration_seconds', a histogram labelled by stage, provider and outcome (its '_count' series
+    counts the measurements). Registered in prometheus_client's default registry, so it's served by whatever already
+    exposes the process's metrics (e.g. django-prometheus).
+    """
+
+    def __init__(self, registry=None):
+        if prometheus_client is None:
+            raise ImproperlyConfigured('PrometheusExporter requires prometheus_client (pip install "fedauth[metrics]")')
+        self.duration = prometheus_client.Histogram(
+            'fedauth_stage_duration_seconds',
+            'Duration of the stages of a fedauth login',
+            ['stage', 'provider', 'outcome'],
+            buckets=BUCKETS,
+            registry=registry or prometheus_client.REGISTRY,
+        )
+
+    def observe(self, stage, seconds, provider, outcome):
+        self.duration.labels(stage=stage, provider=provider, outcome=outcome).observe(seconds)
+
+
+@lru_cache(maxsize=4)
+def _get_metrics_exporter(path: str) -> MetricsExporter | None:
+    # resolved once per path: a misconfigured exporter (bad path, missing prometheus_client) disables metrics, with a
+    # single warning instead of an error on every measurement
+    try:
+        return import_string(path)()
+    except (ImportError, ImproperlyConfigured) as exc:
+        LOGGER.warning('Metrics are disabled, FEDAUTH_METRICS_EXPORTER %r could not be loaded: %s', path, exc)
+        return None
+
+
+def get_metrics_exporter() -> MetricsExporter | None:
+    path = import_from_settings('FEDAUTH_METRICS_EXPORTER', DEFAULT_METRICS_EXPORTER)
+    if path is None:
+        return None
+    return _get_metrics_exporter(path)
+
+
+def get_provider_label(provider) -> str:
+    """
+    Domain of a dynamic provider, or alias of a static provider. Empty when there is no provider.
+    """
+    if provider is None:
+        return ''
+    return getattr(provider, 'domain', None) or getattr(provider, 'provider', '')
+
+
+def record(stage: str, seconds: float, provider: str = '', outcome: str = 'success'):
+    exporter = get_metrics_exporter()
+    if exporter is None:
+        return
+    try:
+        exporter.observe(stage, seconds, provider, outcome)
+    except Exception:  # metrics should never break a login
+        LOGGER.exception('Failed to record %s metric', stage)
+
+
+class Measurement:
+
+    def __init__(self, provider):
+        self.provider = provider  # can be set during the stage, e.g. once the provider is found
+        self.outcome = None
+
+
+@contextmanager
+def measure(stage: str, provider=None):
+    """
+    Record the duration and outcome of a stage. Usable in async code too (it doesn't block).
+    :param provider: provider object, or its label
+    """
+    measurement = Measurement(provider)
+    outcome = 'success'
+    start = time.perf_counter()
+    try:
+        yield measurement
+    except BaseException:
+        outcome = 'error'
+        raise
+    finally:
+        provider = measurement.provider
+        label = provider if isinstance(provider, str) else get_provider_label(provider)
+        record(stage, time.perf_counter() - start, label, measurement.outcome or outcome)
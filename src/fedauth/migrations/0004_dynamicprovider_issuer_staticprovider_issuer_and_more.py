@@ -0,0 +1,63 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fedauth', '0003_rename_federatedprovider_dynamicprovider_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dynamicprovider',
+            name='issuer',
+            field=models.URLField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='staticprovider',
+            name='issuer',
+            field=models.URLField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='dynamicprovider',
+            name='auth_endpoint',
+            field=models.URLField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='dynamicprovider',
+            name='jwks_endpoint',
+            field=models.URLField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='dynamicprovider',
+            name='token_endpoint',
+            field=models.URLField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='dynamicprovider',
+            name='user_endpoint',
+            field=models.URLField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='staticprovider',
+            name='auth_endpoint',
+            field=models.URLField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='staticprovider',
+            name='jwks_endpoint',
+            field=models.URLField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='staticprovider',
+            name='token_endpoint',
+            field=models.URLField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='staticprovider',
+            name='user_endpoint',
+            field=models.URLField(blank=True),
+        ),
+    ]
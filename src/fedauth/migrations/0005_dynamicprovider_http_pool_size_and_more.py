@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fedauth', '0004_dynamicprovider_issuer_staticprovider_issuer_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dynamicprovider',
+            name='http_pool_size',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Max open connections to the IdP per worker. Defaults to FEDAUTH_HTTP_POOL_SIZE.', null=True),
+        ),
+        migrations.AddField(
+            model_name='dynamicprovider',
+            name='http_retries',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Retries for failed IdP requests. Defaults to FEDAUTH_HTTP_RETRIES.', null=True),
+        ),
+        migrations.AddField(
+            model_name='dynamicprovider',
+            name='http_timeout',
+            field=models.FloatField(blank=True, help_text='Seconds. Defaults to OIDC_TIMEOUT.', null=True),
+        ),
+        migrations.AddField(
+            model_name='staticprovider',
+            name='http_pool_size',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Max open connections to the IdP per worker. Defaults to FEDAUTH_HTTP_POOL_SIZE.', null=True),
+        ),
+        migrations.AddField(
+            model_name='staticprovider',
+            name='http_retries',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Retries for failed IdP requests. Defaults to FEDAUTH_HTTP_RETRIES.', null=True),
+        ),
+        migrations.AddField(
+            model_name='staticprovider',
+            name='http_timeout',
+            field=models.FloatField(blank=True, help_text='Seconds. Defaults to OIDC_TIMEOUT.', null=True),
+        ),
+    ]
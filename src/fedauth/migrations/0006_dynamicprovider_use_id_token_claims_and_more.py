@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fedauth', '0005_dynamicprovider_http_pool_size_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dynamicprovider',
+            name='use_id_token_claims',
+            field=models.BooleanField(default=False, help_text='Take user details from the ID token, and only call the userinfo endpoint if claims are missing.'),
+        ),
+        migrations.AddField(
+            model_name='staticprovider',
+            name='use_id_token_claims',
+            field=models.BooleanField(default=False, help_text='Take user details from the ID token, and only call the userinfo endpoint if claims are missing.'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from mozilla_django_oidc.utils import import_from_settings
 
-from fedauth.utils import get_dynamic_provider_settings, get_static_provider_settings
+from fedauth.tracing import span
+from fedauth.utils import get_dynamic_provider, get_provider_config, get_static_provider
 
 
 class AuthBackendSettingsMixin:
@@ -8,19 +9,34 @@ class AuthBackendSettingsMixin:
     Overrides base class 'get_settings' method
     This get_settings gets settings for both Dynamic and Static OIDC providers
     """
-    def get_settings(self, attr, *args):
+    _provider = None
+    _provider_key = None
+
+    def get_provider(self):
         """
         If 'domain' in request session, then the user is busy with a dynamic login
         If 'provider' in request session, then the user is busy with a static login
+
+        The provider object is memoized on the backend instance (one instance per authentication attempt), so that
+        the row is only loaded once, instead of once for every setting.
         """
-        request = self.request  # NOQA
-        domain = request.session.get('domain')
-        provider = request.session.get('provider')
-        is_dynamic = True if domain else False
-        if is_dynamic:
-            return get_dynamic_provider_settings(attr, domain, *args)
-        elif provider:
-            return get_static_provider_settings(attr, provider, *args)
-        else:
+        session = self.request.session  # NOQA
+        key = (session.get('domain'), session.get('provider'))
+        if key != self._provider_key:
+            domain, provider = key
+            with span('fedauth.provider_resolution', domain or provider):
+                if domain:
+                    self._provider = get_dynamic_provider(domain)
+                elif provider:
+                    self._provider = get_static_provider(provider)
+                else:
+                    self._provider = None
+            self._provider_key = key
+        return self._provider
+
+    def get_settings(self, attr, *args):
+        provider = self.get_provider()
+        if provider is None:
             # Fallback to global settings or defaults
             return import_from_settings(attr, *args)
+        return get_provider_config(provider, attr, *args)
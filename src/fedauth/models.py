@@ -1,6 +1,6 @@
 from django.db import models
 
-from fedauth.crypto import decrypt, encrypt, SIGN_ALGOS
+from fedauth.crypto import decrypt_secret, encrypt, SIGN_ALGOS
 
 
 class TimeStampedModel(models.Model):
@@ -12,21 +12,35 @@ class TimeStampedModel(models.Model):
 
 
 class BaseProvider(TimeStampedModel):
-    auth_endpoint = models.URLField()
-    token_endpoint = models.URLField()
-    user_endpoint = models.URLField()
-    jwks_endpoint = models.URLField()
+    # if an issuer is set, endpoints are resolved from the issuer's discovery document (see fedauth.discovery)
+    issuer = models.URLField(blank=True)
+    auth_endpoint = models.URLField(blank=True)
+    token_endpoint = models.URLField(blank=True)
+    user_endpoint = models.URLField(blank=True)
+    jwks_endpoint = models.URLField(blank=True)
     client_id = models.CharField(max_length=250)
     client_secret_cipher = models.BinaryField()
     sign_algo = models.CharField(max_length=5, choices=SIGN_ALGOS, default='RS256')
     scopes = models.CharField(max_length=250, default="openid profile email phone groups")  # IP configured scopes
+    # HTTP settings for token, userinfo and JWKS requests to the IdP (see fedauth.http). Fall back to global settings.
+    http_timeout = models.FloatField(null=True, blank=True, help_text='Seconds. Defaults to OIDC_TIMEOUT.')
+    http_pool_size = models.PositiveSmallIntegerField(
+        null=True, blank=True, help_text='Max open connections to the IdP per worker. Defaults to FEDAUTH_HTTP_POOL_SIZE.'
+    )
+    http_retries = models.PositiveSmallIntegerField(
+        null=True, blank=True, help_text='Retries for failed IdP requests. Defaults to FEDAUTH_HTTP_RETRIES.'
+    )
+    use_id_token_claims = models.BooleanField(
+        default=False,
+        help_text='Take user details from the ID token, and only call the userinfo endpoint if claims are missing.',
+    )
     objects = models.Manager()
 
     class Meta:
         abstract = True
 
     def get_client_secret(self) -> str:
-        return decrypt(self.client_secret_cipher).decode()
+        return decrypt_secret(self.client_secret_cipher).decode()
 
     def set_client_secret(self, client_secret: str):
         self.client_secret_cipher = encrypt(client_secret.encode())
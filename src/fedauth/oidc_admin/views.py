@@ -3,8 +3,8 @@ from django.contrib.auth.views import LoginView as DjangoLoginView
 from django.shortcuts import redirect
 from django.urls import reverse
 
-from fedauth.models import DynamicProvider
 from fedauth.oidc_admin.forms import UsernameForm
+from fedauth.utils import find_dynamic_provider
 
 
 class LoginView(DjangoLoginView):
@@ -28,13 +28,13 @@ class LoginView(DjangoLoginView):
             # 1. get domain from username
             username = form.cleaned_data['username']
             domain = username.split('@')[-1]
-            # 2. check if there is a federated provider object that matches domain
-            db_provider_exists = DynamicProvider.objects.filter(domain=domain).exists()
+            # 2. check if there is a federated provider object that matches domain (or a parent domain)
+            provider = find_dynamic_provider(domain)
             # 3. Determine which view to redirect to
             # 'fed-provider-auth' for OIDC authentication flow, 'default-admin-login' for standard django auth flow
-            if db_provider_exists:
+            if provider:
                 next_view = 'fed-provider-auth'
-                request.session['domain'] = domain  # Needed during OIDC callback.
+                request.session['domain'] = provider.domain  # Needed during OIDC callback.
             else:
                 next_view = 'default-admin-login'
             # 4. redirect to next url with username as context (needed for both flows)
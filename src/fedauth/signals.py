@@ -0,0 +1,15 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from fedauth.cache import invalidate_providers
+from fedauth.models import DynamicProvider, StaticProvider
+
+
+@receiver([post_save, post_delete], sender=DynamicProvider)
+@receiver([post_save, post_delete], sender=StaticProvider)
+def provider_changed(sender, **kwargs):
+    # invalidate straight away for this request, and again once the change is committed, so that no other request
+    # can re-cache the old row in between.
+    invalidate_providers()
+    transaction.on_commit(invalidate_providers)
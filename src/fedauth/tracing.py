@@ -0,0 +1,54 @@
+"""
+OpenTelemetry spans for the login flow, if opentelemetry-api is installed ('tracing' extra). Without it, 'span' is a
+no-op that returns a shared null context.
+
+A frontend login is made of two separate HTTP requests (the login request, and the IdP's callback), so they end up in
+separate traces. Both carry the 'fedauth.state' attribute, a hash of the OIDC state parameter, to link them. The state
+itself isn't recorded: it's the key to a pending login.
+"""
+import hashlib
+from contextlib import nullcontext
+
+from fedauth.metrics import get_provider_label
+
+try:
+    from opentelemetry import trace
+except ImportError:  # only needed for tracing ('tracing' extra)
+    trace = None
+
+STATE_ATTRIBUTE = 'fedauth.state'
+PROVIDER_ATTRIBUTE = 'fedauth.provider'
+
+_null_span = nullcontext()
+
+
+def get_state_hash(state: str) -> str:
+    return hashlib.sha256(state.encode()).hexdigest()[:32]
+
+
+def _attributes(provider=None, state=None, **attributes) -> dict:
+    if provider is not None:
+        attributes[PROVIDER_ATTRIBUTE] = provider if isinstance(provider, str) else get_provider_label(provider)
+    if state:
+        attributes[STATE_ATTRIBUTE] = get_state_hash(state)
+    return {key: value for key, value in attributes.items() if value is not None}
+
+
+def span(name: str, provider=None, state=None, **attributes):
+    """
+    Start a span as the current span (a context manager).
+    :param provider: provider object, or its label
+    :param state: OIDC state parameter, recorded as a hash
+    """
+    if trace is None:
+        return _null_span
+    return trace.get_tracer('fedauth').start_as_current_span(name, attributes=_attributes(provider, state, **attributes))
+
+
+def set_span_attributes(provider=None, state=None, **attributes):
+    """
+    Add attributes to the current span, for values that are only known once the span started (e.g. a new state).
+    """
+    if trace is None:
+        return
+    trace.get_current_span().set_attributes(_attributes(provider, state, **attributes))
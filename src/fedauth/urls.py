@@ -1,9 +1,10 @@
 from django.urls import path, include
 
-from fedauth.views import AuthenticationCallbackView
+from fedauth.views import AuthenticationCallbackView, AsyncAuthenticationCallbackView
 
 urlpatterns = [
     path('callback/', AuthenticationCallbackView.as_view(), name='oidc-provider-callback'),
+    path('callback/async/', AsyncAuthenticationCallbackView.as_view(), name='oidc-provider-callback-async'),
     path('authenticate/', include('fedauth.dynamic_oidc.urls')),
     path('login/', include('fedauth.frontend_oidc.urls'))
 ]
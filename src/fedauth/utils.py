@@ -1,27 +1,75 @@
 from mozilla_django_oidc.utils import import_from_settings
 
+from fedauth.cache import get_or_load
 from fedauth.constants import SETTINGS_MAP
+from fedauth.discovery import ENDPOINT_METADATA, get_endpoint
+from fedauth.domains import domain_index
 from fedauth.models import DynamicProvider, StaticProvider
 
 
 def get_provider_config(provider, attr, *args):
     # Most settings are stored on te model, but some settings are global settings defined in config
     try:
-        attr = SETTINGS_MAP[attr]
+        field = SETTINGS_MAP[attr]
     except KeyError:
         # check for global settings if setting not in map
         return import_from_settings(attr, *args)
 
-    if args:
-        return getattr(provider, attr, args[0])
-    return getattr(provider, attr)
+    if field in ENDPOINT_METADATA:
+        return get_endpoint(provider, field)
+    value = getattr(provider, field, args[0]) if args else getattr(provider, field)
+    if value is None:
+        # optional provider fields that are left empty fall back to global settings
+        return import_from_settings(attr, *args)
+    return value
+
+
+def get_cached_provider(model, field, value):
+    """
+    Providers are read on every login, but rarely change, so rows are kept in the process wide provider cache.
+    """
+    key = (model._meta.label, value)
+    return get_or_load(key, lambda: model.objects.get(**{field: value}))
+
+
+def get_dynamic_provider(domain):
+    return get_cached_provider(DynamicProvider, 'domain', domain)
+
+
+def find_dynamic_provider(domain):
+    """
+    Find the dynamic provider for an email domain. A provider also serves the subdomains of its domain (e.g. the
+    'company.com' provider is used for 'eu.company.com'), and the longest matching domain wins.
+    Returns None if there is no matching provider. Non-matching domains are answered from memory (see DomainIndex).
+    """
+    provider_domain = domain_index.match(domain)
+    if provider_domain is None:
+        return None
+    try:
+        return get_dynamic_provider(provider_domain)
+    except DynamicProvider.DoesNotExist:  # deleted since the index was built
+        return None
+
+
+def get_static_provider(alias):
+    return get_cached_provider(StaticProvider, 'provider', alias)
+
+
+def find_static_provider(alias):
+    """
+    Find the static provider for an alias. Returns None if there is no such provider.
+    """
+    try:
+        return get_static_provider(alias)
+    except StaticProvider.DoesNotExist:
+        return None
 
 
 def get_dynamic_provider_settings(attr, domain, *args):
-    provider = DynamicProvider.objects.get(domain=domain)
+    provider = get_dynamic_provider(domain)
     return get_provider_config(provider, attr, *args)
 
 
 def get_static_provider_settings(attr, alias, *args):
-    provider = StaticProvider.objects.get(provider=alias)
+    provider = get_static_provider(alias)
     return get_provider_config(provider, attr, *args)
@@ -1,13 +1,20 @@
 import secrets
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.contrib.sessions.backends.cache import SessionStore
+from django.contrib import auth
 from django.core.cache import cache
+from django.core.exceptions import SuspiciousOperation
 from django.shortcuts import resolve_url
+from mozilla_django_oidc.utils import import_from_settings
 from mozilla_django_oidc.views import (
     OIDCAuthenticationCallbackView
 )
-from rest_framework_simplejwt.tokens import RefreshToken
+
+from fedauth.backends import aauthenticate
+from fedauth.frontend_oidc.utils import get_tokens_for_user
+from fedauth.login_context import LOGIN_CONTEXT_FIELDS, pop_login_context
+from fedauth.tracing import span
 
 
 class AuthenticationCallbackView(OIDCAuthenticationCallbackView):
@@ -16,67 +23,127 @@ class AuthenticationCallbackView(OIDCAuthenticationCallbackView):
     The baseclass `get` method calls auth.authenticate(), which in turns calls The Auth backend defined in
     settings (AUTHENTICATION_BACKENDS), which will handle user creation/update/authentication.
     """
+    login_context = None
+
+    def pop_redirect_url(self, key):
+        # remove from session storage. The url of the login context takes precedence: if the browser's session belongs
+        # to another user, logging in flushes the session before the success url is read.
+        url = self.request.session.pop(key, None)
+        if self.login_context:
+            url = self.login_context.get(key) or url
+        return url
+
     @property
     def failure_url(self):
         # 'fail' url will only be set/present if the flow originated from the frontend. If there is no next url, then
         # we can safely assume that we are busy with an admin login.
-        next_url = self.request.session.get('fail')
-        self.request.session.pop('fail', None)  # remove from session storage
+        next_url = self.pop_redirect_url('fail')
         return next_url or self.get_settings('LOGIN_REDIRECT_URL_FAILURE', '/')
 
     @property
     def success_url(self):
         # if frontend login (i.e. next url in session), generate and cache user tokens, and return short-lived code
         # that can be exchanged with token exchange API.
-        next_url = self.request.session.get('next', None)
+        next_url = self.pop_redirect_url('next')
         if next_url:
-            # generate a refresh token object to get refresh and access tokens
-            tokens = RefreshToken.for_user(user=self.request.user)
-            jwt_data = {
-                'access_token': str(tokens.access_token),
-                'refresh_token': str(tokens)
-            }
-
-            # Generate a short-lived auth code and cache jwt_data.
+            if import_from_settings('FEDAUTH_LAZY_TOKENS', False):
+                # only remember who logged in, the tokens are minted when (and if) the code is exchanged
+                code_data = {'user_id': self.request.user.pk}
+            else:
+                code_data = get_tokens_for_user(self.request.user)
+
+            # Generate a short-lived auth code and cache code_data.
             code = secrets.token_urlsafe(32)
-            cache.set(f'auth_code:{code}', jwt_data, timeout=settings.OIDC_SL_CODE_TIMEOUT)
+            cache.set(f'auth_code:{code}', code_data, timeout=settings.OIDC_SL_CODE_TIMEOUT)
             # add code as url param - fronted can use this to retrieve jwt
             next_url = f'{next_url}?code={code}'
-            self.request.session.pop('next', None)  # remove from session
         # use next_url if fronted login, else fallback to default admin login
         return next_url or resolve_url(self.get_settings('LOGIN_REDIRECT_URL', '/'))
 
-    @staticmethod
-    def retrieve_session_by_id(session_id):
-        session_store = SessionStore(session_key=session_id)
-        if session_store.exists(session_id):
-            return session_store.load()
-        return None
-
     def get(self, request):
         """
         If oidc flow originates from frontend (via API), then there will be 2 separate sessions in play by the time
         this callback is called by the idP. There will be:
         1 session between frontend and backend (session A)
         1 session between backend and idP (session B)
-        This is a problem, because the session between frontend and backend contains all the OIDC context that is needed
+        This is a problem, because the login request from the frontend knows all the OIDC context that is needed
         during callback to authenticate the correct user, and since session B is a different session altogether,
-        we don't have the context during the callback. Yikes.
+        we don't have the context during the callback.
+
+        The OIDC flow provides us with a solution. There is a 'state' parameter that is persisted throughout the entire
+        OIDC flow (url parameter, so not tied to session). During the initial login request, the context is stored in the
+        login state store (see fedauth.login_context): by default a small cache record keyed by the state, so here it
+        takes a single cache fetch to get it back. The record is removed when it is read, so a state can only be used
+        once.
+
+        Admin logins start and end in the same browser session, so they have no login context and are handled by
+        mozilla's view.
+        """
+        state = request.GET.get('state')
+        with span('fedauth.callback', state=state):
+            with span('fedauth.login_context'):
+                context = pop_login_context(state)
+            if context is None:
+                return super().get(request)
+            return self.authenticate_with_context(request, context)
 
-        This is where we need to introduce some magic. The OIDC flow provides as with a solution. There is a 'state'
-        parameter that is persisted throughout the entire OIDC flow (url parameter, so not tied to session).
-        We can set this state during the initial login request.
+    def apply_login_context(self, request, context):
+        # the backend (provider lookup) and the success/failure urls read these values from the session
+        self.login_context = context
+        request.session.update({key: context[key] for key in LOGIN_CONTEXT_FIELDS if key in context})
 
-        So we set our initial session ID as the state parameter! Then, during the callback, we can retrieve the original
-        session using the state parameter, and join the two sessions into one, thereby providing all the OIDC context
-        that is needed for the callback authentication to happen.
+    def authenticate_with_context(self, request, context):
+        self.apply_login_context(request, context)
+        if request.GET.get('error') or 'code' not in request.GET:
+            if request.user.is_authenticated:
+                auth.logout(request)
+            return self.login_failure()
+
+        self.user = auth.authenticate(request=request, nonce=context['nonce'], code_verifier=context.get('code_verifier'))
+        if self.user and self.user.is_active:
+            return self.login_success()
+        return self.login_failure()
+
+
+class AsyncAuthenticationCallbackView(AuthenticationCallbackView):
+    """
+    Async version of the callback view, for ASGI deployments. The token and userinfo requests to the IdP don't block
+    a worker thread (see AsyncOIDCAuthenticationBackend), so a few workers can serve many logins at the same time.
+    To use it, point OIDC_AUTHENTICATION_CALLBACK_URL to 'oidc-provider-callback-async'.
+    """
+
+    def start_authentication(self, request, state):
+        """
+        Frontend logins: apply the login context of the state (see `get` above). Admin logins: do the same checks as
+        mozilla's callback, the state must be in the session, and is removed from it to prevent replay attacks.
+        Returns the nonce and code verifier of the state, or None if there is nothing to authenticate with.
         """
+        with span('fedauth.login_context'):
+            context = pop_login_context(state)
+        if context is not None:
+            self.apply_login_context(request, context)
+            return {'nonce': context['nonce'], 'code_verifier': context.get('code_verifier')}
 
+        if 'oidc_states' not in request.session:
+            return None
+        if state not in request.session['oidc_states']:
+            raise SuspiciousOperation('OIDC callback state not found in session `oidc_states`!')
+        oidc_state = request.session['oidc_states'].pop(state)
+        request.session.save()
+        # reload the session after authenticating, so that changes made by parallel requests aren't overwritten
+        request.session = request.session.__class__(request.session.session_key)
+        return {'nonce': oidc_state['nonce'], 'code_verifier': oidc_state.get('code_verifier')}
+
+    async def get(self, request):
         state = request.GET.get('state')
-        session_data = self.retrieve_session_by_id(state)  # retrieve original session
-        if session_data:
-            request.session.clear()
-            request.session.update(session_data)
-            request.session.modified = True
-            request.session._session_key = state
-        return super().get(request)
+        if request.GET.get('error') or 'code' not in request.GET or not state:
+            # no IdP requests needed, let the sync view handle it
+            return await sync_to_async(super().get)(request)
+
+        with span('fedauth.callback', state=state):
+            kwargs = await sync_to_async(self.start_authentication)(request, state)
+            if kwargs is not None:
+                self.user = await aauthenticate(request=request, **kwargs)
+                if self.user and self.user.is_active:
+                    return await sync_to_async(self.login_success)()
+            return await sync_to_async(self.login_failure)()
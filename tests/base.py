@@ -1,7 +1,17 @@
+import json
+from contextlib import contextmanager
+from pathlib import Path
+from unittest.mock import patch
 from urllib.request import Request
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.crypto import get_random_string
+from redis.client import Pipeline, Redis
 from rest_framework.test import APIClient, APITestCase
 
+from fedauth.login_context import save_login_context
+
 
 class BaseApiTestCase(APITestCase):
     client: APIClient
@@ -27,3 +37,76 @@ class FakeToken:
 
     def __str__(self) -> str:
         return 'refresh'
+
+
+def start_login(domain='company.com', extra_data=None):
+    """
+    Store the login context that the login view would have stored (frontend login flow). Returns the state and nonce.
+    """
+    nonce = get_random_string(32)
+    state = save_login_context({'domain': domain, 'nonce': nonce, **(extra_data or {})})
+    return state, nonce
+
+
+class CaptureCacheOps:
+    """
+    Like django's CaptureQueriesContext, for redis: records the commands sent to redis in the block. A pipeline is sent
+    in one round trip, so it's recorded as a single 'PIPELINE' operation.
+
+        with CaptureCacheOps() as ops:
+            ...
+        assert len(ops) == 2
+    """
+
+    def __init__(self):
+        self.operations = []
+        self._patches = []
+
+    def __len__(self):
+        return len(self.operations)
+
+    def __enter__(self):
+        operations = self.operations
+        execute_command, execute_pipeline = Redis.execute_command, Pipeline.execute
+
+        def count_command(client, *args, **options):
+            operations.append(args[0])
+            return execute_command(client, *args, **options)
+
+        def count_pipeline(pipeline, *args, **kwargs):
+            operations.append('PIPELINE')
+            return execute_pipeline(pipeline, *args, **kwargs)
+
+        self._patches = [patch.object(Redis, 'execute_command', count_command), patch.object(Pipeline, 'execute', count_pipeline)]
+        for patcher in self._patches:
+            patcher.start()
+        return self
+
+    def __exit__(self, *args):
+        for patcher in reversed(self._patches):
+            patcher.stop()
+
+
+BUDGETS_FILE = Path(__file__).parent / 'budgets.json'
+
+
+class BudgetTestMixin:
+    """
+    Checks requests against the maximum number of database queries and cache (redis) operations allowed for their
+    entry point, as recorded in tests/budgets.json. A change that needs more has to raise the budget explicitly.
+    """
+    budgets = json.loads(BUDGETS_FILE.read_text())
+
+    @contextmanager
+    def assertWithinBudget(self, entry_point):  # named like assertNumQueries
+        budget = self.budgets[entry_point]
+        with CaptureQueriesContext(connection) as queries, CaptureCacheOps() as cache_ops:
+            yield
+        if len(queries) > budget['queries']:
+            sql = '\n'.join(query['sql'] for query in queries.captured_queries)
+            self.fail(f"'{entry_point}' made {len(queries)} queries, budget is {budget['queries']}:\n{sql}")
+        if len(cache_ops) > budget['cache_ops']:
+            self.fail(
+                f"'{entry_point}' made {len(cache_ops)} cache operations, budget is {budget['cache_ops']}: "
+                f"{', '.join(cache_ops.operations)}"
+            )
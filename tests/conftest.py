@@ -0,0 +1,10 @@
+import pytest
+
+from fedauth.cache import invalidate_providers
+
+
+@pytest.fixture(autouse=True)
+def clear_provider_caches():
+    # provider caches live in process memory, so they outlive the db rollback between tests.
+    invalidate_providers()
+    yield
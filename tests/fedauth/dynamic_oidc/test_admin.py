@@ -63,6 +63,34 @@ class TestDynamicOidcAdmin(TestCase):
         encrypted_secret = new_fp.client_secret_cipher
         assert decrypt(encrypted_secret).decode() == client_secret
 
+    def test_create_fp_with_issuer(self):
+        # endpoints are optional when an issuer is set
+        resp = self.client.post(self.create_url, {
+            'domain': 'somecompany.com',
+            'issuer': 'https://provider.com/realms/somecompany',
+            'client_id': 'a1123a67-1423-4124-24hg-7h12k124h3hj',
+            'client_secret': 'topsecret',
+            'sign_algo': 'RS256',
+            'scopes': "openid profile email phone groups",
+        })
+        assert resp.status_code == 302
+        assert DynamicProvider.objects.get(domain='somecompany.com').issuer == 'https://provider.com/realms/somecompany'
+
+    def test_create_fp_without_issuer_or_endpoints(self):
+        resp = self.client.post(self.create_url, {
+            'domain': 'somecompany.com',
+            'client_id': 'a1123a67-1423-4124-24hg-7h12k124h3hj',
+            'client_secret': 'topsecret',
+            'sign_algo': 'RS256',
+            'scopes': "openid profile email phone groups",
+        })
+        assert resp.status_code == 200
+        form = resp.context['adminform'].form
+        assert form.errors == {
+            field: ['This field is required if no issuer is set.']
+            for field in ('auth_endpoint', 'token_endpoint', 'user_endpoint', 'jwks_endpoint')
+        }
+
     def test_client_secret_read(self):
         assert 'client_secret' not in self.admin.get_fields(FakeRequest, self.dynamic_provider)
 
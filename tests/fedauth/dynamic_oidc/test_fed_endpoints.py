@@ -15,3 +15,16 @@ class TestDbProviderAuthEndpoints(BaseApiTestCase):
         resp = self.get(self.auth_url)
         assert resp.status_code == 302  # redirect
         assert resp.url.startswith(self.provider_fed.auth_endpoint)
+
+    def test_db_provider_loaded_once_per_request(self):
+        # every setting used to build the auth url is served from a single provider lookup (plus building the domain
+        # index on first use)
+        with self.assertNumQueries(2):
+            resp = self.get(self.auth_url)
+        assert resp.status_code == 302
+
+    def test_db_provider_subdomain_authenticate_redirect(self):
+        url = reverse_lazy('fed-provider-auth', kwargs={'username': 'andy@eu.random.com'})
+        resp = self.get(url)
+        assert resp.status_code == 302
+        assert resp.url.startswith(self.provider_fed.auth_endpoint)
@@ -1,11 +1,14 @@
 import secrets
 from urllib.parse import urlencode, urlparse, parse_qs
 
-from django.contrib.sessions.backends.cache import SessionStore
+from django.contrib.auth import get_user_model
 from django.core.cache import cache as default_cache  # to prevent fixture clash
 from django.test import override_settings
 from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
+from fedauth.login_context import get_login_context_key
+from fedauth.metrics import get_metrics_exporter
 from tests.base import BaseApiTestCase
 from tests.factories import DynamicProviderFactory, StaticProviderFactory
 
@@ -88,20 +91,72 @@ class TestLoginApi(BaseApiTestCase):
         assert auth_url
         assert auth_url.startswith(self.fp.auth_endpoint)
 
-        # assert that generated url's "state" param matches an existing session.
-        parsed_url = urlparse(auth_url)
-        state = parse_qs(parsed_url.query)['state'][0]
-        session_store = SessionStore(session_key=state)
-        assert session_store.exists(state)
+        # assert that generated url's "state" param matches a login context.
+        params = parse_qs(urlparse(auth_url).query)
+        context = default_cache.get(get_login_context_key(params['state'][0]))
 
-        # check that appropriate values are stored in session
-        session = session_store.load()
-        assert session.get('domain') == 'hogwarts.com'
-        assert session.get('next') == self.valid_url
-        assert session.get('fail') == self.valid_url
+        # check that appropriate values are stored in the login context
+        assert context.get('domain') == 'hogwarts.com'
+        assert context.get('next') == self.valid_url
+        assert context.get('fail') == self.valid_url
+        assert context.get('nonce') == params['nonce'][0]
 
-        # double check that provider isn't in session (since not a static oidc login request)
-        assert not session.get('provider')
+        # double check that provider isn't in the context (since not a static oidc login request)
+        assert not context.get('provider')
+        # the login context is all the callback needs, so no session is created
+        assert not resp.wsgi_request.session.session_key
+
+    def test_login_subdomain_username_request_success(self):
+        # subdomains of a provider domain use the same provider
+        resp = self.post(url=self.full_url, data={'username': 'hagrid@staff.hogwarts.com'})
+        assert resp.status_code == 200
+        assert resp.json()['auth_url'].startswith(self.fp.auth_endpoint)
+
+    def test_login_username_request_query_count(self):
+        # provider choices, domain index and provider row. The provider is resolved once for the whole request.
+        with self.assertNumQueries(3):
+            resp = self.post(url=self.full_url, data={'username': 'hagrid@hogwarts.com'})
+        assert resp.status_code == 200
+        # once provider choices, domain index and provider are cached, the login request needs no queries
+        with self.assertNumQueries(0):
+            resp = self.post(url=self.full_url, data={'username': 'hagrid@hogwarts.com'})
+        assert resp.status_code == 200
+
+    def test_login_static_provider_request_query_count(self):
+        # provider choices and provider row
+        with self.assertNumQueries(2):
+            resp = self.post(url=self.full_url, data={'provider': 'okta'})
+        assert resp.status_code == 200
+        with self.assertNumQueries(0):
+            resp = self.post(url=self.full_url, data={'provider': 'okta'})
+        assert resp.status_code == 200
+
+    def test_new_static_provider_choice_available_immediately(self):
+        data = {'provider': 'google'}
+        resp = self.post(url=self.full_url, data=data)
+        assert resp.status_code == 400
+        # provider added on admin page
+        StaticProviderFactory(provider='google')
+        resp = self.post(url=self.full_url, data=data)
+        assert resp.status_code == 200
+
+    def test_login_unknown_domain(self):
+        # no provider for domain, so no auth url (frontend should fall back to default login)
+        resp = self.post(url=self.full_url, data={'username': 'hagrid@gmail.com'})
+        assert resp.status_code == 200
+        assert resp.json() == {'auth_url': None}
+
+    def test_login_metrics(self):
+        exporter = get_metrics_exporter()
+        exporter.clear()
+        self.post(url=self.full_url, data={'username': 'hagrid@hogwarts.com'})
+        self.post(url=self.full_url, data={'username': 'hagrid@gmail.com'})
+        assert set(exporter.snapshot()) == {
+            ('provider_lookup', 'hogwarts.com', 'found'),
+            ('auth_url', 'hogwarts.com', 'success'),
+            # unknown domains aren't used as label
+            ('provider_lookup', '', 'not_found'),
+        }
 
     def test_login_static_provider_request_success(self):
         """
@@ -116,20 +171,17 @@ class TestLoginApi(BaseApiTestCase):
         assert auth_url
         assert auth_url.startswith(self.gp.auth_endpoint)
 
-        # assert that generated url's "state" param matches an existing session.
-        parsed_url = urlparse(auth_url)
-        state = parse_qs(parsed_url.query)['state'][0]
-        session_store = SessionStore(session_key=state)
-        assert session_store.exists(state)
+        # assert that generated url's "state" param matches a login context.
+        state = parse_qs(urlparse(auth_url).query)['state'][0]
+        context = default_cache.get(get_login_context_key(state))
 
-        # check that session contains all the values that is needed for callback
-        session = session_store.load()
-        assert session.get('provider') == 'okta'
-        assert session.get('next') == self.valid_url
-        assert session.get('fail') == self.valid_url
+        # check that the context contains all the values that is needed for callback
+        assert context.get('provider') == 'okta'
+        assert context.get('next') == self.valid_url
+        assert context.get('fail') == self.valid_url
 
-        # double check that domain isn't in session (since not a dynamic login request)
-        assert not session.get('domain')
+        # double check that domain isn't in the context (since not a dynamic login request)
+        assert not context.get('domain')
 
 
 class TestTokenExchangeApi(BaseApiTestCase):
@@ -165,3 +217,60 @@ class TestTokenExchangeApi(BaseApiTestCase):
         resp = self.post(self.url, data=data)
         assert resp.status_code == 200
         assert resp.json() == self.jwt_data
+        # codes are single use
+        resp = self.post(self.url, data=data)
+        assert resp.status_code == 400
+
+    def test_exchange_lazy_code(self):
+        # code cached by the callback with FEDAUTH_LAZY_TOKENS, the tokens are minted on exchange
+        user = get_user_model().objects.create(username='hagrid@hogwarts.com')
+        default_cache.set('auth_code:lazy', {'user_id': user.pk})
+        resp = self.post(self.url, data={'code': 'lazy'})
+        assert resp.status_code == 200
+        assert RefreshToken(resp.json()['refresh_token'])['user_id'] == str(user.pk)
+        assert AccessToken(resp.json()['access_token'])['user_id'] == str(user.pk)
+
+    def test_exchange_lazy_code_inactive_user(self):
+        user = get_user_model().objects.create(username='hagrid@hogwarts.com', is_active=False)
+        default_cache.set('auth_code:lazy', {'user_id': user.pk})
+        resp = self.post(self.url, data={'code': 'lazy'})
+        assert resp.status_code == 400
+        assert resp.json() == {'detail': ['Code Invalid or expired']}
+
+
+class TestBatchTokenExchangeApi(BaseApiTestCase):
+
+    def setUp(self):
+        self.url = reverse('token-exchange-batch')
+        self.jwt_data = {'access_token': 'access', 'refresh_token': 'refresh'}
+        default_cache.set('auth_code:code1', self.jwt_data)
+        self.user = get_user_model().objects.create(username='hagrid@hogwarts.com')
+        default_cache.set('auth_code:code2', {'user_id': self.user.pk})
+
+    def tearDown(self):
+        default_cache.clear()
+
+    def test_exchange_codes(self):
+        resp = self.client.post(self.url, {'codes': ['code1', 'expired', 'code2', 'code1']}, format='json')
+        assert resp.status_code == 200
+        results = resp.json()['results']
+        assert [result['code'] for result in results] == ['code1', 'expired', 'code2']
+        assert results[0] == {'code': 'code1', **self.jwt_data}
+        assert results[1] == {'code': 'expired', 'detail': 'Code Invalid or expired'}
+        assert RefreshToken(results[2]['refresh_token'])['user_id'] == str(self.user.pk)
+
+        # codes are single use
+        resp = self.client.post(self.url, {'codes': ['code1', 'code2']}, format='json')
+        assert all(result.get('detail') for result in resp.json()['results'])
+
+    @override_settings(FEDAUTH_TOKEN_EXCHANGE_BATCH_SIZE=2)
+    def test_exchange_too_many_codes(self):
+        resp = self.client.post(self.url, {'codes': ['code1', 'code2', 'code3']}, format='json')
+        assert resp.status_code == 400
+        assert resp.json() == {'codes': ['Ensure this field has no more than 2 codes.']}
+        # nothing was redeemed
+        assert default_cache.get('auth_code:code1') == self.jwt_data
+
+    def test_exchange_no_codes(self):
+        resp = self.client.post(self.url, {'codes': []}, format='json')
+        assert resp.status_code == 400
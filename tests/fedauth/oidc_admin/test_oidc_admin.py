@@ -17,6 +17,14 @@ class TestAdminLoginView(BaseApiTestCase):
         assert resp.status_code == 302
         assert resp.url == reverse_lazy('fed-provider-auth', kwargs={'username': self.username})
 
+    def test_admin_with_federated_subdomain_username(self):
+        username = 'wynand@eu.byteorbit.com'
+        resp = self.post(self.auth_url, data={'username': username})
+        assert resp.status_code == 302
+        assert resp.url == reverse_lazy('fed-provider-auth', kwargs={'username': username})
+        # the provider domain is stored for the callback, not the subdomain
+        assert self.client.session['domain'] == 'byteorbit.com'
+
     def test_admin_with_non_federated_username(self):
         non_federated_username = 'john@gmail.com'
         resp = self.post(self.auth_url, data={'username': non_federated_username})
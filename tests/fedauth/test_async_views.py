@@ -0,0 +1,99 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache as default_cache  # to prevent fixture clash
+from django.test import TestCase, AsyncClient, override_settings
+from django.urls import reverse
+
+from fedauth.jwks import jwks_cache
+from tests.base import start_login
+from tests.factories import DynamicProviderFactory
+from tests.stub_idp import StubIdP
+
+CLAIMS = {'email': 'user@company.com', 'given_name': 'Jane', 'family_name': 'Doe', 'groups': ['admin']}
+
+
+@override_settings(
+    AUTHENTICATION_BACKENDS=['fedauth.backends.AsyncOIDCAuthenticationBackend'],
+    OIDC_AUTHENTICATION_CALLBACK_URL='oidc-provider-callback-async',
+)
+class TestAsyncCallbackView(TestCase):
+    """
+    Full login flows against a stub IdP, through the async callback view.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.idp = StubIdP().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.idp.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        jwks_cache.clear()
+        self.provider = DynamicProviderFactory(domain='company.com', **self.idp.provider_fields())
+        self.callback_url = reverse('oidc-provider-callback-async')
+
+    def tearDown(self):
+        default_cache.clear()
+
+    async def test_admin_login(self):
+        state, nonce = start_login()
+        code = self.idp.authorize(CLAIMS, nonce)
+
+        resp = await AsyncClient().get(f'{self.callback_url}?code={code}&state={state}')
+        assert resp.status_code == 302
+        assert resp.url == '/'
+        user = await get_user_model().objects.aget(username='user@company.com')
+        assert user.first_name == 'Jane'
+        assert user.is_staff
+
+    async def test_frontend_login(self):
+        state, nonce = start_login(extra_data={'next': 'https://some_site.com/home/', 'fail': 'https://some_site.com/fail/'})
+        code = self.idp.authorize(CLAIMS, nonce)
+
+        resp = await AsyncClient().get(f'{self.callback_url}?code={code}&state={state}')
+        assert resp.status_code == 302
+        assert resp.url.startswith('https://some_site.com/home/?code=')
+        code = resp.url.split('code=')[-1]
+        assert set(await default_cache.aget(f'auth_code:{code}')) == {'access_token', 'refresh_token'}
+
+    async def test_userinfo_skipped_with_id_token_claims(self):
+        self.provider.use_id_token_claims = True
+        await self.provider.asave()
+        state, nonce = start_login()
+        code = self.idp.authorize(CLAIMS, nonce)
+        userinfo_requests = self.idp.requests['/userinfo']
+
+        resp = await AsyncClient().get(f'{self.callback_url}?code={code}&state={state}')
+        assert resp.url == '/'
+        assert await get_user_model().objects.filter(username='user@company.com', first_name='Jane').aexists()
+        assert self.idp.requests['/userinfo'] == userinfo_requests
+
+    async def test_wrong_nonce(self):
+        state, nonce = start_login()
+        code = self.idp.authorize(CLAIMS, 'another-nonce')
+
+        # same as the sync view: mozilla raises SuspiciousOperation for a nonce mismatch
+        resp = await AsyncClient().get(f'{self.callback_url}?code={code}&state={state}')
+        assert resp.status_code == 400
+        assert not await get_user_model().objects.filter(username='user@company.com').aexists()
+
+    async def test_state_replay(self):
+        state, nonce = start_login()
+        code = self.idp.authorize(CLAIMS, nonce)
+        assert (await AsyncClient().get(f'{self.callback_url}?code={code}&state={state}')).url == '/'
+        token_requests = self.idp.requests['/token']
+        # the login context was removed, so the state can't be used again
+        resp = await AsyncClient().get(f'{self.callback_url}?code={code}&state={state}')
+        assert resp.status_code == 302
+        assert self.idp.requests['/token'] == token_requests
+
+    async def test_idp_error(self):
+        state, nonce = start_login(extra_data={'fail': 'https://some_site.com/fail/'})
+        token_requests = self.idp.requests['/token']
+        resp = await AsyncClient().get(f'{self.callback_url}?error=access_denied&state={state}')
+        assert resp.status_code == 302
+        assert resp.url == 'https://some_site.com/fail/'
+        assert self.idp.requests['/token'] == token_requests
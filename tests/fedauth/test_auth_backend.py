@@ -1,7 +1,9 @@
 from unittest.mock import patch
 
 from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from fedauth.backends import OIDCAuthenticationBackend
 from fedauth.models import DynamicProvider, StaticProvider
@@ -42,6 +44,26 @@ class TestAuthenticationBackend(TestCase):
         assert self.backend.OIDC_RP_CLIENT_SECRET == self.dyn_provider.client_secret
         assert self.backend.OIDC_RP_SIGN_ALGO == self.dyn_provider.sign_algo
 
+    def test_configure_oidc_settings_loads_provider_once(self):
+        # all the settings should be served from a single provider lookup
+        self.backend.request.session['domain'] = self.domain
+        with self.assertNumQueries(1):
+            self.backend.configure_oidc_settings()
+            # subsequent lookups during the same authentication attempt don't hit the db again
+            assert self.backend.get_settings('OIDC_RP_SCOPES') == self.dyn_provider.scopes
+
+    def test_provider_reloaded_when_session_context_changes(self):
+        self.backend.request.session['domain'] = self.domain
+        assert self.backend.get_provider() == self.dyn_provider
+        # once the dynamic context is cleared, the static provider should be resolved instead
+        self.backend.request.session.pop('domain')
+        self.backend.request.session['provider'] = self.provider
+        assert self.backend.get_provider() == self.stat_provider
+        # no context at all means we fall back to global settings
+        self.backend.request.session.clear()
+        assert self.backend.get_provider() is None
+        assert self.backend.get_settings('OIDC_SUPER_GROUP') == 'superuser'
+
     def test_configure_oidc_settings_method_for_static_provider(self):
         # the 'configure_oidc_settings' should retrieve and populate the class attributes
         self.backend.request.session['provider'] = self.provider   # method requires provider
@@ -98,6 +120,21 @@ class TestAuthenticationBackend(TestCase):
         # user should now also be superuser
         assert user.is_superuser
 
+    def test_update_user_writes_changed_fields_only(self):
+        user = User.objects.create(username='user@test.com', first_name='Jane', last_name='Doe')
+        claims = {'given_name': 'Jane', 'family_name': 'Doe', 'groups': []}
+        # nothing changed, so nothing is written
+        with self.assertNumQueries(0):
+            self.backend.update_user(user, claims)
+
+        claims['groups'] = ['admin']
+        with CaptureQueriesContext(connection) as queries:
+            self.backend.update_user(user, claims)
+        assert len(queries) == 1
+        assert '"is_staff"' in queries[0]['sql'] and '"first_name"' not in queries[0]['sql']
+        user.refresh_from_db()
+        assert user.is_staff
+
     def test_create_user(self):
         """
         When the user does not exist on the system yet, but authenticates via idP, we use the claims from idP
@@ -114,3 +151,20 @@ class TestAuthenticationBackend(TestCase):
         user = User.objects.get(username=username)
         assert user.is_staff
         assert user.is_superuser
+
+    def test_create_user_single_insert(self):
+        claims = {'email': 'user@test.com', 'given_name': 'Jane', 'family_name': 'Doe', 'groups': ['admin']}
+        with CaptureQueriesContext(connection) as queries:
+            user = self.backend.create_user(claims)
+        assert [query['sql'].split()[0] for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))] == ['INSERT']
+        user = User.objects.get(pk=user.pk)
+        assert (user.first_name, user.last_name, user.is_staff, user.is_superuser) == ('Jane', 'Doe', True, False)
+        assert not user.has_usable_password()
+
+    def test_create_user_created_concurrently(self):
+        # another login of the same user created it between 'filter_users_by_claims' and 'create_user'
+        existing = User.objects.create(username='user@test.com', email='user@test.com')
+        user = self.backend.create_user({'email': 'user@test.com', 'given_name': 'Jane', 'groups': []})
+        assert user.pk == existing.pk
+        assert user.first_name == 'Jane'
+        assert User.objects.count() == 1
@@ -0,0 +1,102 @@
+"""
+Query and cache operation budgets of the fedauth entry points (see tests/budgets.json). Every request is made with cold
+in-process caches (providers and JWKS), which is the most expensive case.
+"""
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from django.conf import settings
+from django.contrib.sessions.backends.cache import KEY_PREFIX
+from django.core.cache import cache as default_cache  # to prevent fixture clash
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from fedauth.cache import invalidate_providers
+from fedauth.jwks import jwks_cache
+from fedauth.login_context import get_login_context_key
+from tests.base import BudgetTestMixin, start_login
+from tests.factories import DynamicProviderFactory, StaticProviderFactory
+from tests.stub_idp import StubIdP
+
+FRONTEND_URL = 'www.frontend.com'
+
+
+@override_settings(
+    AUTHENTICATION_BACKENDS=['fedauth.backends.OIDCAuthenticationBackend'],
+    OIDC_REDIRECT_ALLOWED_HOSTS=[FRONTEND_URL],
+)
+class TestBudgets(BudgetTestMixin, TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.idp = StubIdP().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.idp.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        DynamicProviderFactory(domain='company.com', **self.idp.provider_fields())
+        StaticProviderFactory()
+        invalidate_providers()
+        jwks_cache.clear()
+        self.client = Client()
+        self.cache_keys = []  # written by the test, besides the session
+
+    def tearDown(self):
+        # only the keys of this test: the cache database is shared (e.g. with the sessions of other clients)
+        session = self.client.cookies.get(settings.SESSION_COOKIE_NAME)
+        if session:
+            self.cache_keys.append(f'{KEY_PREFIX}{session.value}')
+        default_cache.delete_many(self.cache_keys)
+
+    def test_admin_login(self):
+        with self.assertWithinBudget('admin_login'):
+            resp = self.client.post(reverse('admin-login'), {'username': 'user@company.com'})
+        assert resp.url == reverse('fed-provider-auth', kwargs={'username': 'user@company.com'})
+
+    def test_admin_login_local(self):
+        with self.assertWithinBudget('admin_login_local'):
+            resp = self.client.post(reverse('admin-login'), {'username': 'user@gmail.com'})
+        assert resp.url == reverse('default-admin-login', kwargs={'username': 'user@gmail.com'})
+
+    def test_dynamic_auth_request(self):
+        with self.assertWithinBudget('dynamic_auth_request'):
+            resp = self.client.get(reverse('fed-provider-auth', kwargs={'username': 'user@company.com'}))
+        assert resp.status_code == 302
+
+    def test_static_auth_request(self):
+        with self.assertWithinBudget('static_auth_request'):
+            resp = self.client.get(reverse('jumpcloud_authentication_init'))
+        assert resp.status_code == 302
+
+    def test_frontend_login(self):
+        query = urlencode({'next': f'https://{FRONTEND_URL}', 'fail': f'https://{FRONTEND_URL}'})
+        with self.assertWithinBudget('frontend_login'):
+            resp = self.client.post(f"{reverse('oidc-provider-login')}?{query}", {'username': 'user@company.com'})
+        state = parse_qs(urlparse(resp.json()['auth_url']).query)['state'][0]
+        self.cache_keys.append(get_login_context_key(state))
+
+    def test_callback(self):
+        state, nonce = start_login(extra_data={'next': f'https://{FRONTEND_URL}'})
+        self.cache_keys.append(get_login_context_key(state))
+        code = self.idp.authorize({'email': 'user@company.com', 'groups': []}, nonce)
+        with self.assertWithinBudget('callback'):
+            resp = self.client.get(f"{reverse('oidc-provider-callback')}?code={code}&state={state}")
+        assert resp.url.startswith(f'https://{FRONTEND_URL}?code=')
+        self.cache_keys.append(f"auth_code:{parse_qs(urlparse(resp.url).query)['code'][0]}")
+
+    def test_token_exchange(self):
+        self.cache_keys.append('auth_code:code')
+        default_cache.set('auth_code:code', {'access_token': 'access', 'refresh_token': 'refresh'})
+        with self.assertWithinBudget('token_exchange'):
+            resp = self.client.post(reverse('token-exchange'), {'code': 'code'})
+        assert resp.status_code == 200
+
+    def test_token_exchange_batch(self):
+        self.cache_keys = [f'auth_code:code{i}' for i in range(5)]
+        default_cache.set_many({key: {'access_token': 'access', 'refresh_token': 'refresh'} for key in self.cache_keys})
+        with self.assertWithinBudget('token_exchange_batch'):
+            resp = self.client.post(reverse('token-exchange-batch'), {'codes': [f'code{i}' for i in range(5)]}, 'application/json')
+        assert resp.status_code == 200
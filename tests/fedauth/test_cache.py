@@ -0,0 +1,148 @@
+from unittest.mock import patch
+
+from django.core.cache import cache as default_cache  # to prevent fixture clash
+from django.test import TestCase, override_settings
+from redis.exceptions import ResponseError
+
+from fedauth.cache import PROVIDERS_VERSION_KEY, TTLCache, cache_pop, cache_pop_many, provider_version
+from fedauth.models import DynamicProvider
+from fedauth.utils import get_dynamic_provider, get_static_provider
+from tests.factories import DynamicProviderFactory, StaticProviderFactory
+
+
+class TestTTLCache(TestCase):
+
+    def test_lru_eviction(self):
+        lru = TTLCache(maxsize=2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        # reading 'a' makes 'b' the least recently used entry
+        assert lru.get('a') == 1
+        lru.set('c', 3)
+        assert lru.get('b') is None
+        assert lru.get('a') == 1
+        assert lru.get('c') == 3
+
+    @patch('fedauth.cache.time.monotonic')
+    def test_entry_expiry(self, monotonic):
+        monotonic.return_value = 100
+        ttl = TTLCache(timeout=10)
+        ttl.set('a', 1)
+        ttl.set('b', 2, timeout=60)
+        monotonic.return_value = 111
+        assert ttl.get('a') is None
+        assert ttl.get('b') == 2
+
+
+class TestProviderCache(TestCase):
+
+    def setUp(self):
+        self.dyn_provider = DynamicProviderFactory(domain='company.com')
+        self.stat_provider = StaticProviderFactory(provider='jumpcloud')
+
+    def test_provider_served_from_cache(self):
+        with self.assertNumQueries(2):
+            assert get_dynamic_provider('company.com') == self.dyn_provider
+            assert get_static_provider('jumpcloud') == self.stat_provider
+        # second lookups are served from process memory
+        with self.assertNumQueries(0):
+            assert get_dynamic_provider('company.com') == self.dyn_provider
+            assert get_static_provider('jumpcloud') == self.stat_provider
+
+    def test_cache_invalidated_on_save(self):
+        get_dynamic_provider('company.com')
+        self.dyn_provider.client_id = 'new-client-id'
+        self.dyn_provider.save()
+        with self.assertNumQueries(1):
+            assert get_dynamic_provider('company.com').client_id == 'new-client-id'
+
+    def test_cache_invalidated_on_delete(self):
+        get_dynamic_provider('company.com')
+        self.dyn_provider.delete()
+        with self.assertRaises(DynamicProvider.DoesNotExist):
+            get_dynamic_provider('company.com')
+
+    @override_settings(FEDAUTH_PROVIDER_CACHE_TIMEOUT=0)
+    def test_cache_disabled(self):
+        get_dynamic_provider('company.com')
+        with self.assertNumQueries(1):
+            get_dynamic_provider('company.com')
+
+
+@override_settings(FEDAUTH_PROVIDER_CACHE_BROADCAST=True)
+class TestProviderCacheBroadcast(TestCase):
+
+    def setUp(self):
+        self.dyn_provider = DynamicProviderFactory(domain='company.com')
+
+    def tearDown(self):
+        default_cache.delete(PROVIDERS_VERSION_KEY)
+
+    def test_change_on_other_worker_drops_cache(self):
+        get_dynamic_provider('company.com')
+        with self.assertNumQueries(0):
+            get_dynamic_provider('company.com')
+        # simulate another worker saving a provider (only the shared version moves)
+        default_cache.incr(PROVIDERS_VERSION_KEY)
+        provider_version._checked_at = None  # skip the poll interval
+        with self.assertNumQueries(1):
+            get_dynamic_provider('company.com')
+
+    def test_local_change_bumps_shared_version(self):
+        version = default_cache.get(PROVIDERS_VERSION_KEY, 0)
+        self.dyn_provider.save()
+        assert default_cache.get(PROVIDERS_VERSION_KEY) > version
+
+
+class TestCachePop(TestCase):
+
+    def tearDown(self):
+        default_cache.delete_many(['auth_code:abc', 'auth_code:a', 'auth_code:b', 'auth_code:c'])
+
+    def test_redis_pop(self):
+        default_cache.set('auth_code:abc', {'access_token': 'access'})
+        redis = default_cache.client.get_client(write=True)
+        with patch.object(redis, 'getdel', wraps=redis.getdel) as getdel, patch.object(redis, 'get') as get:
+            assert cache_pop('auth_code:abc') == {'access_token': 'access'}
+            assert cache_pop('auth_code:abc') is None
+            assert cache_pop('auth_code:abc', 'default') == 'default'
+        # one GETDEL per pop, no separate GET and DELETE
+        assert getdel.call_count == 3
+        assert not get.called
+
+    def test_redis_pop_without_getdel(self):
+        # redis < 6.2
+        default_cache.set('auth_code:abc', 'tokens')
+        redis = default_cache.client.get_client(write=True)
+        with patch.object(redis, 'getdel', side_effect=ResponseError('unknown command')):
+            assert cache_pop('auth_code:abc') == 'tokens'
+            assert cache_pop('auth_code:abc') is None
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_pop_with_lock(self):
+        default_cache.set('auth_code:abc', 'tokens')
+        assert cache_pop('auth_code:abc') == 'tokens'
+        assert cache_pop('auth_code:abc') is None
+
+        # another request is popping the same key
+        default_cache.set('auth_code:abc', 'tokens')
+        default_cache.add('auth_code:abc:pop-lock', 1)
+        assert cache_pop('auth_code:abc') is None
+
+    def test_redis_pop_many(self):
+        default_cache.set_many({'auth_code:a': 'tokens a', 'auth_code:b': 'tokens b'})
+        redis = default_cache.client.get_client(write=True)
+        with patch.object(redis, 'pipeline', wraps=redis.pipeline) as pipeline:
+            assert cache_pop_many(['auth_code:a', 'auth_code:b', 'auth_code:c']) == {
+                'auth_code:a': 'tokens a',
+                'auth_code:b': 'tokens b',
+            }
+        # a single round trip
+        assert pipeline.call_count == 1
+        assert cache_pop_many(['auth_code:a', 'auth_code:b']) == {}
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_pop_many_with_lock(self):
+        default_cache.set_many({'auth_code:a': 'tokens a', 'auth_code:b': 'tokens b'})
+        assert cache_pop_many(['auth_code:a', 'auth_code:c']) == {'auth_code:a': 'tokens a'}
+        assert default_cache.get('auth_code:b') == 'tokens b'
@@ -0,0 +1,207 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from cryptography.fernet import Fernet
+from django.core.cache import cache as default_cache  # to prevent fixture clash
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+
+from fedauth.cache import PROVIDERS_VERSION_KEY
+from fedauth.crypto import decrypt
+from fedauth.models import DynamicProvider, StaticProvider
+from tests.factories import DynamicProviderFactory, StaticProviderFactory
+
+OLD_KEY = Fernet.generate_key()
+NEW_KEY = Fernet.generate_key()
+
+
+@override_settings(FEDAUTH_ENCRYPTION_KEYS=[OLD_KEY])
+class TestRotateKeysCommand(TestCase):
+
+    def setUp(self):
+        self.secret = 'HWcI.p6WmTqCv6.OHtG3Dp0~Ep'
+        for i in range(5):
+            DynamicProviderFactory(domain=f'company{i}.com', client_secret=self.secret)
+        StaticProviderFactory(provider='jumpcloud', client_secret=self.secret)
+
+    def rotate(self, *args):
+        out = StringIO()
+        with override_settings(FEDAUTH_ENCRYPTION_KEYS=[NEW_KEY, OLD_KEY]):
+            call_command('fedauth_rotate_keys', *args, stdout=out)
+        return out.getvalue()
+
+    def assert_encrypted_with(self, providers, key):
+        for provider in providers:
+            assert decrypt(provider.client_secret_cipher, key).decode() == self.secret
+
+    def test_rotate_all_providers(self):
+        out = self.rotate('--batch-size', '2')
+        assert 'dynamic: done, 5 secrets rotated' in out
+        assert 'static: done, 1 secrets rotated' in out
+        assert 'Running workers pick up the changes' in out
+        self.assert_encrypted_with(DynamicProvider.objects.all(), NEW_KEY)
+        self.assert_encrypted_with(StaticProvider.objects.all(), NEW_KEY)
+
+        # once the old key is dropped, secrets can still be read
+        with override_settings(FEDAUTH_ENCRYPTION_KEYS=[NEW_KEY]):
+            assert DynamicProvider.objects.first().client_secret == self.secret
+
+    def test_resume_rotation(self):
+        providers = list(DynamicProvider.objects.order_by('pk'))
+        self.rotate('--model', 'dynamic', '--start-after', str(providers[2].pk))
+        rotated = DynamicProvider.objects.filter(pk__gt=providers[2].pk)
+        skipped = DynamicProvider.objects.filter(pk__lte=providers[2].pk)
+        self.assert_encrypted_with(rotated, NEW_KEY)
+        self.assert_encrypted_with(skipped, OLD_KEY)
+        # static providers are left alone when only rotating dynamic providers
+        self.assert_encrypted_with(StaticProvider.objects.all(), OLD_KEY)
+
+    def test_start_after_requires_model(self):
+        with self.assertRaisesMessage(CommandError, '--start-after requires --model.'):
+            self.rotate('--start-after', '3')
+        self.assert_encrypted_with(DynamicProvider.objects.all(), OLD_KEY)
+
+
+ROW = {
+    'domain': 'company.com',
+    'auth_endpoint': 'https://oauth.id.okta.com/oauth2/auth',
+    'token_endpoint': 'https://oauth.id.okta.com/oauth2/token',
+    'user_endpoint': 'https://oauth.id.okta.com/userinfo',
+    'jwks_endpoint': 'https://oauth.id.okta.com/keys',
+    'client_id': '5e7b657f-ac86-45de-9755-c9e1ee6c4d93',
+    'client_secret': 'HWcI.p6WmTqCv6.OHtG3Dp0~Ep',
+}
+
+
+class TestImportExportProvidersCommands(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as file:
+            file.write(text)
+        return path
+
+    def call(self, command, *args):
+        out, err = StringIO(), StringIO()
+        call_command(command, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_jsonl(self):
+        existing = DynamicProviderFactory(domain='company0.com', client_id='old')
+        rows = [{**ROW, 'domain': f'company{i}.com'} for i in range(5)]
+        path = self.write('providers.jsonl', ''.join(json.dumps(row) + '\n' for row in rows))
+
+        # one upsert per batch
+        with self.assertNumQueries(3 * 3):
+            out, _ = self.call('fedauth_import_providers', path, '--batch-size', '2')
+        assert 'dynamic: done, 5 providers imported, 0 invalid rows skipped' in out
+
+        assert DynamicProvider.objects.count() == 5
+        existing.refresh_from_db()
+        assert existing.client_id == ROW['client_id']
+        provider = DynamicProvider.objects.get(domain='company4.com')
+        assert provider.client_secret == ROW['client_secret']
+        # defaults of missing fields are used
+        assert provider.sign_algo == 'RS256'
+        assert provider.http_timeout is None
+
+    def test_import_csv_with_invalid_rows(self):
+        path = self.write('providers.csv', (
+            'domain,issuer,auth_endpoint,token_endpoint,user_endpoint,jwks_endpoint,client_id,client_secret,'
+            'sign_algo,http_timeout,use_id_token_claims\n'
+            'company.com,https://login.company.com,,,,,client,secret,ES256,2.5,True\n'
+            'other.com,,,,,,client,secret,,,\n'
+            'bad.com,https://login.bad.com,,,,,client,,RS512,slow,\n'
+        ))
+        out, err = self.call('fedauth_import_providers', path)
+        assert 'dynamic: done, 1 providers imported, 2 invalid rows skipped' in out
+        assert 'line 3: auth_endpoint: This field is required if no issuer is set.' in err
+        assert 'line 4: client_secret: This field is required.' in err
+
+        provider = DynamicProvider.objects.get()
+        assert provider.domain == 'company.com'
+        assert provider.sign_algo == 'ES256'
+        assert provider.http_timeout == 2.5
+        assert provider.use_id_token_claims is True
+
+    def test_import_csv_with_extra_cells(self):
+        header = ','.join(ROW)
+        path = self.write('providers.csv', (
+            f'\ufeff{header}\n'
+            f"{','.join(ROW.values())},extra\n"
+            f"{','.join({**ROW, 'domain': 'other.com'}.values())}\n"
+        ))
+        out, err = self.call('fedauth_import_providers', path)
+        assert '1 providers imported, 1 invalid rows skipped' in out
+        assert 'line 2: invalid row' in err
+        # the byte order mark isn't part of the first column name
+        assert DynamicProvider.objects.get().domain == 'other.com'
+
+    def test_import_invalid_values(self):
+        rows = [{**ROW, 'sign_algo': 'RS512', 'http_timeout': 'slow'}, {**ROW, 'color': 'red'}]
+        path = self.write('providers.jsonl', ''.join(json.dumps(row) + '\n' for row in rows) + 'not json\n')
+        out, err = self.call('fedauth_import_providers', path)
+        assert '0 providers imported, 3 invalid rows skipped' in out
+        assert "line 1: sign_algo: Value 'RS512' is not a valid choice." in err
+        assert 'http_timeout: ' in err
+        assert 'line 2: Unknown fields: color' in err
+        assert 'line 3: invalid row' in err
+
+    def test_import_invalidates_worker_caches(self):
+        version = default_cache.get(PROVIDERS_VERSION_KEY, 0)
+        path = self.write('providers.jsonl', json.dumps(ROW))
+        out, _ = self.call('fedauth_import_providers', path)
+        # published for workers that broadcast provider changes, even if this process doesn't
+        assert default_cache.get(PROVIDERS_VERSION_KEY) == version + 1
+        assert 'Running workers pick up the changes within 300 seconds' in out
+
+        with override_settings(FEDAUTH_PROVIDER_CACHE_BROADCAST=True):
+            out, _ = self.call('fedauth_import_providers', path)
+        assert default_cache.get(PROVIDERS_VERSION_KEY) == version + 2
+        assert 'Running workers' not in out
+
+    def test_dry_run(self):
+        path = self.write('providers.jsonl', json.dumps(ROW))
+        out, _ = self.call('fedauth_import_providers', path, '--dry-run')
+        assert '1 providers validated' in out
+        assert not DynamicProvider.objects.exists()
+
+    def test_import_static_providers(self):
+        row = {**ROW, 'provider': 'jumpcloud'}
+        del row['domain']
+        path = self.write('providers.jsonl', json.dumps(row))
+        self.call('fedauth_import_providers', path, '--model', 'static')
+        assert StaticProvider.objects.get().provider == 'jumpcloud'
+
+    def test_export_without_secrets(self):
+        DynamicProviderFactory(domain='company.com')
+        out, _ = self.call('fedauth_export_providers', '-')
+        row = json.loads(out)
+        assert row['domain'] == 'company.com'
+        assert row['sign_algo'] == 'HS256'
+        assert 'client_secret' not in row
+        assert 'client_secret_cipher' not in row
+
+    def test_export_import_round_trip(self):
+        for i in range(3):
+            DynamicProviderFactory(domain=f'company{i}.com', http_timeout=2.5, use_id_token_claims=True)
+        for name in ('providers.jsonl', 'providers.csv'):
+            path = os.path.join(self.directory.name, name)
+            out, _ = self.call('fedauth_export_providers', path, '--include-secrets', '--batch-size', '2')
+            assert 'dynamic: done, 3 providers exported' in out
+
+            exported = list(DynamicProvider.objects.order_by('domain').values())
+            DynamicProvider.objects.all().delete()
+            self.call('fedauth_import_providers', path)
+            imported = list(DynamicProvider.objects.order_by('domain').values())
+            ignored = ('id', 'created_at', 'updated_at', 'client_secret_cipher')
+            assert [{k: v for k, v in row.items() if k not in ignored} for row in imported] == [
+                {k: v for k, v in row.items() if k not in ignored} for row in exported
+            ]
+            assert DynamicProvider.objects.first().client_secret == 'HWcI.p6WmTqCv6.OHtG3Dp0~Ep'
@@ -1,8 +1,11 @@
-from django.test import TestCase
+from unittest.mock import patch
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
 
 from cryptography.fernet import Fernet
 
-from fedauth.crypto import encrypt, decrypt
+from fedauth.crypto import encrypt, decrypt, decrypt_secret, get_encryption_keys, get_fernet, secret_cache
 
 
 class TestUtils(TestCase):
@@ -10,8 +13,36 @@ class TestUtils(TestCase):
     def setUp(self):
         self.secret = 'HWcI.p6WmTqCv6.OHtG3Dp0~Ep'
         self.key = Fernet.generate_key()
+        secret_cache.clear()
 
     def test_crypto(self):
         encrypted_secret = encrypt(self.secret.encode(), self.key)
         decrypted_secret = decrypt(encrypted_secret, self.key)
         assert decrypted_secret.decode() == self.secret
+
+    def test_empty_encryption_keys(self):
+        with override_settings(FEDAUTH_ENCRYPTION_KEYS=[f' {self.key.decode()} ', '']):
+            assert get_encryption_keys() == (self.key.decode(),)
+        with override_settings(FEDAUTH_ENCRYPTION_KEYS=['']):
+            with self.assertRaises(ImproperlyConfigured):
+                get_encryption_keys()
+
+    def test_fernet_instance_reused_per_key(self):
+        assert get_fernet(self.key) is get_fernet(self.key)
+        assert get_fernet(self.key) is not get_fernet(Fernet.generate_key())
+
+    def test_decrypt_secret_cached(self):
+        encrypted_secret = encrypt(self.secret.encode(), self.key)
+        with patch('fedauth.crypto.decrypt', wraps=decrypt) as mock_decrypt:
+            assert decrypt_secret(encrypted_secret, self.key).decode() == self.secret
+            assert decrypt_secret(memoryview(encrypted_secret), self.key).decode() == self.secret
+        # second read is served from the secret cache
+        assert mock_decrypt.call_count == 1
+
+    @override_settings(FEDAUTH_SECRET_CACHE_TIMEOUT=0)
+    def test_decrypt_secret_cache_disabled(self):
+        encrypted_secret = encrypt(self.secret.encode(), self.key)
+        with patch('fedauth.crypto.decrypt', wraps=decrypt) as mock_decrypt:
+            decrypt_secret(encrypted_secret, self.key)
+            decrypt_secret(encrypted_secret, self.key)
+        assert mock_decrypt.call_count == 2
@@ -0,0 +1,108 @@
+from unittest.mock import patch
+
+import requests
+from django.core.cache import cache as default_cache  # to prevent fixture clash
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+
+from fedauth.discovery import DiscoveryCache, DiscoveryError, discovery_cache, fetch_discovery_document
+from fedauth.utils import get_dynamic_provider_settings
+from tests.factories import DynamicProviderFactory
+
+ISSUER = 'https://idp.company.com/realms/company'
+DOCUMENT = {
+    'issuer': ISSUER,
+    'authorization_endpoint': f'{ISSUER}/protocol/openid-connect/auth',
+    'token_endpoint': f'{ISSUER}/protocol/openid-connect/token',
+    'userinfo_endpoint': f'{ISSUER}/protocol/openid-connect/userinfo',
+    'jwks_uri': f'{ISSUER}/protocol/openid-connect/certs',
+}
+
+
+class TestDiscoveryCache(TestCase):
+
+    def setUp(self):
+        self.cache = DiscoveryCache()
+
+    def tearDown(self):
+        default_cache.delete(self.cache.get_cache_key(ISSUER))
+
+    @patch('fedauth.discovery.fetch_discovery_document', return_value=DOCUMENT)
+    def test_document_cached(self, fetch):
+        assert self.cache.get(ISSUER) == DOCUMENT
+        assert self.cache.get(ISSUER) == DOCUMENT
+        assert fetch.call_count == 1
+        # a new worker (empty process cache) gets the document from the shared cache
+        assert DiscoveryCache().get(ISSUER) == DOCUMENT
+        assert fetch.call_count == 1
+
+    @patch('fedauth.discovery.time.sleep')
+    @patch('fedauth.discovery.fetch_discovery_document', return_value=DOCUMENT)
+    def test_wait_for_other_worker(self, fetch, sleep):
+        key = self.cache.get_cache_key(ISSUER)
+        # another worker holds the fetch lock, and stores the document while we wait
+        default_cache.add(f'{key}:lock', 1)
+        sleep.side_effect = lambda seconds: default_cache.set(key, DOCUMENT)
+        try:
+            assert self.cache.get(ISSUER) == DOCUMENT
+        finally:
+            default_cache.delete(f'{key}:lock')
+        assert not fetch.called
+
+    @patch('fedauth.discovery.fetch_discovery_document', side_effect=requests.ConnectionError('down'))
+    def test_failure_cached(self, fetch):
+        for _ in range(2):
+            with self.assertRaisesMessage(DiscoveryError, 'down'):
+                self.cache.get(ISSUER)
+        # other workers back off too, until FEDAUTH_DISCOVERY_FAILURE_TIMEOUT expires
+        with self.assertRaises(DiscoveryError):
+            DiscoveryCache().get(ISSUER)
+        assert fetch.call_count == 1
+
+    @patch('fedauth.discovery.requests.get')
+    def test_fetch(self, get):
+        get.return_value.json.return_value = DOCUMENT
+        assert fetch_discovery_document(ISSUER) == DOCUMENT
+        # the fetch has its own timeout, OIDC_TIMEOUT defaults to none
+        assert get.call_args.kwargs['timeout'] == 5
+
+    @patch('fedauth.discovery.requests.get')
+    def test_fetch_issuer_mismatch(self, get):
+        get.return_value.json.return_value = {**DOCUMENT, 'issuer': 'https://evil.com'}
+        with self.assertRaisesMessage(ValueError, "discovery document issuer doesn't match"):
+            fetch_discovery_document(ISSUER)
+
+
+class TestDiscoveredEndpoints(TestCase):
+
+    def setUp(self):
+        discovery_cache.clear()
+        self.provider = DynamicProviderFactory(
+            domain='company.com',
+            issuer=ISSUER,
+            auth_endpoint='',
+            token_endpoint='',
+            user_endpoint='',
+            jwks_endpoint='https://idp.company.com/old/certs',
+        )
+
+    def tearDown(self):
+        default_cache.delete(DiscoveryCache.get_cache_key(ISSUER))
+
+    @patch('fedauth.discovery.requests.get')
+    def test_endpoints_from_discovery(self, get):
+        get.return_value.json.return_value = DOCUMENT
+        assert get_dynamic_provider_settings('OIDC_OP_AUTHORIZATION_ENDPOINT', 'company.com') == DOCUMENT['authorization_endpoint']
+        assert get_dynamic_provider_settings('OIDC_OP_TOKEN_ENDPOINT', 'company.com') == DOCUMENT['token_endpoint']
+        assert get_dynamic_provider_settings('OIDC_OP_USER_ENDPOINT', 'company.com') == DOCUMENT['userinfo_endpoint']
+        # discovered endpoints take precedence over stored endpoints
+        assert get_dynamic_provider_settings('OIDC_OP_JWKS_ENDPOINT', 'company.com') == DOCUMENT['jwks_uri']
+        assert get.call_args.args == (f'{ISSUER}/.well-known/openid-configuration',)
+        assert get.call_count == 1
+
+    @patch('fedauth.discovery.requests.get', side_effect=requests.ConnectionError('down'))
+    def test_discovery_failure(self, get):
+        # stored endpoint is used as fallback
+        assert get_dynamic_provider_settings('OIDC_OP_JWKS_ENDPOINT', 'company.com') == 'https://idp.company.com/old/certs'
+        with self.assertRaises(ImproperlyConfigured):
+            get_dynamic_provider_settings('OIDC_OP_TOKEN_ENDPOINT', 'company.com')
@@ -0,0 +1,119 @@
+import time
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+
+from fedauth.cache import invalidate_providers
+from fedauth.domains import BloomFilter, DomainTrie, domain_index
+from fedauth.models import DynamicProvider
+from fedauth.utils import find_dynamic_provider
+from tests.factories import DynamicProviderFactory
+
+
+class TestDomainTrie(TestCase):
+
+    def setUp(self):
+        self.trie = DomainTrie(['company.com', 'eu.company.com', 'other.org'])
+
+    def test_exact_match(self):
+        assert self.trie.match('company.com') == 'company.com'
+        assert self.trie.match('Other.ORG') == 'other.org'
+
+    def test_longest_suffix_match(self):
+        assert self.trie.match('dev.company.com') == 'company.com'
+        assert self.trie.match('eu.company.com') == 'eu.company.com'
+        assert self.trie.match('dev.eu.company.com') == 'eu.company.com'
+
+    def test_no_match(self):
+        assert self.trie.match('gmail.com') is None
+        assert self.trie.match('com') is None
+        # a shared suffix that isn't a full label doesn't match
+        assert self.trie.match('mycompany.com') is None
+
+    def test_exact_match_only(self):
+        assert self.trie.match('company.com', subdomains=False) == 'company.com'
+        assert self.trie.match('dev.company.com', subdomains=False) is None
+
+
+class TestDomainIndex(TestCase):
+
+    def setUp(self):
+        self.provider = DynamicProviderFactory(domain='company.com')
+
+    def test_lookups_served_from_memory(self):
+        with self.assertNumQueries(1):
+            assert domain_index.match('company.com') == 'company.com'
+            assert domain_index.match('eu.company.com') == 'company.com'
+            assert domain_index.match('gmail.com') is None
+
+    def test_index_rebuilt_on_provider_change(self):
+        assert domain_index.match('other.org') is None
+        DynamicProviderFactory(domain='other.org')
+        assert domain_index.match('other.org') == 'other.org'
+
+    def test_index_expires(self):
+        self.addCleanup(invalidate_providers)  # the row is rolled back, the index isn't
+        assert domain_index.match('other.org') is None
+        # added by another process: no signal, the provider version of this process doesn't move
+        DynamicProvider.objects.bulk_create([DynamicProvider(domain='other.org', client_id='client')])
+        assert domain_index.match('other.org') is None
+        with patch('fedauth.domains.time.monotonic', return_value=time.monotonic() + 300):
+            assert domain_index.match('other.org') == 'other.org'
+
+    def test_find_dynamic_provider(self):
+        assert find_dynamic_provider('eu.company.com') == self.provider
+        assert find_dynamic_provider('gmail.com') is None
+
+    @override_settings(FEDAUTH_MATCH_SUBDOMAINS=False)
+    def test_subdomain_matching_disabled(self):
+        assert find_dynamic_provider('company.com') == self.provider
+        assert find_dynamic_provider('eu.company.com') is None
+
+
+class TestBloomFilter(TestCase):
+
+    def test_membership(self):
+        domains = [f'tenant{i}.com' for i in range(1000)]
+        bloom = BloomFilter(domains, error_rate=0.01)
+        # no false negatives
+        assert all(domain in bloom for domain in domains)
+        # false positives stay around the error rate
+        false_positives = sum(f'other{i}.com' in bloom for i in range(1000))
+        assert false_positives < 30
+
+
+@override_settings(FEDAUTH_DOMAIN_BLOOM_THRESHOLD=0)
+class TestDomainIndexBloomFilter(TestCase):
+
+    def setUp(self):
+        self.provider = DynamicProviderFactory(domain='company.com')
+        self.eu_provider = DynamicProviderFactory(domain='eu.company.com')
+
+    def test_matches(self):
+        assert domain_index.match('company.com') == 'company.com'
+        assert domain_index.match('Dev.Company.com') == 'company.com'
+        assert domain_index.match('dev.eu.company.com') == 'eu.company.com'
+        assert find_dynamic_provider('eu.company.com') == self.eu_provider
+
+    def test_mixed_case_domain(self):
+        provider = DynamicProviderFactory(domain='Other.org')
+        # same result as the trie: the domain as it is stored
+        assert domain_index.match('dev.other.ORG') == 'Other.org'
+        assert find_dynamic_provider('other.org') == provider
+
+    def test_unknown_domains_served_from_memory(self):
+        domain_index.match('company.com')
+        with self.assertNumQueries(0):
+            assert domain_index.match('gmail.com') is None
+            assert domain_index.match('mycompany.com') is None
+
+    def test_possible_matches_confirmed_once(self):
+        domain_index.match('gmail.com')
+        with self.assertNumQueries(1):
+            assert domain_index.match('dev.company.com') == 'company.com'
+            assert domain_index.match('dev.company.com') == 'company.com'
+
+    @override_settings(FEDAUTH_MATCH_SUBDOMAINS=False)
+    def test_subdomain_matching_disabled(self):
+        assert domain_index.match('company.com') == 'company.com'
+        assert domain_index.match('dev.company.com') is None
@@ -17,6 +17,11 @@ class TestOidcAuthEndpoints(BaseApiTestCase):
         # crafted url should start with models 'auth_endpoint'
         assert resp.url.startswith('https://oauth.id.jumpcloud.com/oauth2/auth')
 
+    def test_provider_loaded_once_per_request(self):
+        with self.assertNumQueries(1):
+            resp = self.get(self.auth_url)
+        assert resp.status_code == 302
+
     def test_callback(self):
         # not testing functionality, only that settings are obtained correctly.
         resp = self.get(self.callback_url)
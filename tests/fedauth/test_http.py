@@ -0,0 +1,167 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch, Mock
+
+import requests
+from asgiref.sync import sync_to_async
+from django.test import TestCase, override_settings
+
+from fedauth.backends import AsyncOIDCAuthenticationBackend, OIDCAuthenticationBackend
+from fedauth.http import build_async_client, build_session, get_async_client, get_session
+from tests.base import FakeRequest
+from tests.factories import DynamicProviderFactory, StaticProviderFactory
+from tests.stub_idp import StubIdP
+
+
+class TestGetSession(TestCase):
+
+    def setUp(self):
+        self.dyn_provider = DynamicProviderFactory(domain='company.com')
+        self.stat_provider = StaticProviderFactory(provider='jumpcloud')
+
+    def test_session_per_provider(self):
+        session = get_session(self.dyn_provider)
+        assert get_session(self.dyn_provider) is session
+        assert get_session(self.stat_provider) is not session
+        assert get_session() is not session
+
+    def test_pool_settings(self):
+        adapter = get_session(self.dyn_provider).get_adapter('https://idp.company.com')
+        assert adapter._pool_maxsize == 10
+        assert adapter.max_retries.total == 0
+
+        self.dyn_provider.http_pool_size = 2
+        self.dyn_provider.http_retries = 3
+        adapter = get_session(self.dyn_provider).get_adapter('https://idp.company.com')
+        assert adapter._pool_maxsize == 2
+        assert adapter.max_retries.total == 3
+        # POSTs (token requests) are not retried on error responses
+        assert 'POST' not in adapter.max_retries.allowed_methods
+
+    @override_settings(FEDAUTH_HTTP_POOL_SIZE=20)
+    def test_pool_size_setting(self):
+        assert get_session(self.stat_provider).get_adapter('https://idp.jumpcloud.com')._pool_maxsize == 20
+
+    async def test_async_client_per_provider(self):
+        client = get_async_client(self.dyn_provider)
+        assert get_async_client(self.dyn_provider) is client
+        assert get_async_client(self.stat_provider) is not client
+        # ssl and proxy settings are part of the httpx client
+        assert get_async_client(self.dyn_provider, verify=False) is not client
+
+
+class CookieHandler(BaseHTTPRequestHandler):
+    # sets a cookie, and records the cookies it receives
+    cookies = []
+
+    def log_message(self, format, *args):  # noqa
+        pass
+
+    def do_GET(self):  # noqa
+        self.cookies.append(self.headers.get('Cookie'))
+        self.send_response(200)
+        self.send_header('Set-Cookie', f'session={self.path.strip("/")}; Path=/')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class TestCookies(TestCase):
+    """
+    Sessions are shared by the logins of all users: cookies the IdP sets for one user are not sent for another.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), CookieHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        CookieHandler.cookies = []
+
+    def test_session_keeps_no_cookies(self):
+        session = build_session(pool_size=1, retries=0)
+        session.get(f'{self.url}/user1')
+        session.get(f'{self.url}/user2')
+        assert CookieHandler.cookies == [None, None]
+        assert not session.cookies
+
+    async def test_async_client_keeps_no_cookies(self):
+        async with build_async_client(pool_size=1, retries=0) as client:
+            await client.get(f'{self.url}/user1')
+            await client.get(f'{self.url}/user2')
+            assert not client.cookies
+        assert CookieHandler.cookies == [None, None]
+
+
+class TestBackendHttp(TestCase):
+
+    def setUp(self):
+        self.provider = DynamicProviderFactory(domain='company.com', http_timeout=2.5)
+        self.backend = OIDCAuthenticationBackend()
+        self.backend.request = FakeRequest
+        self.backend.request.session.clear()
+        self.backend.request.session['domain'] = 'company.com'
+        self.backend.configure_oidc_settings()
+
+    @patch('requests.Session.post')
+    def test_get_token(self, post):
+        post.return_value = Mock(status_code=200, json=Mock(return_value={'id_token': 'token'}))
+        assert self.backend.get_token({'code': 'code'}) == {'id_token': 'token'}
+        assert post.call_args.args == (self.provider.token_endpoint,)
+        assert post.call_args.kwargs['timeout'] == 2.5
+
+    @patch('requests.Session.get')
+    @override_settings(OIDC_TIMEOUT=10)
+    def test_get_userinfo(self, get):
+        get.return_value = Mock(headers={}, json=Mock(return_value={'email': 'user@company.com'}))
+        assert self.backend.get_userinfo('access', 'id', {}) == {'email': 'user@company.com'}
+        assert get.call_args.kwargs['headers'] == {'Authorization': 'Bearer access'}
+        assert get.call_args.kwargs['timeout'] == 2.5
+
+        # falls back to OIDC_TIMEOUT when the provider has no timeout set
+        self.provider.http_timeout = None
+        self.provider.save()
+        self.backend._provider_key = None
+        self.backend.get_userinfo('access', 'id', {})
+        assert get.call_args.kwargs['timeout'] == 10
+
+
+class TestAsyncBackendHttp(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.idp = StubIdP().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.idp.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        DynamicProviderFactory(domain='company.com', **self.idp.provider_fields())
+        self.backend = AsyncOIDCAuthenticationBackend()
+        self.backend.request = FakeRequest
+        self.backend.request.session.clear()
+        self.backend.request.session['domain'] = 'company.com'
+        self.backend.configure_oidc_settings()
+
+    async def test_userinfo(self):
+        access_token = StubIdP.encode({'email': 'user@company.com'})
+        assert await self.backend.aget_userinfo(access_token, 'id', {}) == {'email': 'user@company.com'}
+
+    async def test_userinfo_error(self):
+        # same exception as the sync backend
+        with self.assertRaises(requests.HTTPError) as error:
+            await self.backend.aget_userinfo('invalid', 'id', {})
+        assert error.exception.response.status_code == 401
+        with self.assertRaises(requests.HTTPError):
+            await sync_to_async(self.backend.get_userinfo)('invalid', 'id', {})
@@ -0,0 +1,113 @@
+from unittest.mock import patch, Mock
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.core.exceptions import SuspiciousOperation
+from django.test import TestCase
+
+from fedauth.backends import OIDCAuthenticationBackend
+from fedauth.jwks import JWKSCache, parse_cache_control, jwks_cache
+from tests.base import FakeRequest
+
+ENDPOINT = 'https://oauth.id.okta.com/keys'
+
+
+def make_key(kid):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key(), as_dict=True)
+    jwk.update({'kid': kid, 'alg': 'RS256', 'use': 'sig'})
+    return private_key, jwk
+
+
+class FakeResponse:
+    def __init__(self, keys, cache_control=''):
+        self.keys = keys
+        self.headers = {'Cache-Control': cache_control}
+
+    def json(self):
+        return {'keys': self.keys}
+
+    def raise_for_status(self):
+        pass
+
+
+class TestJWKSCache(TestCase):
+
+    def setUp(self):
+        self.cache = JWKSCache()
+        self.private_key, self.jwk = make_key('key-1')
+        self.token = jwt.encode({'sub': 'user'}, self.private_key, algorithm='RS256', headers={'kid': 'key-1'})
+        self.fetch = Mock(return_value=FakeResponse([self.jwk], 'public, max-age=300'))
+
+    def test_parse_cache_control(self):
+        assert parse_cache_control('public, max-age=300, stale-while-revalidate=60') == {
+            'max-age': 300, 'stale-while-revalidate': 60
+        }
+        assert parse_cache_control('no-cache') == {'max-age': 0, 'stale-while-revalidate': 0}
+        assert parse_cache_control('no-store, stale-while-revalidate=60') == {'max-age': 0, 'stale-while-revalidate': 0}
+        assert parse_cache_control('') == {}
+
+    def test_key_set_cached(self):
+        key = self.cache.get_signing_key(ENDPOINT, self.token, self.fetch)
+        assert key.key_id == 'key-1'
+        # parsed key object is reused, endpoint is not fetched again
+        assert self.cache.get_signing_key(ENDPOINT, self.token, self.fetch) is key
+        assert self.fetch.call_count == 1
+
+    @patch('fedauth.jwks.time.monotonic')
+    def test_stale_key_set_served_while_revalidating(self, monotonic):
+        monotonic.return_value = 1000
+        key = self.cache.get_signing_key(ENDPOINT, self.token, self.fetch)
+        # max-age passed, but still within stale window
+        monotonic.return_value = 1000 + 301
+        assert self.cache.get_signing_key(ENDPOINT, self.token, self.fetch) is key
+        self.cache._refreshing.get(ENDPOINT, Mock()).join()
+        assert self.fetch.call_count == 2
+
+    @patch('fedauth.jwks.time.monotonic')
+    def test_expired_key_set_refetched(self, monotonic):
+        monotonic.return_value = 1000
+        self.fetch.return_value = FakeResponse([self.jwk], 'max-age=300, stale-while-revalidate=60')
+        self.cache.get_signing_key(ENDPOINT, self.token, self.fetch)
+        monotonic.return_value = 1000 + 361
+        self.cache.get_signing_key(ENDPOINT, self.token, self.fetch)
+        assert self.fetch.call_count == 2
+
+    @patch('fedauth.jwks.time.monotonic')
+    def test_unknown_kid_forces_rate_limited_refresh(self, monotonic):
+        monotonic.return_value = 1000
+        self.cache.get_signing_key(ENDPOINT, self.token, self.fetch)
+
+        # IdP rotates its keys
+        private_key, jwk = make_key('key-2')
+        token = jwt.encode({'sub': 'user'}, private_key, algorithm='RS256', headers={'kid': 'key-2'})
+        self.fetch.return_value = FakeResponse([self.jwk, jwk], 'max-age=300')
+
+        # within the minimum refresh interval the key set isn't fetched again
+        with self.assertRaises(SuspiciousOperation):
+            self.cache.get_signing_key(ENDPOINT, token, self.fetch)
+        assert self.fetch.call_count == 1
+
+        monotonic.return_value = 1000 + 61
+        assert self.cache.get_signing_key(ENDPOINT, token, self.fetch).key_id == 'key-2'
+        assert self.fetch.call_count == 2
+
+
+class TestBackendJWKS(TestCase):
+
+    def setUp(self):
+        jwks_cache.clear()
+        self.backend = OIDCAuthenticationBackend()
+        self.backend.request = FakeRequest
+        self.backend.request.session.clear()
+        self.backend.OIDC_OP_JWKS_ENDPOINT = ENDPOINT
+        private_key, self.jwk = make_key('key-1')
+        self.token = jwt.encode({'sub': 'user'}, private_key, algorithm='RS256', headers={'kid': 'key-1'})
+
+    @patch('requests.Session.get')
+    def test_retrieve_matching_jwk_cached(self, get):
+        get.return_value = FakeResponse([self.jwk])
+        assert self.backend.retrieve_matching_jwk(self.token).key_id == 'key-1'
+        assert self.backend.retrieve_matching_jwk(self.token).key_id == 'key-1'
+        assert get.call_count == 1
+        assert get.call_args.args == (ENDPOINT,)
@@ -0,0 +1,54 @@
+import time
+from unittest.mock import patch
+
+from django.core.cache import cache as default_cache  # to prevent fixture clash
+from django.test import TestCase, override_settings
+
+from fedauth.login_context import (
+    CacheLoginStateStore,
+    SignedLoginStateStore,
+    get_login_context_key,
+    get_login_state_store,
+    pop_login_context,
+    save_login_context,
+)
+
+CONTEXT = {'domain': 'company.com', 'nonce': 'nonce', 'next': 'https://some_site.com/home/'}
+
+
+class TestLoginContext(TestCase):
+
+    def tearDown(self):
+        default_cache.clear()
+
+    def test_cache_store(self):
+        assert isinstance(get_login_state_store(), CacheLoginStateStore)
+        state = save_login_context({**CONTEXT, 'fail': None})
+        # empty values are left out
+        assert default_cache.get(get_login_context_key(state)) == CONTEXT
+        assert pop_login_context(state) == CONTEXT
+        # a state can only be used once
+        assert pop_login_context(state) is None
+        assert pop_login_context('') is None
+        assert pop_login_context('not-a-cache-state') is None
+
+    @override_settings(FEDAUTH_LOGIN_STATE_STORE='fedauth.login_context.SignedLoginStateStore')
+    def test_signed_store(self):
+        assert isinstance(get_login_state_store(), SignedLoginStateStore)
+        with patch.object(default_cache, 'set') as cache_set:
+            state = save_login_context(CONTEXT)
+        assert not cache_set.called
+        assert pop_login_context(state) == CONTEXT
+
+        # tampered states are refused
+        assert pop_login_context(state[:-8] + 'AAAAAAAA') is None
+        assert pop_login_context('random') is None
+
+    @override_settings(
+        FEDAUTH_LOGIN_STATE_STORE='fedauth.login_context.SignedLoginStateStore',
+        FEDAUTH_LOGIN_CONTEXT_TIMEOUT=60,
+    )
+    def test_signed_store_expiry(self):
+        state = save_login_context(CONTEXT)
+        with patch('time.time', return_value=time.time() + 120):
+            assert pop_login_context(state) is None
@@ -0,0 +1,73 @@
+from unittest.mock import patch
+
+import prometheus_client
+from django.test import TestCase, override_settings
+
+from fedauth.metrics import InProcessExporter, PrometheusExporter, _get_metrics_exporter, get_metrics_exporter, measure
+from tests.factories import DynamicProviderFactory, StaticProviderFactory
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        self.exporter = get_metrics_exporter()
+        self.exporter.clear()
+
+    def test_measure(self):
+        with measure('token', DynamicProviderFactory(domain='company.com')):
+            pass
+        with measure('token', StaticProviderFactory(provider='okta')) as metric:
+            metric.outcome = 'invalid'
+        with self.assertRaises(ValueError), measure('userinfo', 'okta'):
+            raise ValueError
+
+        metrics = self.exporter.snapshot()
+        assert set(metrics) == {('token', 'company.com', 'success'), ('token', 'okta', 'invalid'), ('userinfo', 'okta', 'error')}
+        histogram = metrics[('token', 'company.com', 'success')]
+        assert histogram['count'] == 1
+        assert histogram['buckets'][0] == 1  # took less than 5ms
+
+    @patch('fedauth.metrics.time.perf_counter')
+    def test_buckets(self, perf_counter):
+        perf_counter.side_effect = [0, 0.2, 0, 30]
+        with measure('token'):
+            pass
+        with measure('token'):
+            pass
+        histogram = self.exporter.snapshot()[('token', '', 'success')]
+        assert histogram['count'] == 2
+        assert histogram['sum'] == 30.2
+        assert histogram['buckets'][5] == 1  # 0.1 - 0.25
+        assert histogram['buckets'][-1] == 1  # above the largest bucket
+
+    @override_settings(FEDAUTH_METRICS_EXPORTER=None)
+    def test_disabled(self):
+        with measure('token'):
+            pass
+        assert not self.exporter.snapshot()
+
+    def test_exporter_error(self):
+        # metrics never break a login
+        with patch.object(InProcessExporter, 'observe', side_effect=RuntimeError):
+            with measure('token'):
+                pass
+
+    @override_settings(FEDAUTH_METRICS_EXPORTER='fedauth.metrics.MissingExporter')
+    def test_misconfigured_exporter(self):
+        _get_metrics_exporter.cache_clear()
+        with self.assertLogs('fedauth.metrics') as logs:
+            for _ in range(3):
+                with measure('token'):
+                    pass
+        # resolved once: a single warning, and metrics are disabled
+        assert [record.levelname for record in logs.records] == ['WARNING']
+        assert get_metrics_exporter() is None
+
+    def test_prometheus_exporter(self):
+        registry = prometheus_client.CollectorRegistry()
+        exporter = PrometheusExporter(registry=registry)
+        exporter.observe('token', 0.2, 'company.com', 'success')
+        labels = {'stage': 'token', 'provider': 'company.com', 'outcome': 'success'}
+        assert registry.get_sample_value('fedauth_stage_duration_seconds_count', labels) == 1
+        assert registry.get_sample_value('fedauth_stage_duration_seconds_bucket', {**labels, 'le': '0.25'}) == 1
+        assert registry.get_sample_value('fedauth_stage_duration_seconds_bucket', {**labels, 'le': '0.1'}) == 0
@@ -0,0 +1,80 @@
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+from django.core.cache import cache as default_cache  # to prevent fixture clash
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from fedauth import tracing
+from fedauth.jwks import jwks_cache
+from fedauth.tracing import STATE_ATTRIBUTE, get_state_hash, span
+from tests.factories import DynamicProviderFactory
+from tests.stub_idp import StubIdP
+
+FRONTEND_URL = 'www.frontend.com'
+
+
+@override_settings(
+    AUTHENTICATION_BACKENDS=['fedauth.backends.OIDCAuthenticationBackend'],
+    OIDC_REDIRECT_ALLOWED_HOSTS=[FRONTEND_URL],
+)
+class TestTracing(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.idp = StubIdP().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.idp.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        jwks_cache.clear()
+        DynamicProviderFactory(domain='company.com', **self.idp.provider_fields())
+        self.exporter = InMemorySpanExporter()
+        provider = TracerProvider()
+        provider.add_span_processor(SimpleSpanProcessor(self.exporter))
+        patcher = patch.object(trace, 'get_tracer', provider.get_tracer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        default_cache.clear()
+
+    def spans(self):
+        return {span.name: span for span in self.exporter.get_finished_spans()}
+
+    def test_login_traces_linked_by_state(self):
+        frontend = f'https://{FRONTEND_URL}'
+        resp = Client().post(f"{reverse('oidc-provider-login')}?next={frontend}&fail={frontend}", {'username': 'user@company.com'})
+        params = parse_qs(urlparse(resp.json()['auth_url']).query)
+        state = params['state'][0]
+        spans = self.spans()
+        assert {'fedauth.login', 'fedauth.provider_lookup', 'fedauth.auth_url'} <= set(spans)
+        assert spans['fedauth.auth_url'].attributes[STATE_ATTRIBUTE] == get_state_hash(state)
+        assert spans['fedauth.auth_url'].parent.span_id == spans['fedauth.login'].context.span_id
+
+        self.exporter.clear()
+        code = self.idp.authorize({'email': 'user@company.com', 'groups': []}, params['nonce'][0])
+        resp = Client().get(f"{reverse('oidc-provider-callback')}?code={code}&state={state}")
+        assert resp.url.startswith(frontend)
+        spans = self.spans()
+        assert {'fedauth.callback', 'fedauth.login_context', 'fedauth.provider_resolution', 'fedauth.idp.token',
+                'fedauth.idp.jwks', 'fedauth.idp.userinfo'} <= set(spans)
+        assert spans['fedauth.callback'].attributes[STATE_ATTRIBUTE] == get_state_hash(state)
+        assert spans['fedauth.idp.token'].attributes['fedauth.provider'] == 'company.com'
+        # the state itself isn't recorded
+        assert all(state not in str(span.attributes) for span in spans.values())
+
+    def test_no_op_without_opentelemetry(self):
+        with patch.object(tracing, 'trace', None):
+            with span('fedauth.login', state='state') as current:
+                assert current is None
+            tracing.set_span_attributes(state='state')
+        assert not self.exporter.get_finished_spans()
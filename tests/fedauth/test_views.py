@@ -2,15 +2,19 @@ from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.contrib.sessions.backends.cache import SessionStore
 from django.core.cache import cache as default_cache  # to prevent fixture clash
 from django.http import HttpResponseRedirect
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.utils.crypto import get_random_string
 
+from fedauth.jwks import jwks_cache
+from fedauth.login_context import get_login_context_key, save_login_context
+from fedauth.metrics import get_metrics_exporter
 from fedauth.views import AuthenticationCallbackView
-from tests.base import FakeRequest, FakeToken
+from tests.base import FakeRequest, FakeToken, start_login
+from tests.factories import DynamicProviderFactory
+from tests.stub_idp import StubIdP
 
 
 class TestAuthenticationCallbackView(TestCase):
@@ -32,21 +36,6 @@ class TestAuthenticationCallbackView(TestCase):
         # clear any sessions left over by tests.
         default_cache.clear()
 
-    @staticmethod
-    def create_session(key, extra_data: dict) -> None:
-        """
-        Helper to create a session.
-        :param key: the session key
-        :param extra_data: dict containing extra session context data
-        :return: None
-        """
-        session = SessionStore(key)
-        session._session_key = key
-        session.save(must_create=True)
-        for k, v in extra_data.items():
-            session[k] = v
-        session.save()
-
     def test_default_success_url_for_admin_login_callback(self):
         """
         For admin login, there is no 'next' url in session. We should instead use default login redirect url, which
@@ -86,6 +75,18 @@ class TestAuthenticationCallbackView(TestCase):
         # 'next' url should be removed from session after url is successfully crafter by success_url property
         assert not self.callback_view.request.session.get('next')
 
+    @override_settings(FEDAUTH_LAZY_TOKENS=True)
+    @mock.patch('fedauth.views.secrets.token_urlsafe')
+    @mock.patch('rest_framework_simplejwt.tokens.RefreshToken.for_user')
+    def test_success_url_lazy_tokens(self, jwt, code):
+        """
+        With lazy tokens, only the user id is cached, the tokens are minted when the code is exchanged.
+        """
+        code.return_value = 'uTOp_UWMd_4gaBwjhS1aIvvP7it95b3NoHK1xIlBrHY'
+        assert self.callback_view.success_url == f'https://some_site.com/home/?code={code.return_value}'
+        assert default_cache.get(f'auth_code:{code.return_value}') == {'user_id': self.callback_view.request.user.pk}
+        assert not jwt.called
+
     def test_failure_url_for_frontend_login_callback(self):
         """
         For frontend login, there is a 'fail' url in session, which is the redirect url.
@@ -96,38 +97,33 @@ class TestAuthenticationCallbackView(TestCase):
         # 'fail' url should be removed from session after url is successfully crafter by failure_url property
         assert not self.callback_view.request.session.get('fail')
 
-    def test_retrieve_session_by_id(self):
+    @mock.patch('fedauth.views.auth.authenticate')
+    def test_get_with_login_context(self, authenticate):
         """
-        Test that 'retrieve_session_by_id retrieves the correct session.
+        With frontend login attempts, the context of the login is stored under the state parameter. It should be
+        applied to the callback's session, and removed so that the state can't be used again.
         """
-        # create a session, and add some data
-        session_key = 'this_is_the_key'
-        data = {'test': 'data'}
-        self.create_session(session_key, data)
-        session = self.callback_view.retrieve_session_by_id(session_key)
-        assert session == data
+        authenticate.return_value = None  # login fails, the user is redirected to the 'fail' url of the context
+        state = save_login_context({'domain': 'company.com', 'nonce': 'nonce', 'fail': self.failure_url})
 
-    @mock.patch('mozilla_django_oidc.views.OIDCAuthenticationCallbackView.get')
-    def test_get_with_state_matching_session_id(self, get_method):
+        callback_url = reverse('oidc-provider-callback')
+        resp = Client().get(f'{callback_url}?code=code&state={state}')
+        assert resp.status_code == 302
+        assert resp.url == self.failure_url
+        assert resp.wsgi_request.session['domain'] == 'company.com'
+        assert authenticate.call_args.kwargs['nonce'] == 'nonce'
+        assert default_cache.get(get_login_context_key(state)) is None
+
+    @mock.patch('fedauth.views.auth.authenticate')
+    def test_get_with_login_context_error(self, authenticate):
         """
-        With frontend login attempts, the state parameter is set to equal the session id.
-        The session then should be restored.
+        When the IdP returns an error, the user is sent to the 'fail' url without authenticating.
         """
-        client = Client()
-        # mock getting a redirect from get call
-        get_method.return_value = HttpResponseRedirect(self.success_url)
-
-        # create a frontend-backend session that would have been created during initial login api from fe to be
-        fe_session_key = 'this_is_the_session_key_for_fe_session'
-        self.create_session(fe_session_key, {'data': 'extra context data'})
-
-        # during get call, the sessions should be restored
+        state = save_login_context({'domain': 'company.com', 'nonce': 'nonce', 'fail': self.failure_url})
         callback_url = reverse('oidc-provider-callback')
-        resp = client.get(f'{callback_url}?state={fe_session_key}')  # state that matched original session id
-        assert resp.status_code == 302
-        # session should now be the "restored" frontend-backend session
-        assert resp.wsgi_request.session._session_key == fe_session_key
-        assert resp.wsgi_request.session._session_cache == {'data': 'extra context data'}
+        resp = Client().get(f'{callback_url}?error=access_denied&state={state}')
+        assert resp.url == self.failure_url
+        assert not authenticate.called
 
     @mock.patch('mozilla_django_oidc.views.OIDCAuthenticationCallbackView.get')
     def test_get_with_random_state(self, get_method):
@@ -145,3 +141,115 @@ class TestAuthenticationCallbackView(TestCase):
         assert resp.status_code == 302
         # No session id, means it didn't try to restore any session.
         assert not resp.wsgi_request.session._session_key
+
+
+@override_settings(AUTHENTICATION_BACKENDS=['fedauth.backends.OIDCAuthenticationBackend'])
+class TestCallbackLogin(TestCase):
+    """
+    Full login flows against a stub IdP.
+    """
+    claims = {'email': 'user@company.com', 'given_name': 'Jane', 'family_name': 'Doe', 'groups': ['admin']}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.idp = StubIdP().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.idp.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        jwks_cache.clear()
+        self.provider = DynamicProviderFactory(domain='company.com', **self.idp.provider_fields())
+        self.requests = self.idp.requests.copy()
+
+    def tearDown(self):
+        default_cache.clear()
+
+    def login(self, claims=None):
+        state, nonce = start_login()
+        code = self.idp.authorize(claims or self.claims, nonce)
+        return Client().get(f"{reverse('oidc-provider-callback')}?code={code}&state={state}")
+
+    def idp_requests(self, path):
+        return self.idp.requests[path] - self.requests[path]
+
+    def test_login(self):
+        assert self.login().url == '/'
+        assert get_user_model().objects.get(username='user@company.com').first_name == 'Jane'
+        assert self.idp_requests('/token') == 1
+        assert self.idp_requests('/userinfo') == 1
+        assert self.idp_requests('/jwks') == 1
+
+    def test_login_es256(self):
+        with StubIdP(algorithm='ES256') as idp:
+            DynamicProviderFactory(domain='company.org', **idp.provider_fields())
+            state, nonce = start_login(domain='company.org')
+            code = idp.authorize(self.claims, nonce)
+            resp = Client().get(f"{reverse('oidc-provider-callback')}?code={code}&state={state}")
+        assert resp.url == '/'
+        assert get_user_model().objects.filter(username='user@company.com').exists()
+
+    def test_login_metrics(self):
+        exporter = get_metrics_exporter()
+        exporter.clear()
+        self.login()
+        stages = {(stage, provider, outcome) for stage, provider, outcome in exporter.snapshot()}
+        assert stages == {
+            ('token', 'company.com', 'success'),
+            ('jwks', 'company.com', 'success'),
+            ('userinfo', 'company.com', 'success'),
+            ('user_create', 'company.com', 'success'),
+        }
+
+    def test_frontend_login_with_other_user_logged_in(self):
+        # logging in flushes the browser's session of the other user, the redirect urls of the login context are kept
+        client = Client()
+        client.force_login(get_user_model().objects.create(username='other@company.com'))
+        state, nonce = start_login(extra_data={'next': 'https://some_site.com/home/'})
+        code = self.idp.authorize(self.claims, nonce)
+        resp = client.get(f"{reverse('oidc-provider-callback')}?code={code}&state={state}")
+        assert resp.url.startswith('https://some_site.com/home/?code=')
+
+    def test_state_replay(self):
+        state, nonce = start_login()
+        code = self.idp.authorize(self.claims, nonce)
+        callback_url = f"{reverse('oidc-provider-callback')}?code={code}&state={state}"
+        assert Client().get(callback_url).url == '/'
+        # the login context was removed, so the state can't be used again
+        resp = Client().get(callback_url)
+        assert resp.status_code == 302
+        assert '_auth_user_id' not in resp.wsgi_request.session
+        assert self.idp_requests('/token') == 1
+
+    @override_settings(FEDAUTH_LOGIN_STATE_STORE='fedauth.login_context.SignedLoginStateStore')
+    def test_login_signed_state(self):
+        # the login context travels in the state parameter, nothing is stored in the cache
+        with mock.patch.object(default_cache, 'set', wraps=default_cache.set) as cache_set:
+            assert self.login().url == '/'
+        assert not any(call.args[0].startswith('fedauth:login:') for call in cache_set.call_args_list)
+        assert get_user_model().objects.filter(username='user@company.com').exists()
+
+    def test_jwks_fetched_with_token(self):
+        with mock.patch.object(jwks_cache, 'refresh_in_background', wraps=jwks_cache.refresh_in_background) as prefetch:
+            self.login()
+            # keys aren't cached yet, so they are fetched while the token is requested
+            assert prefetch.call_count == 1
+            self.login()
+            assert prefetch.call_count == 1
+        assert self.idp_requests('/jwks') == 1
+
+    def test_userinfo_skipped_with_id_token_claims(self):
+        self.provider.use_id_token_claims = True
+        self.provider.save()
+        assert self.login().url == '/'
+        assert get_user_model().objects.get(username='user@company.com').is_staff
+        assert self.idp_requests('/userinfo') == 0
+
+    def test_userinfo_called_if_claims_missing(self):
+        self.provider.use_id_token_claims = True
+        self.provider.save()
+        self.login({'email': 'user@company.com'})
+        assert self.idp_requests('/userinfo') == 1
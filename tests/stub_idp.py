@@ -0,0 +1,188 @@
+"""
+Minimal OpenID provider, for tests and benchmarks. Serves the discovery, token, userinfo and JWKS endpoints on
+localhost, and signs ID tokens with a generated RS256 or ES256 key.
+
+    with StubIdP() as idp:
+        provider = DynamicProviderFactory(**idp.provider_fields())
+        code = idp.authorize({'email': 'user@company.com'}, nonce)
+        # callback?code=<code>&state=...
+
+Auth codes and access tokens carry the claims themselves, so the IdP keeps no state, and can be run in a separate
+process (see 'start_process') to keep it from competing with the code under test for the GIL.
+"""
+import base64
+import json
+import multiprocessing
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+KEY_ID = 'stub-key'
+
+
+class StubIdPHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so that connection pooling can be measured
+    disable_nagle_algorithm = True  # headers and body are written separately, don't delay the body
+    idp = None
+
+    def log_message(self, format, *args):  # noqa
+        pass
+
+    def send_json(self, data, status=200, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):  # noqa
+        self.idp.handle(self)
+
+    def do_POST(self):  # noqa
+        self.idp.handle(self)
+
+
+class StubIdPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # accept many concurrent connections (benchmarks)
+
+
+class StubIdP:
+
+    def __init__(self, latency=0.0, algorithm='RS256'):
+        """
+        :param latency: seconds every response is delayed with, to simulate the round trip to a remote IdP
+        :param algorithm: ID token signing algorithm, 'RS256' or 'ES256'
+        """
+        self.latency = latency
+        self.algorithm = algorithm
+        if algorithm == 'RS256':
+            self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+            self.jwk = jwt.algorithms.RSAAlgorithm.to_jwk(self.private_key.public_key(), as_dict=True)
+        elif algorithm == 'ES256':
+            self.private_key = ec.generate_private_key(ec.SECP256R1())
+            self.jwk = jwt.algorithms.ECAlgorithm.to_jwk(self.private_key.public_key(), as_dict=True)
+        else:
+            raise ValueError(f'Unsupported algorithm: {algorithm}')
+        self.jwk.update({'kid': KEY_ID, 'alg': algorithm, 'use': 'sig'})
+        self.requests = Counter()  # path -> number of requests (only counted when running in this process)
+        self._lock = threading.Lock()
+        handler = type('Handler', (StubIdPHandler,), {'idp': self})
+        self.server = StubIdPServer(('127.0.0.1', 0), handler)
+        self._thread = None
+        self._process = None
+
+    @property
+    def issuer(self):
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='stub-idp', daemon=True)
+        self._thread.start()
+        return self
+
+    def start_process(self):
+        """
+        Serve from a forked process instead of a thread.
+        """
+        self._process = multiprocessing.get_context('fork').Process(target=self.server.serve_forever, daemon=True)
+        self._process.start()
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+        else:
+            self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def provider_fields(self) -> dict:
+        return {
+            'auth_endpoint': f'{self.issuer}/auth',
+            'token_endpoint': f'{self.issuer}/token',
+            'user_endpoint': f'{self.issuer}/userinfo',
+            'jwks_endpoint': f'{self.issuer}/jwks',
+            'sign_algo': self.algorithm,
+        }
+
+    @staticmethod
+    def encode(data) -> str:
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+    @staticmethod
+    def decode(value: str):
+        try:
+            return json.loads(base64.urlsafe_b64decode(value.encode()))
+        except ValueError:
+            return None
+
+    def authorize(self, claims: dict, nonce: str) -> str:
+        """
+        Return an auth code for a user that logged in at the IdP.
+        """
+        return self.encode({'claims': claims, 'nonce': nonce})
+
+    def handle(self, request):
+        path = request.path.split('?')[0]
+        with self._lock:
+            self.requests[path] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        handler = {
+            '/.well-known/openid-configuration': self.discovery,
+            '/token': self.token,
+            '/userinfo': self.userinfo,
+            '/jwks': self.jwks,
+        }.get(path)
+        if handler is None:
+            return request.send_json({'error': 'not_found'}, status=404)
+        return handler(request)
+
+    def discovery(self, request):
+        request.send_json({
+            'issuer': self.issuer,
+            'authorization_endpoint': f'{self.issuer}/auth',
+            'token_endpoint': f'{self.issuer}/token',
+            'userinfo_endpoint': f'{self.issuer}/userinfo',
+            'jwks_uri': f'{self.issuer}/jwks',
+        })
+
+    def token(self, request):
+        body = request.rfile.read(int(request.headers.get('Content-Length', 0))).decode()
+        data = {name: values[0] for name, values in parse_qs(body).items()}
+        code = self.decode(data.get('code', ''))
+        if not code:
+            return request.send_json({'error': 'invalid_grant'}, status=400)
+
+        claims, now = code['claims'], int(time.time())
+        id_token = jwt.encode(
+            {**claims, 'iss': self.issuer, 'aud': data.get('client_id'), 'nonce': code['nonce'], 'iat': now, 'exp': now + 300},
+            self.private_key,
+            algorithm=self.algorithm,
+            headers={'kid': KEY_ID},
+        )
+        request.send_json({'id_token': id_token, 'access_token': self.encode(claims), 'token_type': 'Bearer'})
+
+    def userinfo(self, request):
+        claims = self.decode(request.headers.get('Authorization', '').removeprefix('Bearer '))
+        if not claims:
+            return request.send_json({'error': 'invalid_token'}, status=401)
+        request.send_json(claims)
+
+    def jwks(self, request):
+        request.send_json({'keys': [self.jwk]}, headers={'Cache-Control': 'public, max-age=3600'})